@@ -3,137 +3,187 @@ import os
 import tempfile
 from pathlib import Path
 from datetime import datetime
-from document_analyzer import DocumentAnalyzer
+from document_analyzer import DocumentAnalyzer, QUOTA_ERRORS
+import jobs
+
+JOB_KINDS = {"analisis": "Análisis del documento", "precedentes": "Búsqueda de precedentes"}
+
+def job_status(job):
+    """Markdown con el estado, la etapa y el avance de un trabajo de jobs.py"""
+    label = JOB_KINDS.get(job['kind'], job['kind'])
+    header = f"**{label}** · trabajo `{job['id']}`"
+    if job['status'] == "queued":
+        ahead = job.get('position', 0)
+        return f"🕒 {header}\n\nEn cola ({ahead} trabajo(s) antes). Guarda el ID para consultar el resultado más tarde."
+    if job['status'] == "running":
+        filled = int(job['progress'] * 20)
+        bar = "█" * filled + "░" * (20 - filled)
+        return f"⏳ {header}\n\n{job['stage'] or ''}\n\n`{bar}` {job['progress']:.0%}"
+    if job['status'] == "done":
+        return f"✅ {header}\n\nCompletado."
+    if job['status'] == "interrupted":
+        return f"⚠️ {header}\n\nEl trabajo se interrumpió ({job['error']}). Vuelve a enviarlo."
+    return f"❌ Error: {job['error']}"
+
+def render_precedents(groups):
+    """HTML de los precedentes agrupados por argumento"""
+    total = sum(len(g['precedents']) for g in groups)
+    if not total:
+        precedents_html = """
+        <div class="precedents-container">
+            <h3>📚 PRECEDENTES RELACIONADOS</h3>
+            <p><strong>✅ Análisis completado</strong></p>
+            <p><strong>Criterio de búsqueda:</strong> Una búsqueda por cada argumento jurídico</p>
+            <p><strong>Filtro inteligente:</strong> El modelo evalúa y muestra solo precedentes con relación jurídica real (Alta, Media o Baja)</p>
+            <p><em>❌ No se encontraron precedentes con relación jurídica significativa.</em></p>
+        </div>
+        """
+    else:
+        precedents_html = """
+        <div class="precedents-container">
+            <h3>📚 PRECEDENTES RELACIONADOS</h3>
+            <p><strong>✅ Análisis completado</strong></p>
+            <p><strong>Criterio de búsqueda:</strong> Una búsqueda por cada argumento jurídico, sin precedentes repetidos entre argumentos</p>
+            <p><strong>Filtro inteligente:</strong> El modelo evalúa y muestra solo precedentes con relación jurídica real</p>
+            <hr>
+        """
+        
+        i = 0
+        for group in groups:
+            title = f"Argumento {group['numero']}: {group['titulo']}" if group['numero'] else group['titulo']
+            precedents_html += f"<h4>⚖️ {title}</h4>"
+            if not group['precedents']:
+                precedents_html += "<p><em>Sin precedentes con relación jurídica significativa.</em></p><hr>"
+            for precedent in group['precedents']:
+                i += 1
+                # Truncar contenido para mejor legibilidad
+                content_preview = precedent['document'][:200].replace('\n', ' ')
+                if len(precedent['document']) > 200:
+                    content_preview += "..."
+                
+                relation_level = precedent.get('relation_level', 'NO DETERMINADO')
+                relation_justification = precedent.get('relation_justification', 'Justificación no disponible')
+                
+                # Color según nivel de relación
+                level_color = {
+                    'ALTA': '#28a745',  # Verde
+                    'MEDIA': '#ffc107',  # Amarillo
+                    'BAJA': '#fd7e14'   # Naranja
+                }.get(relation_level, '#6c757d')
+                
+                precedents_html += f"""
+                <div class="precedent-item">
+                    <h4>🔍 Precedente {i}</h4>
+                    <p><strong>📊 Nivel de relación:</strong> <span class="relation-level" style="background-color: {level_color}; color: white; padding: 3px 8px; border-radius: 4px; font-weight: bold;">{relation_level}</span></p>
+                    <p><strong>📄 Fuente:</strong> {precedent['source']}</p>
+                    <p><strong>🔗 Justificación de la relación (argumento/precedente):</strong></p>
+                    <p style="font-style: italic; background-color: #f8f9fa; padding: 10px; border-left: 4px solid #007bff; margin: 10px 0;"><em>{relation_justification}</em></p>
+                    <p><strong>📝 Contenido:</strong> <em>{content_preview}</em></p>
+                </div>
+                <hr>
+                """
+        
+        precedents_html += "</div>"
+    return precedents_html
 
 def create_analysis_interface(gemini_api_key: str, qdrant_url: str, qdrant_api_key: str):
     """Crea la interfaz de análisis de documentos"""
     
     # Inicializar el analizador
     analyzer = DocumentAnalyzer(gemini_api_key, qdrant_url, qdrant_api_key)
+    # Análisis y precedentes corren como trabajos en segundo plano (jobs.py)
+    queue = jobs.default_queue()
     
-    def analyze_uploaded_document(file, progress=gr.Progress()):
-        """Analiza el documento subido"""
-        if file is None:
-            return "❌ Error: No se ha subido ningún archivo", "", "", gr.update(visible=False), gr.update(visible=False)
-        
-        try:
-            # Mostrar progreso inicial
-            progress(0.1, desc="Extrayendo texto del PDF...ya casi EUREKA")
-            
-            # Analizar el documento
-            result = analyzer.analyze_document(file.name)
-            
+    def _analysis_job(path):
+        def run(on_stage):
+            result = analyzer.analyze_document(path, on_stage=on_stage)
             if not result['success']:
-                return f"❌ Error: {result['error']}", "", "", gr.update(visible=False), gr.update(visible=False)
-            
-            # Progreso de generación de resúmenes
-            progress(0.7, desc="Generando resúmenes con IA...ya casi EUREKA")
-            
-            # Simular progreso gradual
-            import time
-            time.sleep(1)
-            
-            progress(1.0, desc="¡EUREKA! Análisis completado")
-            
-            status_final = "✅ **Documento analizado exitosamente!** \n\n✏️ Puedes editar los resúmenes si lo deseas antes de buscar precedentes."
-            facts = result['facts_summary']
-            legal = result['legal_summary']
-            
-            # Mostrar botón de análisis de precedentes y área de precedentes
-            return status_final, facts, legal, gr.update(visible=True), gr.update(visible=True)
-            
-        except Exception as e:
-            return f"❌ Error inesperado: {str(e)}", "", "", gr.update(visible=False), gr.update(visible=False)
+                raise RuntimeError(result['error'])
+            # Solo se guarda lo que muestra la pestaña (no el texto completo del PDF)
+            return {'facts_summary': result['facts_summary'], 'legal_summary': result['legal_summary']}
+        return run
+    
+    def _precedents_job(legal_text):
+        def run(on_stage):
+            # Un embedding por argumento (en lote), una búsqueda y calificación en paralelo
+            try:
+                groups = analyzer.search_precedents_by_argument(legal_text, on_stage=on_stage)
+            except QUOTA_ERRORS as e:
+                raise RuntimeError(f"Sin cuota de Gemini para buscar precedentes ({e}). Intente de nuevo más tarde.") from e
+            return {'legal_summary': legal_text, 'groups': groups}
+        return run
+    
+    def submit_analysis(file, request: gr.Request = None):
+        """Encola el análisis del documento subido y vuelve de inmediato con el ID del trabajo"""
+        if file is None:
+            return "", "❌ Error: No se ha subido ningún archivo", gr.update(visible=False), gr.update(visible=False), gr.Timer(active=False)
+        path = getattr(file, 'name', file)
+        job_id = queue.submit("analisis", _analysis_job(path), owner=getattr(request, 'session_hash', None),
+                              params={'document': Path(path).name})
+        return job_id, job_status(queue.get(job_id)), gr.update(visible=False), gr.update(visible=False), gr.Timer(active=True)
     
-    def search_precedents_action(file, facts_text, legal_text, progress=gr.Progress()):
-        """Busca precedentes relacionados basándose en argumentos jurídicos"""
+    def submit_precedents(file, facts_text, legal_text, request: gr.Request = None):
+        """Encola la búsqueda de precedentes con los argumentos jurídicos (editados o no)"""
         if file is None:
-            return "❌ Error: No hay documento para analizar precedentes", gr.update(visible=False)
+            return "", "❌ Error: No hay documento para analizar precedentes", gr.update(visible=False), gr.Timer(active=False)
         
         if not legal_text or legal_text.strip() == "":
-            return "❌ Error: Primero debe generar los argumentos jurídicos para buscar precedentes", gr.update(visible=False)
+            return "", "❌ Error: Primero debe generar los argumentos jurídicos para buscar precedentes", gr.update(visible=False), gr.Timer(active=False)
         
-        try:
-            # Progreso inicial
-            progress(0.1, desc="Generando embeddings de argumentos jurídicos...")
-            
-            import time
-            time.sleep(1)
-            
-            # Progreso búsqueda
-            progress(0.4, desc="Buscando en base de datos vectorial...")
-            time.sleep(1)
-            
-            # Progreso filtrado IA
-            progress(0.7, desc="Filtrado inteligente con IA...ya casi EUREKA")
-            
-            # Buscar precedentes basándose en argumentos jurídicos
-            precedents = analyzer.search_precedents(legal_text, limit=20)
-            
-            progress(1.0, desc="¡EUREKA! Precedentes analizados")
-            
-            if not precedents:
-                precedents_html = """
+        job_id = queue.submit("precedentes", _precedents_job(legal_text), owner=getattr(request, 'session_hash', None),
+                              params={'document': Path(getattr(file, 'name', file)).name})
+        return job_id, job_status(queue.get(job_id)), gr.update(visible=False), gr.Timer(active=True)
+    
+    def poll_job(job_id):
+        """
+        Estado del trabajo en curso (lo llama el temporizador de la pestaña).
+        Al terminar, llena los resúmenes o los precedentes una sola vez y
+        detiene el temporizador.
+        Salidas: job_id, estado, hechos, argumentos, botón de precedentes, precedentes, temporizador
+        y el ID del último trabajo de precedentes terminado (de ahí toma sus precedentes el reporte PDF).
+        """
+        unchanged = gr.update()
+        if not job_id:
+            return "", unchanged, unchanged, unchanged, unchanged, unchanged, gr.Timer(active=False), unchanged
+        
+        job = queue.get(job_id)
+        if job is None:
+            return ("", f"❌ Error: No existe el trabajo `{job_id}`", unchanged, unchanged, unchanged, unchanged,
+                    gr.Timer(active=False), unchanged)
+        
+        if job['status'] not in jobs.FINISHED:
+            return job_id, job_status(job), unchanged, unchanged, unchanged, unchanged, unchanged, unchanged
+        
+        if job['status'] != 'done':
+            if job['kind'] == "precedentes":
+                error_html = f"""
                 <div class="precedents-container">
-                    <h3>📚 PRECEDENTES RELACIONADOS</h3>
-                    <p><strong>✅ Análisis completado</strong></p>
-                    <p><strong>Criterio de búsqueda:</strong> Basado en argumentos jurídicos únicamente</p>
-                    <p><strong>Filtro inteligente:</strong> El modelo evalúa y muestra solo precedentes con relación jurídica real (Alta, Media o Baja)</p>
-                    <p><em>❌ No se encontraron precedentes con relación jurídica significativa.</em></p>
+                    <h3>❌ ERROR EN ANÁLISIS</h3>
+                    <p><strong>Error:</strong> {job['error']}</p>
                 </div>
                 """
-            else:
-                precedents_html = """
-                <div class="precedents-container">
-                    <h3>📚 PRECEDENTES RELACIONADOS</h3>
-                    <p><strong>✅ Análisis completado</strong></p>
-                    <p><strong>Criterio de búsqueda:</strong> Basado en argumentos jurídicos únicamente para mayor precisión</p>
-                    <p><strong>Filtro inteligente:</strong> El modelo evalúa y muestra solo precedentes con relación jurídica real</p>
-                    <hr>
-                """
-                
-                for i, precedent in enumerate(precedents, 1):
-                    # Truncar contenido para mejor legibilidad
-                    content_preview = precedent['document'][:200].replace('\n', ' ')
-                    if len(precedent['document']) > 200:
-                        content_preview += "..."
-                    
-                    relation_level = precedent.get('relation_level', 'NO DETERMINADO')
-                    relation_justification = precedent.get('relation_justification', 'Justificación no disponible')
-                    
-                    # Color según nivel de relación
-                    level_color = {
-                        'ALTA': '#28a745',  # Verde
-                        'MEDIA': '#ffc107',  # Amarillo
-                        'BAJA': '#fd7e14'   # Naranja
-                    }.get(relation_level, '#6c757d')
-                    
-                    precedents_html += f"""
-                    <div class="precedent-item">
-                        <h4>🔍 Precedente {i}</h4>
-                        <p><strong>📊 Nivel de relación:</strong> <span class="relation-level" style="background-color: {level_color}; color: white; padding: 3px 8px; border-radius: 4px; font-weight: bold;">{relation_level}</span></p>
-                        <p><strong>📄 Fuente:</strong> {precedent['source']}</p>
-                        <p><strong>🔗 Justificación de la relación (argumento/precedente):</strong></p>
-                        <p style="font-style: italic; background-color: #f8f9fa; padding: 10px; border-left: 4px solid #007bff; margin: 10px 0;"><em>{relation_justification}</em></p>
-                        <p><strong>📝 Contenido:</strong> <em>{content_preview}</em></p>
-                    </div>
-                    <hr>
-                    """
-                
-                precedents_html += "</div>"
-            
-            return precedents_html, gr.update(visible=True)
-            
-        except Exception as e:
-            error_html = f"""
-            <div class="precedents-container">
-                <h3>❌ ERROR EN ANÁLISIS</h3>
-                <p><strong>Error:</strong> {str(e)}</p>
-            </div>
-            """
-            return error_html, gr.update(visible=False)
+                return ("", job_status(job), unchanged, unchanged, unchanged, gr.update(value=error_html, visible=True),
+                        gr.Timer(active=False), unchanged)
+            return ("", job_status(job), "", "", gr.update(visible=False), gr.update(visible=False),
+                    gr.Timer(active=False), unchanged)
+        
+        result = job['result']
+        if job['kind'] == "precedentes":
+            return ("", f"✅ **Precedentes analizados** (trabajo `{job_id}`)", unchanged, unchanged, gr.update(visible=True),
+                    gr.update(value=render_precedents(result['groups']), visible=True), gr.Timer(active=False), job_id)
+        
+        status_final = (f"✅ **Documento analizado exitosamente!** (trabajo `{job_id}`)\n\n"
+                        "✏️ Puedes editar los resúmenes si lo deseas antes de buscar precedentes.")
+        # Mostrar botón de análisis de precedentes y área de precedentes
+        return ("", status_final, result['facts_summary'], result['legal_summary'],
+                gr.update(visible=True), gr.update(visible=True), gr.Timer(active=False), unchanged)
+    
+    def lookup_job(job_id):
+        """Retoma un trabajo por su ID (p. ej. después de cerrar la pestaña)"""
+        job_id = (job_id or "").strip()
+        return job_id, gr.Timer(active=bool(job_id))
     
-    def generate_pdf_report(file, facts_text, legal_text, precedents_text, progress=gr.Progress()):
+    def generate_pdf_report(file, facts_text, legal_text, precedents_text, precedents_job_id="", progress=gr.Progress()):
         """Genera y descarga el reporte PDF"""
         if file is None:
             return None, "❌ Error: No hay documento para generar reporte"
@@ -158,8 +208,14 @@ def create_analysis_interface(gemini_api_key: str, qdrant_url: str, qdrant_api_k
             # Buscar precedentes si no están disponibles
             precedents = []
             if precedents_text and "PRECEDENTES RELACIONADOS" in precedents_text:
-                # Extraer precedentes basándose en argumentos jurídicos (ya filtrados por el modelo)
-                precedents = analyzer.search_precedents(legal_text, limit=20)
+                # Precedentes ya calificados, del resultado guardado del trabajo;
+                # si los argumentos cambiaron desde la búsqueda, se buscan de nuevo
+                job = queue.get(precedents_job_id) if precedents_job_id else None
+                if job and job['status'] == 'done' and job['result']['legal_summary'] == legal_text:
+                    groups = job['result']['groups']
+                else:
+                    groups = analyzer.search_precedents_by_argument(legal_text)
+                precedents = [p for g in groups for p in g['precedents']]
             
             progress(0.6, desc="Generando documento PDF...")
             
@@ -185,7 +241,7 @@ principios jurídicos y conclusiones legales."""
                 facts_prompt=facts_prompt,
                 legal_prompt=legal_prompt,
                 output_path=output_path,
-                search_note="La búsqueda de precedentes se realizó basándose únicamente en los argumentos jurídicos para mayor precisión."
+                search_note="La búsqueda de precedentes se realizó por separado para cada argumento jurídico, sin repetir precedentes entre argumentos."
             )
             
             progress(1.0, desc="¡EUREKA! Reporte PDF completado")
@@ -294,6 +350,16 @@ principios jurídicos y conclusiones legales."""
                 
                 # Estado del análisis
                 status_text = gr.Markdown("")
+            
+            with gr.Column(scale=1):
+                # Trabajos anteriores: el resultado queda guardado por ID
+                job_lookup = gr.Textbox(label="🔎 Consultar trabajo por ID", placeholder="ID del trabajo...")
+                lookup_btn = gr.Button("Consultar", variant="secondary")
+        
+        # Trabajo en seguimiento y temporizador que consulta su avance
+        job_state = gr.State("")
+        precedents_job_state = gr.State("")
+        job_timer = gr.Timer(2.0, active=False)
         
         # Resúmenes editables
         with gr.Row():
@@ -338,24 +404,33 @@ principios jurídicos y conclusiones legales."""
                 download_status = gr.Markdown("")
                 pdf_output = gr.File(label="Descargar Reporte", visible=False)
         
-        # Eventos con Progress tracking
+        # Eventos: análisis y precedentes se encolan y el temporizador informa el avance
+        poll_outputs = [job_state, status_text, facts_summary, legal_summary, precedents_btn, precedents_area, job_timer,
+                        precedents_job_state]
+        
         analyze_btn.click(
-            analyze_uploaded_document,
+            submit_analysis,
             inputs=[file_upload],
-            outputs=[status_text, facts_summary, legal_summary, precedents_btn, precedents_area],
-            show_progress="full"  # Agregar para mostrar la barra de progreso
+            outputs=[job_state, status_text, precedents_btn, precedents_area, job_timer]
         )
         
         precedents_btn.click(
-            search_precedents_action,
+            submit_precedents,
             inputs=[file_upload, facts_summary, legal_summary],
-            outputs=[precedents_area, precedents_area],
-            show_progress="full"  # Agregar para mostrar la barra de progreso
+            outputs=[job_state, status_text, precedents_area, job_timer]
         )
         
+        job_timer.tick(poll_job, inputs=[job_state], outputs=poll_outputs, show_progress="hidden")
+        
+        lookup_btn.click(
+            lookup_job,
+            inputs=[job_lookup],
+            outputs=[job_state, job_timer]
+        ).then(poll_job, inputs=[job_state], outputs=poll_outputs)
+        
         download_btn.click(
             generate_pdf_report,
-            inputs=[file_upload, facts_summary, legal_summary, precedents_area],
+            inputs=[file_upload, facts_summary, legal_summary, precedents_area, precedents_job_state],
             outputs=[pdf_output, download_status],
             show_progress="full"  # Agregar para mostrar la barra de progreso
         ).then(
@@ -364,6 +439,14 @@ principios jurídicos y conclusiones legales."""
             outputs=[pdf_output, download_status]
         )
     
+    # Handlers de los eventos, para ejercitarlos sin la UI (bench/load_test.py)
+    analysis_interface.handlers = {
+        "analyze": submit_analysis,
+        "precedents": submit_precedents,
+        "poll": poll_job,
+        "report": generate_pdf_report,
+        "queue": queue,
+    }
     return analysis_interface
 
 def create_analysis_tab(gemini_api_key: str, qdrant_url: str, qdrant_api_key: str):
@@ -3,9 +3,10 @@ import mimetypes
 from pathlib import Path
 import gradio as gr
 import os
-from rag_chain import answer, GOODBYE_RE
+from rag_chain import answer, start_background_init, GOODBYE_RE
 from analysis_interface import create_analysis_tab
 from auth_layer import AuthManager
+import metrics
 
 ORG = "#284293"  # azul CGR
 SUGERENCIA_HTML = (
@@ -84,8 +85,13 @@ body, .gradio-container {{ background:white; font-family:'Poppins',sans-serif; }
 
 # Inicializar el gestor de autenticación
 auth_manager = AuthManager()
+metrics.REGISTRY.register_collector(auth_manager.usage_families)
 
-def chat_fn(msg, hist, user_code):
+# Sincronizar el índice con Drive en segundo plano desde el arranque:
+# las consultas no esperan la ingestión y usan lo ya indexado
+start_background_init()
+
+def chat_fn(msg, hist, user_code, request: gr.Request = None):
     # Verificar permisos antes de procesar
     can_query, permission_msg = auth_manager.check_query_permission(user_code)
     if not can_query:
@@ -103,8 +109,11 @@ def chat_fn(msg, hist, user_code):
     
     try:
         # Registrar la consulta antes de procesarla
-        auth_manager.record_query(user_code)
-        resp, _ = answer(msg, k=10)
+        if auth_manager.record_query(user_code):
+            # La sesión de Gradio identifica la conversación (memoria de seguimientos)
+            resp, _ = answer(msg, k=10, session_id=request.session_hash if request else None)
+        else:
+            resp = f"❌ Límite diario alcanzado ({auth_manager.daily_limit} consultas)"
     except Exception as e:
         print(f"Error en chat_fn: {e}")
         resp = "⚠️ Ocurrió un error procesando su consulta. Por favor, intente de nuevo."
@@ -115,6 +124,7 @@ def chat_fn(msg, hist, user_code):
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 QDRANT_URL = os.getenv("QDRANT_URL")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
+VECTOR_BACKEND = (os.getenv("VECTOR_BACKEND") or "qdrant").strip().lower()
 
 with gr.Blocks(css=CSS, title="RAG | Resoluciones DJ") as demo:
     # Estado para almacenar el código de usuario autenticado
@@ -138,7 +148,7 @@ with gr.Blocks(css=CSS, title="RAG | Resoluciones DJ") as demo:
             
             # Nueva pestaña de análisis de documentos
             with gr.TabItem("📄 Análisis de Documento"):
-                if GEMINI_API_KEY and QDRANT_URL and QDRANT_API_KEY:
+                if GEMINI_API_KEY and (VECTOR_BACKEND == "local" or (QDRANT_URL and QDRANT_API_KEY)):
                     analysis_interface = create_analysis_tab(GEMINI_API_KEY, QDRANT_URL, QDRANT_API_KEY)
                 else:
                     gr.Markdown("""
@@ -165,4 +175,17 @@ with gr.Blocks(css=CSS, title="RAG | Resoluciones DJ") as demo:
     )
 
 if __name__ == "__main__":
-    demo.launch(server_name="0.0.0.0", pwa=True, server_port=int(os.environ.get('PORT', 8080)))
+    # Gradio montado en FastAPI para servir /metrics (Prometheus) en el mismo puerto
+    import uvicorn
+    from fastapi import FastAPI, Request, Response
+
+    server = FastAPI()
+
+    @server.get("/metrics")
+    def metrics_endpoint(request: Request):
+        if not metrics.authorized(request.headers.get("authorization")):
+            return Response(status_code=401)
+        return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+    server = gr.mount_gradio_app(server, demo, path="/", pwa=True)
+    uvicorn.run(server, host="0.0.0.0", port=int(os.environ.get('PORT', 8080)))
@@ -1,9 +1,8 @@
 import os
-import json
-from datetime import datetime, timedelta
-from pathlib import Path
 import gradio as gr
 
+from usage_store import UsageCounter
+
 class AuthManager:
     def __init__(self):
         # Obtener códigos de acceso desde variable de entorno
@@ -11,39 +10,10 @@ class AuthManager:
         self.unlimited_code = "5424"
         self.daily_limit = 2
         
-        # Archivo para almacenar el uso diario
-        self.usage_file = Path("daily_usage.json")
+        # Contador de uso diario (SQLite compartido entre workers; ver usage_store.py)
+        self.usage = UsageCounter()
         self.authenticated_sessions = set()
         
-    def load_daily_usage(self):
-        """Cargar el uso diario desde archivo"""
-        if not self.usage_file.exists():
-            return {}
-        
-        try:
-            with open(self.usage_file, 'r') as f:
-                data = json.load(f)
-            
-            # Limpiar datos de días anteriores
-            today = datetime.now().strftime("%Y-%m-%d")
-            if today not in data:
-                data = {today: {}}
-            else:
-                # Mantener solo los datos de hoy
-                data = {today: data.get(today, {})}
-                
-            return data
-        except:
-            return {}
-    
-    def save_daily_usage(self, usage_data):
-        """Guardar el uso diario en archivo"""
-        try:
-            with open(self.usage_file, 'w') as f:
-                json.dump(usage_data, f)
-        except:
-            pass
-    
     def validate_code(self, code):
         """Validar el código de acceso"""
         return code.strip() in self.access_codes
@@ -57,33 +27,33 @@ class AuthManager:
         if code.strip() == self.unlimited_code:
             return True, "Acceso ilimitado"
         
-        # Verificar límite diario para otros códigos
-        usage_data = self.load_daily_usage()
-        today = datetime.now().strftime("%Y-%m-%d")
-        
-        if today not in usage_data:
-            usage_data[today] = {}
-        
-        current_usage = usage_data[today].get(code.strip(), 0)
+        # Verificar límite diario para otros códigos (desde memoria)
+        current_usage = self.usage.peek(code.strip())
         
         if current_usage >= self.daily_limit:
             return False, f"Límite diario alcanzado ({self.daily_limit} consultas)"
         
         return True, f"Consultas restantes: {self.daily_limit - current_usage}"
     
+    def usage_families(self):
+        """Consultas del día por código para /metrics (colector de metrics.REGISTRY).
+        Los códigos se publican por posición en ACCESO_CODIGO, nunca el código mismo."""
+        samples = []
+        for i, code in enumerate(self.access_codes, start=1):
+            code = code.strip()
+            samples.append(({"code_id": str(i), "unlimited": str(code == self.unlimited_code).lower()},
+                            self.usage.peek(code, track=False)))
+        yield ("rag_usage_queries_today", "gauge", "Consultas del día por código de acceso", samples)
+        yield ("rag_usage_daily_limit", "gauge", "Límite diario de consultas por código", [({}, self.daily_limit)])
+    
     def record_query(self, code):
-        """Registrar una consulta realizada"""
+        """Registrar una consulta realizada; False si el código ya agotó su límite diario"""
         if code.strip() == self.unlimited_code:
-            return  # No registrar para código ilimitado
-        
-        usage_data = self.load_daily_usage()
-        today = datetime.now().strftime("%Y-%m-%d")
-        
-        if today not in usage_data:
-            usage_data[today] = {}
+            self.usage.consume(code.strip())  # sin límite: se acumula y se escribe en diferido
+            return True
         
-        usage_data[today][code.strip()] = usage_data[today].get(code.strip(), 0) + 1
-        self.save_daily_usage(usage_data)
+        # Reserva atómica: dos workers no pueden pasarse del límite
+        return self.usage.consume(code.strip(), limit=self.daily_limit) is not None
     
     def create_auth_interface(self):
         """Crear la interfaz de autenticación"""
@@ -0,0 +1,103 @@
+# bench/bench_metadata.py
+# Micro-benchmark de extracción de metadatos sobre resoluciones reales.
+# Compara la versión anterior de ingest.py (cuatro búsquedas + sancion_a_tipo
+# recompilando patrones) con metadata_extractor.extract_metadata y verifica que
+# ambas den los mismos campos.
+#
+# Uso:  python bench/bench_metadata.py [carpeta_pdfs] [--repeat N]
+from __future__ import annotations
+import re
+import sys
+import time
+import argparse
+import statistics
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ingestion import load_pdf_pages  # noqa: E402
+from metadata_extractor import (  # noqa: E402
+    extract_metadata, res_regex, int_regex, pa_regex, TIPO_PATTERNS,
+)
+
+# ── Implementación anterior (referencia) ─────────
+_legacy_sancion_regex = re.compile(
+    r"(separaci[oó]n del cargo[^\n]*?|despido[^\n]*?responsabilidad[^\n]*?|"
+    r"suspensi[oó]n[^\n]*?(d[ií]as|meses|años)|inhabilitaci[oó]n[^\n]*?años?|"
+    r"prohibici[oó]n de ingreso[^\n]*?|multa[^\n]*?¢[\d\.]+|archivo)",
+    re.IGNORECASE | re.DOTALL
+)
+
+
+def legacy_sancion_a_tipo(s):
+    if not s:
+        return None
+    low = s.lower()
+    for tipo, patt in TIPO_PATTERNS.items():
+        if re.search(patt, low, re.I):
+            return tipo
+    return None
+
+
+def legacy_metadata(text: str) -> dict:
+    meta = {}
+    if m := res_regex.search(text):
+        meta["resolucion"] = m.group()
+    if m := int_regex.search(text):
+        meta["interno"] = m.group()
+    if m := pa_regex.search(text):
+        meta["pa"] = m.group()
+    if m := _legacy_sancion_regex.search(text):
+        meta["sancion"] = " ".join(m.group().split())
+        # antes se llamaba tres veces por chunk en el ciclo de indexación
+        meta["tipo"] = legacy_sancion_a_tipo(meta["sancion"])
+    return meta
+
+
+def _time(fn, arg, repeat: int) -> float:
+    runs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(arg)
+        runs.append(time.perf_counter() - t0)
+    return statistics.median(runs) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("folder", nargs="?", default="pdfs")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    pdfs = sorted(Path(args.folder).glob("*.pdf"))
+    if not pdfs:
+        print(f"No hay PDFs en {args.folder}")
+        return
+
+    legacy_ms, new_ms, mismatches = [], [], 0
+    for pdf in pdfs:
+        try:
+            pages = load_pdf_pages(pdf)
+        except Exception as e:
+            print(f"⚠️ {pdf.name}: {e}")
+            continue
+        text = "\n".join(pages)
+        old, new = legacy_metadata(text), extract_metadata(pages)
+        if old != new:
+            mismatches += 1
+            print(f"≠ {pdf.name}: antes={old} ahora={new}")
+        legacy_ms.append(_time(legacy_metadata, text, args.repeat))
+        new_ms.append(_time(extract_metadata, pages, args.repeat))
+
+    if not new_ms:
+        return
+    total_old, total_new = sum(legacy_ms), sum(new_ms)
+    print(f"Documentos: {len(new_ms)}  (diferencias: {mismatches})")
+    print(f"Anterior : {total_old:8.1f} ms total | {statistics.median(legacy_ms):.2f} ms mediana/doc")
+    print(f"Una pasada: {total_new:8.1f} ms total | {statistics.median(new_ms):.2f} ms mediana/doc")
+    if total_new:
+        print(f"Aceleración: x{total_old / total_new:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+# bench/bench_offline.py
+# Benchmarks de los caminos críticos sin red (ni Gemini, ni Qdrant, ni Drive):
+#   - chunking: split_pages sobre el corpus sintético
+#   - metadatos: extract_metadata, con verificación de los valores esperados
+#   - ingestión: IngestionEngine → VectorStoreSink(LocalVectorStore) con
+#     HashingEmbedder como embed_fn (el costo del embedding falso se informa
+#     aparte y se descuenta)
+#   - búsqueda: latencia p50/p95/p99 de LocalVectorStore.search con 10k, 100k
+#     y 1M chunks (los vectores de relleno son chunks reales con ruido)
+#   - memoria: RSS actual/pico del proceso tras cada etapa y bytes en disco
+# Los resultados se guardan en JSON; con --baseline se comparan contra una
+# corrida anterior y se sale con código 1 si alguna métrica empeora más que
+# --tolerance (claves *_ms y *_mb: más bajo es mejor; *_per_s: más alto).
+#
+# Uso:  python bench/bench_offline.py [--docs 300] [--sizes 10000,100000,1000000]
+#                                     [--queries 200] [--index brute|hnsw]
+#                                     [--out bench_offline.json] [--baseline anterior.json]
+from __future__ import annotations
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import contextlib
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import numpy as np  # noqa: E402
+
+from ingestion import ChunkingConfig, IngestionEngine, SourceDocument, VectorStoreSink, split_pages  # noqa: E402
+from metadata_extractor import extract_metadata  # noqa: E402
+from rate_control import AdaptiveRateController  # noqa: E402
+from tracing import percentile  # noqa: E402
+from vector_store import LocalVectorStore  # noqa: E402
+from synthetic import HashingEmbedder, SyntheticResolution, corpus, queries  # noqa: E402
+
+# Misma configuración que ingest.py (la de rag_chain.py, unit="chars", requiere langchain)
+DEFAULT_CHUNKING = ChunkingConfig(unit="words", size=1800, overlap=200)
+FILL_BLOCK = 10_000  # vectores por upsert al llenar los índices grandes
+
+
+# ── Memoria ──────────────────────────────────────
+def _rss_mb() -> Optional[float]:
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * resource.getpagesize() / 2 ** 20, 1)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa KiB y macOS bytes
+    return round(peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+
+
+def _memory() -> Dict[str, Any]:
+    return {"rss_mb": _rss_mb(), "peak_rss_mb": _peak_rss_mb()}
+
+
+def _disk_mb(path: Path) -> float:
+    return round(sum(p.stat().st_size for p in path.rglob("*") if p.is_file()) / 2 ** 20, 1)
+
+
+def _latency(samples_ms: List[float]) -> Dict[str, float]:
+    values = sorted(samples_ms)
+    return {f"{q}_ms": round(percentile(values, int(q[1:])), 3) for q in ("p50", "p95", "p99")}
+
+
+class _TimedEmbedder:
+    """Envuelve el embedder para medir cuánto de la ingestión es embedding falso."""
+
+    def __init__(self, embedder: HashingEmbedder):
+        self.embedder = embedder
+        self.seconds = 0.0
+
+    def __call__(self, texts, model=None):
+        t0 = time.perf_counter()
+        try:
+            return self.embedder(texts, model)
+        finally:
+            self.seconds += time.perf_counter() - t0
+
+
+# ── Etapas ───────────────────────────────────────
+def bench_chunking(docs: List[SyntheticResolution], config: ChunkingConfig) -> Dict[str, Any]:
+    chars = sum(len(p) for d in docs for p in d.pages)
+    t0 = time.perf_counter()
+    chunks = sum(len(split_pages(d.pages, config)) for d in docs)
+    elapsed = time.perf_counter() - t0
+    return {
+        "config": {"unit": config.unit, "size": config.size, "overlap": config.overlap},
+        "docs": len(docs),
+        "chunks": chunks,
+        "total_ms": round(elapsed * 1000, 2),
+        "per_doc_ms": round(elapsed * 1000 / len(docs), 4),
+        "mb_per_s": round(chars / 2 ** 20 / elapsed, 2),
+    }
+
+
+def bench_metadata(docs: List[SyntheticResolution]) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    found = [extract_metadata(d.pages) for d in docs]
+    elapsed = time.perf_counter() - t0
+    fields = list(docs[0].expected)
+    accuracy = {
+        f: round(sum(m.get(f) == d.expected[f] for m, d in zip(found, docs)) / len(docs), 4)
+        for f in fields
+    }
+    return {
+        "docs": len(docs),
+        "total_ms": round(elapsed * 1000, 2),
+        "per_doc_ms": round(elapsed * 1000 / len(docs), 4),
+        "docs_per_s": round(len(docs) / elapsed, 1),
+        "accuracy": accuracy,
+    }
+
+
+def bench_ingestion(docs: List[SyntheticResolution], config: ChunkingConfig, workdir: Path,
+                    embedder: HashingEmbedder) -> Dict[str, Any]:
+    store = LocalVectorStore(workdir / "ingestion")
+    embed = _TimedEmbedder(embedder)
+    engine = IngestionEngine(
+        [VectorStoreSink(store)], chunking=config, embed_fn=embed, metadata_fn=extract_metadata,
+        # sin pausas: el embedder local no tiene cuota
+        rate_controller=AdaptiveRateController(rate=1e9, max_rate=1e9),
+    )
+    sources = [SourceDocument(name=d.name, path=None, pages=d.pages) for d in docs]
+    with contextlib.redirect_stdout(io.StringIO()):  # un "✅ ..." por documento
+        t0 = time.perf_counter()
+        report = engine.run(sources, expected=len(sources))
+        elapsed = time.perf_counter() - t0
+    pipeline = max(elapsed - embed.seconds, 1e-9)
+    return {
+        "docs": report.files_indexed,
+        "chunks": report.chunks_total,
+        "failed": len(report.files_failed) + report.chunks_failed,
+        "total_ms": round(elapsed * 1000, 2),
+        "embed_ms": round(embed.seconds * 1000, 2),
+        "docs_per_s": round(report.files_indexed / elapsed, 1),
+        "chunks_per_s": round(report.chunks_total / elapsed, 1),
+        # sin el embedding falso: lectura, chunking, metadatos, lotes y escritura
+        "pipeline_chunks_per_s": round(report.chunks_total / pipeline, 1),
+        "disk_mb": _disk_mb(store.dir),
+        "store": store,
+    }
+
+
+def bench_search(size: int, payloads: List[Dict[str, Any]], base: np.ndarray, query_vectors: np.ndarray,
+                 workdir: Path, index: str, seed: int, batch: int = 16) -> Dict[str, Any]:
+    """Llena un índice de `size` chunks a partir de los ingeridos (`base`) y mide búsquedas top-10."""
+    rng = np.random.default_rng(seed)
+    store = LocalVectorStore(workdir / f"search_{size}", index=index)
+
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for start in range(0, size, FILL_BLOCK):
+            n = min(FILL_BLOCK, size - start)
+            rows = rng.integers(0, len(base), n)
+            vectors = base[rows] + rng.normal(0, 0.05, (n, base.shape[1])).astype(np.float32)
+            ids = [f"syn-{i}" for i in range(start, start + n)]
+            store.upsert(ids, vectors, [payloads[r] for r in rows])
+    fill = time.perf_counter() - t0
+
+    store.search(query_vectors[0], limit=10)  # calentamiento (páginas del memmap)
+    single = []
+    for q in query_vectors:
+        t = time.perf_counter()
+        store.search(q, limit=10)
+        single.append((time.perf_counter() - t) * 1000)
+    t = time.perf_counter()
+    for i in range(0, len(query_vectors), batch):
+        store.search_batch(query_vectors[i:i + batch], limit=10)
+    batched = time.perf_counter() - t
+
+    result = {
+        "chunks": store.count(),
+        "index": store.index_kind,
+        "fill_ms": round(fill * 1000, 1),
+        "upserts_per_s": round(size / fill, 1),
+        **_latency(single),
+        "queries_per_s": round(len(single) / (sum(single) / 1000), 1),
+        f"batch{batch}_queries_per_s": round(len(query_vectors) / batched, 1),
+        "disk_mb": _disk_mb(store.dir),
+        **_memory(),
+    }
+    del store
+    shutil.rmtree(workdir / f"search_{size}", ignore_errors=True)
+    return result
+
+
+# ── Comparación contra una corrida anterior ──────
+def _flatten(data: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for key, value in data.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            out.update(_flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            out[path] = float(value)
+    return out
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Métricas que empeoraron más que `tolerance` (fracción) respecto de `baseline`."""
+    now, before = _flatten(current["results"]), _flatten(baseline.get("results", {}))
+    regressions = []
+    for key, old in before.items():
+        new = now.get(key)
+        if new is None or old <= 0:
+            continue
+        if key.endswith(("_ms", "_mb")):
+            worse = new > old * (1 + tolerance)
+        elif key.endswith("_per_s"):
+            worse = new < old * (1 - tolerance)
+        elif ".accuracy." in key:
+            worse = new < old
+        else:
+            continue
+        if worse:
+            regressions.append(f"{key}: {old:g} → {new:g} ({(new - old) / old:+.0%})")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--docs", type=int, default=300, help="resoluciones sintéticas para chunking/ingestión")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="tamaños del índice para búsqueda")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--index", choices=["brute", "hnsw"], default="brute")
+    parser.add_argument("--unit", choices=["words", "chars"], default=DEFAULT_CHUNKING.unit)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default="bench_offline.json")
+    parser.add_argument("--baseline", help="JSON de una corrida anterior para detectar regresiones")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--workdir", help="directorio para los índices (por defecto, uno temporal)")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    config = ChunkingConfig(unit=args.unit, size=DEFAULT_CHUNKING.size if args.unit == "words" else 1500,
+                            overlap=DEFAULT_CHUNKING.overlap if args.unit == "words" else 150)
+    embedder = HashingEmbedder()
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="bench_offline_"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    results: Dict[str, Any] = {"memory": {"start": _memory()}}
+
+    try:
+        docs = list(corpus(args.docs, seed=args.seed))
+        print(f"📄 Corpus: {len(docs)} resoluciones, {sum(len(d.pages) for d in docs)} páginas")
+
+        results["chunking"] = bench_chunking(docs, config)
+        print(f"✂️  Chunking: {results['chunking']['per_doc_ms']:.3f} ms/doc, "
+              f"{results['chunking']['mb_per_s']} MB/s")
+
+        results["metadata"] = bench_metadata(docs)
+        print(f"🏷️  Metadatos: {results['metadata']['per_doc_ms']:.3f} ms/doc, "
+              f"precisión {results['metadata']['accuracy']}")
+
+        ingestion = bench_ingestion(docs, config, workdir, embedder)
+        pool = ingestion.pop("store")
+        results["ingestion"] = ingestion
+        results["memory"]["after_ingestion"] = _memory()
+        print(f"📥 Ingestión: {ingestion['chunks_per_s']} chunks/s "
+              f"({ingestion['pipeline_chunks_per_s']} sin embeddings), {ingestion['disk_mb']} MB")
+
+        t0 = time.perf_counter()
+        query_vectors = embedder.embed_many(queries(args.queries, seed=args.seed))
+        results["query_embedding"] = {
+            "queries": args.queries,
+            "per_query_ms": round((time.perf_counter() - t0) * 1000 / max(args.queries, 1), 4),
+        }
+
+        payloads = list(pool.scroll_payloads())
+        base = embedder.embed_many([p["document"] for p in payloads])
+        results["search"] = {}
+        for size in sizes:
+            r = bench_search(size, payloads, base, query_vectors, workdir, args.index, seed=args.seed + size)
+            results["search"][str(size)] = r
+            print(f"🔎 {size:>9,} chunks: p50 {r['p50_ms']:.2f} ms | p95 {r['p95_ms']:.2f} ms | "
+                  f"p99 {r['p99_ms']:.2f} ms | llenado {r['upserts_per_s']:,.0f}/s | RSS {r['rss_mb']} MB")
+        results["memory"]["end"] = _memory()
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(),
+        },
+        "config": {"docs": args.docs, "sizes": sizes, "queries": args.queries, "index": args.index,
+                   "seed": args.seed, "chunking": results["chunking"]["config"]},
+        "results": results,
+    }
+    Path(args.out).write_text(json.dumps(output, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"💾 Resultados en {args.out}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = compare(output, baseline, args.tolerance)
+        if regressions:
+            print(f"❌ {len(regressions)} métricas empeoraron más de {args.tolerance:.0%}:")
+            for line in regressions:
+                print(f"   {line}")
+            sys.exit(1)
+        print(f"✅ Sin regresiones respecto de {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+# bench/eval_retrieval.py
+# Evaluación de calidad y latencia de la recuperación con consultas etiquetadas.
+# Cada consulta pasa por rag_chain.retrieve (la misma etapa de answer():
+# embedding, búsqueda con corte adaptativo y contexto empaquetado) y se mide:
+#   - recall@1/3/5/10, MRR y nDCG@k por documento (archivo) relevante
+#   - context_recall: relevantes que sobreviven al presupuesto de tokens
+#   - latencia p50/p95 total y por etapa, y tokens del contexto generado
+# Resultados por tipo de consulta (identificador, persona, tema) y en total.
+#
+# Sin --live: corpus sintético (bench/synthetic.py) indexado en un
+# LocalVectorStore con HashingEmbedder, una vez por cada configuración de
+# chunking (--chunking unidad:tamaño:traslape,...) y evaluado con cada k (--k).
+# Con --live: el índice y los embeddings configurados (Qdrant + Gemini) con
+# un archivo de consultas etiquetadas (--queries); el chunking es el del índice.
+#
+# Formato de --queries (JSONL): {"query": "...", "kind": "persona", "relevant": ["archivo.pdf", ...]}
+# --export-queries guarda las consultas sintéticas en ese formato como plantilla.
+#
+# Uso:  python bench/eval_retrieval.py [--docs 300] [--queries-n 150] [--k 5,10,20]
+#                                      [--chunking chars:1500:150,words:1800:200,chars:30000:500]
+#                                      [--out eval_retrieval.json]
+#       python bench/eval_retrieval.py --live --queries consultas.jsonl [--k 10]
+from __future__ import annotations
+import io
+import os
+import sys
+import json
+import math
+import shutil
+import argparse
+import tempfile
+import contextlib
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from ingestion import ChunkingConfig, IngestionEngine, SourceDocument, VectorStoreSink  # noqa: E402
+from metadata_extractor import extract_metadata  # noqa: E402
+from rate_control import AdaptiveRateController  # noqa: E402
+from retrieval import Retriever  # noqa: E402
+from tracing import percentile  # noqa: E402
+from vector_store import LocalVectorStore  # noqa: E402
+from synthetic import HashingEmbedder, corpus, labeled_queries  # noqa: E402
+
+# rag_chain, el chunking del analizador (document_analyzer.chunk_text) e ingest.py
+DEFAULT_CHUNKING = "chars:1500:150,words:1800:200,chars:30000:500"
+RECALL_AT = (1, 3, 5, 10)
+# Solo para importar rag_chain sin credenciales en el modo sintético
+OFFLINE_ENV = {
+    "GEMINI_API_KEY": "offline-eval",
+    "VECTOR_BACKEND": "local",
+    "CATALOG_DB": os.path.join(tempfile.gettempdir(), "eval_retrieval_catalog.db"),
+    "USAGE_BACKEND": "memory",
+}
+
+
+# ── Métricas ─────────────────────────────────────
+def ranked_sources(hits: List[Any]) -> List[str]:
+    """Archivos en el orden en que aparecen por primera vez entre los hits."""
+    seen: Dict[str, None] = {}
+    for hit in hits:
+        payload = getattr(hit, "payload", hit) or {}
+        source = payload.get("metadata", {}).get("source")
+        if source:
+            seen.setdefault(source, None)
+    return list(seen)
+
+
+def score_query(ranked: List[str], relevant: List[str], k: int) -> Dict[str, float]:
+    rel = set(relevant)
+    scores = {f"recall@{n}": len(rel & set(ranked[:n])) / len(rel) for n in RECALL_AT if n <= k}
+    first = next((i for i, s in enumerate(ranked, start=1) if s in rel), None)
+    scores["mrr"] = 1 / first if first else 0.0
+    dcg = sum(1 / math.log2(i + 1) for i, s in enumerate(ranked[:k], start=1) if s in rel)
+    ideal = sum(1 / math.log2(i + 1) for i in range(1, min(len(rel), k) + 1))
+    scores[f"ndcg@{k}"] = dcg / ideal if ideal else 0.0
+    return scores
+
+
+def aggregate(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Promedio de las métricas de calidad y percentiles de latencia y tokens."""
+    if not rows:
+        return {}
+    quality = {key: round(sum(r["scores"][key] for r in rows) / len(rows), 4) for key in rows[0]["scores"]}
+    out: Dict[str, Any] = {"queries": len(rows), **quality}
+    for stage in ("total", "embed", "search", "context"):
+        values = sorted(r["timings"][stage] for r in rows)
+        out[f"{stage}_p50_ms"] = round(percentile(values, 50), 3)
+        out[f"{stage}_p95_ms"] = round(percentile(values, 95), 3)
+    tokens = sorted(r["tokens"] for r in rows)
+    out["context_tokens_mean"] = round(sum(tokens) / len(tokens), 1)
+    out["context_tokens_p95"] = percentile(tokens, 95)
+    out["chunks_mean"] = round(sum(r["chunks"] for r in rows) / len(rows), 2)
+    return out
+
+
+def evaluate(queries: List[Dict[str, Any]], k: int, **retrieve_kwargs) -> Dict[str, Any]:
+    """Pasa cada consulta por rag_chain.retrieve y agrega por tipo y en total."""
+    from rag_chain import retrieve
+    rows = []
+    for q in queries:
+        with contextlib.redirect_stdout(io.StringIO()):  # "🎯 ..." y "🧩 ..." por consulta
+            found = retrieve(q["query"], k, **retrieve_kwargs)
+        timings = dict(found.timings, total=sum(found.timings.values()))
+        rel = set(q["relevant"])
+        in_context = {b.source for b in found.context.blocks}
+        scores = score_query(ranked_sources(found.hits), q["relevant"], k)
+        scores["context_recall"] = len(rel & in_context) / len(rel) if rel else 0.0
+        rows.append({"kind": q.get("kind", "general"), "scores": scores, "timings": timings,
+                     "tokens": found.context.tokens, "chunks": len(found.hits)})
+    kinds = sorted({r["kind"] for r in rows})
+    return {"all": aggregate(rows), **{kind: aggregate([r for r in rows if r["kind"] == kind]) for kind in kinds}}
+
+
+# ── Índices sintéticos ───────────────────────────
+def parse_chunking(spec: str) -> List[ChunkingConfig]:
+    configs = []
+    for item in spec.split(","):
+        unit, size, overlap = item.strip().split(":")
+        configs.append(ChunkingConfig(unit=unit, size=int(size), overlap=int(overlap)))
+    return configs
+
+
+def build_index(docs, config: ChunkingConfig, workdir: Path, embedder: HashingEmbedder) -> LocalVectorStore:
+    store = LocalVectorStore(workdir / f"{config.unit}_{config.size}_{config.overlap}")
+    engine = IngestionEngine([VectorStoreSink(store)], chunking=config, embed_fn=embedder,
+                             metadata_fn=extract_metadata,
+                             rate_controller=AdaptiveRateController(rate=1e9, max_rate=1e9))
+    with contextlib.redirect_stdout(io.StringIO()):
+        engine.run([SourceDocument(name=d.name, path=None, pages=d.pages) for d in docs])
+    return store
+
+
+def _print_table(label: str, results: Dict[str, Any], k: int) -> None:
+    print(f"\n📐 {label}")
+    print(f"   {'tipo':<14}{'n':>5}{'R@1':>7}{'R@' + str(min(k, 10)):>7}{'MRR':>7}{'nDCG':>7}"
+          f"{'ctxR':>7}{'p50 ms':>9}{'p95 ms':>9}{'tokens':>8}")
+    for kind, r in results.items():
+        if not r:
+            continue
+        print(f"   {kind:<14}{r['queries']:>5}{r['recall@1']:>7.3f}{r[f'recall@{min(k, 10)}']:>7.3f}"
+              f"{r['mrr']:>7.3f}{r[f'ndcg@{k}']:>7.3f}{r['context_recall']:>7.3f}"
+              f"{r['total_p50_ms']:>9.2f}{r['total_p95_ms']:>9.2f}{r['context_tokens_mean']:>8.0f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--live", action="store_true", help="usar el índice y los embeddings configurados")
+    parser.add_argument("--queries", help="consultas etiquetadas (JSONL); obligatorio con --live")
+    parser.add_argument("--export-queries", help="guardar las consultas sintéticas en JSONL")
+    parser.add_argument("--docs", type=int, default=300)
+    parser.add_argument("--queries-n", type=int, default=150)
+    parser.add_argument("--k", default="5,10,20")
+    parser.add_argument("--chunking", default=DEFAULT_CHUNKING)
+    parser.add_argument("--token-budget", type=int, help="presupuesto del contexto (CONTEXT_TOKEN_BUDGET)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default="eval_retrieval.json")
+    args = parser.parse_args()
+
+    ks = [int(k) for k in args.k.split(",") if k.strip()]
+    if args.live and not args.queries:
+        parser.error("--live necesita --queries con las consultas etiquetadas")
+    if not args.live:
+        for key, value in OFFLINE_ENV.items():
+            os.environ.setdefault(key, value)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import rag_chain  # noqa: F401  (imprime la configuración al importarse)
+    extra = {"token_budget": args.token_budget} if args.token_budget else {}
+
+    runs: List[Dict[str, Any]] = []
+    if args.live:
+        queries = [json.loads(line) for line in Path(args.queries).read_text(encoding="utf-8").splitlines()
+                   if line.strip()]
+        for k in ks:
+            results = evaluate(queries, k, **extra)
+            _print_table(f"índice configurado ({rag_chain.VECTOR_BACKEND}), k={k}", results, k)
+            runs.append({"chunking": "índice", "k": k, "results": results})
+    else:
+        embedder = HashingEmbedder()
+        docs = list(corpus(args.docs, seed=args.seed))
+        if args.queries:
+            queries = [json.loads(line) for line in Path(args.queries).read_text(encoding="utf-8").splitlines()
+                       if line.strip()]
+        else:
+            queries = labeled_queries(docs, args.queries_n, seed=args.seed)
+        if args.export_queries:
+            Path(args.export_queries).write_text(
+                "".join(json.dumps(q, ensure_ascii=False) + "\n" for q in queries), encoding="utf-8")
+            print(f"💾 {len(queries)} consultas etiquetadas en {args.export_queries}")
+        print(f"📄 Corpus sintético: {len(docs)} resoluciones, {len(queries)} consultas")
+
+        workdir = Path(tempfile.mkdtemp(prefix="eval_retrieval_"))
+        try:
+            for config in parse_chunking(args.chunking):
+                label = f"{config.unit}:{config.size}:{config.overlap}"
+                try:
+                    store = build_index(docs, config, workdir, embedder)
+                except ImportError as e:
+                    print(f"ℹ️ Se omite {label}: {e}")
+                    continue
+                searcher = Retriever(store, rag_chain.RETRIEVAL, label="eval",
+                                     payload_fields=rag_chain.CHAT_PAYLOAD_FIELDS)
+                for k in ks:
+                    results = evaluate(queries, k, searcher=searcher, embed_fn=embedder.embed, **extra)
+                    _print_table(f"{label} ({store.count()} chunks), k={k}", results, k)
+                    runs.append({"chunking": label, "chunks": store.count(), "k": k, "results": results})
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "mode": "live" if args.live else "synthetic",
+        "config": {"docs": None if args.live else args.docs, "k": ks, "seed": args.seed,
+                   "retrieval": vars(rag_chain.RETRIEVAL),
+                   "token_budget": args.token_budget or rag_chain.CONTEXT_TOKEN_BUDGET},
+        "runs": runs,
+    }
+    Path(args.out).write_text(json.dumps(output, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"\n💾 Resultados en {args.out}")
+
+
+if __name__ == "__main__":
+    main()
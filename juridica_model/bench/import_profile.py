@@ -0,0 +1,121 @@
+# bench/import_profile.py
+# Perfil de importación para el arranque en frío (Cloud Run escala a cero).
+# Importa cada módulo en un proceso nuevo con `python -X importtime`, muestra
+# los paquetes que más tiempo acumulan y verifica que:
+#   - ningún módulo pesado (SDK de Gemini, qdrant_client, API de Drive,
+#     lectores de PDF, reportlab, langchain) se cargue al importar
+#   - el tiempo acumulado de cada módulo no pase del presupuesto (--budget-ms)
+# Sale con código 1 si algo falla, para usarlo como verificación en CI.
+#
+# Uso:  python bench/import_profile.py [modulo ...] [--budget-ms 1500] [--top 15]
+from __future__ import annotations
+import os
+import re
+import sys
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from typing import Dict, List, NamedTuple
+
+ROOT = Path(__file__).resolve().parent.parent
+
+DEFAULT_MODULES = ["rag_chain", "analysis_interface"]
+# Se cargan en su primer uso (services.py, imports dentro de las funciones)
+HEAVY_MODULES = [
+    "google.generativeai",
+    "qdrant_client",
+    "googleapiclient",
+    "PyPDF2",
+    "reportlab",
+    "langchain",
+]
+# Variables mínimas para que rag_chain se importe; no se abre ninguna conexión
+PROFILE_ENV = {
+    "GEMINI_API_KEY": "import-profile",
+    "QDRANT_URL": "http://localhost:6333",
+    "QDRANT_API_KEY": "import-profile",
+    "CATALOG_DB": os.path.join(tempfile.gettempdir(), "import_profile_catalog.db"),
+    "USAGE_BACKEND": "memory",
+}
+
+_LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)$")
+
+
+class ImportEntry(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def profile_import(module: str) -> List[ImportEntry]:
+    """Importa `module` en un intérprete nuevo y devuelve las líneas de -X importtime."""
+    env = {**os.environ, **{k: v for k, v in PROFILE_ENV.items() if k not in os.environ}}
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(ROOT), env.get("PYTHONPATH")]))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        tail = "\n".join(proc.stderr.strip().splitlines()[-5:])
+        raise RuntimeError(f"no se pudo importar {module}:\n{tail}")
+    entries = []
+    for line in proc.stderr.splitlines():
+        m = _LINE_RE.match(line)
+        if m:
+            entries.append(ImportEntry(m.group(4), int(m.group(1)), int(m.group(2)),
+                                       (len(m.group(3)) - 1) // 2))
+    return entries
+
+
+def by_package(entries: List[ImportEntry]) -> Dict[str, int]:
+    """Tiempo propio (µs) agrupado por paquete de primer nivel."""
+    totals: Dict[str, int] = {}
+    for e in entries:
+        pkg = e.module.split(".")[0]
+        totals[pkg] = totals.get(pkg, 0) + e.self_us
+    return totals
+
+
+def heavy_loaded(entries: List[ImportEntry], heavy: List[str] = HEAVY_MODULES) -> List[str]:
+    names = {e.module for e in entries}
+    return [h for h in heavy if any(n == h or n.startswith(h + ".") for n in names)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", 1500)))
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    failures = []
+    for module in args.modules:
+        try:
+            entries = profile_import(module)
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            failures.append(module)
+            continue
+        target = next((e for e in entries if e.module == module), None)
+        total_ms = (target.cumulative_us if target else 0) / 1000
+        print(f"\n📦 {module}: {total_ms:.0f} ms acumulados, {len(entries)} módulos importados")
+        for pkg, us in sorted(by_package(entries).items(), key=lambda kv: kv[1], reverse=True)[:args.top]:
+            print(f"   {us / 1000:8.1f} ms  {pkg}")
+
+        heavy = heavy_loaded(entries)
+        if heavy:
+            print(f"❌ {module} carga al importarse: {', '.join(heavy)}")
+            failures.append(module)
+        if total_ms > args.budget_ms:
+            print(f"❌ {module} supera el presupuesto: {total_ms:.0f} ms > {args.budget_ms:.0f} ms")
+            failures.append(module)
+
+    if failures:
+        sys.exit(1)
+    print("\n✅ Importaciones dentro del presupuesto y sin módulos pesados")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+# bench/load_test.py
+# Prueba de carga de los handlers de Gradio (chat_fn y la pestaña de análisis)
+# con N sesiones concurrentes, en el mismo proceso y sin la UI.
+#   - cada sesión del chat envía --turns consultas seguidas, con su historial
+#     y su session_hash (memoria de seguimientos), como un usuario real
+#   - con --pdf, --analysis-sessions sesiones analizan el documento y buscan
+#     precedentes con los argumentos obtenidos; ambos pasan por la cola de
+#     jobs.py (ANALYSIS_WORKERS), que también se mide (espera en cola)
+#   - informa throughput, latencia p50/p95/p99 por handler, errores, llamadas
+#     a Gemini por resultado y percentiles por etapa (tracing.STATS)
+# Por defecto GEMINI_REPLAY=replay (replay.py): Gemini responde desde el
+# cassette, con la latencia y los errores simulados que se configuren, sin
+# gastar cuota. El cassette se graba una vez con la API real:
+#   GEMINI_REPLAY=record python bench/load_test.py --sessions 1
+# La sincronización con Drive no se lanza (el índice debe existir); --sync la activa.
+#
+# Uso:  python bench/load_test.py [--sessions 8] [--turns 5] [--queries consultas.txt]
+#                                 [--pdf informe.pdf --analysis-sessions 2]
+#                                 [--think-ms 0] [--ramp-s 0] [--out load_test.json]
+from __future__ import annotations
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+DEFAULT_QUERIES = [
+    "¿Qué se resolvió en la resolución 07685-2025?",
+    "Sanciones del expediente DJ-0612",
+    "¿Cuáles resoluciones hay contra Carlos Francisco Soto?",
+    "Casos de fraccionamiento ilícito en contratación administrativa",
+    "Precedentes sobre no presentación de la declaración jurada de bienes",
+    "¿Qué sanción se impuso por uso de vehículos oficiales para fines particulares?",
+    "Dame las razones de sanción más frecuentes",
+    "¿Y cuál fue el plazo de la sanción?",
+]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, handler: str, ms: float, ok: bool) -> None:
+        with self._lock:
+            self.samples.setdefault(handler, []).append(ms)
+            if not ok:
+                self.errors[handler] = self.errors.get(handler, 0) + 1
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        from tracing import percentile
+        out: Dict[str, Any] = {}
+        with self._lock:
+            for handler, values in self.samples.items():
+                values = sorted(values)
+                out[handler] = {
+                    "requests": len(values),
+                    "errors": self.errors.get(handler, 0),
+                    "throughput_per_s": round(len(values) / elapsed, 3),
+                    "mean_ms": round(sum(values) / len(values), 1),
+                    **{f"{q}_ms": round(percentile(values, int(q[1:])), 1) for q in ("p50", "p95", "p99")},
+                    "max_ms": round(values[-1], 1),
+                }
+        return out
+
+
+def _is_error(text: str) -> bool:
+    return not text or text.lstrip().startswith(("⚠️", "❌"))
+
+
+def chat_session(app, n: int, queries: List[str], turns: int, code: str, think_s: float,
+                 recorder: Recorder) -> None:
+    request = SimpleNamespace(session_hash=f"load-{n}")
+    hist: List[Any] = []
+    for turn in range(turns):
+        msg = queries[(n * turns + turn) % len(queries)]
+        t0 = time.perf_counter()
+        first = None
+        try:
+            for _, hist in app.chat_fn(msg, hist, code, request=request):
+                first = first or time.perf_counter()
+            ok = not _is_error(hist[-1][1])
+        except Exception as e:
+            print(f"⚠️ Sesión {n}: {e}")
+            ok = False
+        recorder.record("chat_fn", (time.perf_counter() - t0) * 1000, ok)
+        if first is not None:
+            recorder.record("chat_fn.first_yield", (first - t0) * 1000, True)
+        if think_s:
+            time.sleep(think_s)
+
+
+def _run_job(handlers: Dict[str, Any], submitted: tuple, n: int, recorder: Recorder, name: str) -> Any:
+    """Espera el trabajo encolado por un handler y registra latencia total y espera en cola."""
+    job_id = submitted[0]
+    if not job_id:
+        print(f"⚠️ {name} {n}: {submitted[1]}")
+        return None
+    job = handlers["queue"].wait(job_id)
+    ok = job["status"] == "done"
+    if not ok:
+        print(f"⚠️ {name} {n}: {job['error']}")
+    if job["started_at"]:
+        recorder.record(f"{name}.queue_wait", (job["started_at"] - job["created_at"]) * 1000, True)
+    return job["result"] if ok else None
+
+
+def analysis_session(handlers: Dict[str, Any], n: int, pdf: str, recorder: Recorder) -> None:
+    # Los handlers encolan en jobs.py: se mide hasta que el trabajo termina
+    upload = SimpleNamespace(name=pdf)
+    request = SimpleNamespace(session_hash=f"load-analysis-{n}")
+    t0 = time.perf_counter()
+    result = _run_job(handlers, handlers["analyze"](upload, request=request), n, recorder, "analysis.analyze")
+    recorder.record("analysis.analyze", (time.perf_counter() - t0) * 1000, result is not None)
+    if not result or not result["legal_summary"]:
+        return
+    t0 = time.perf_counter()
+    result = _run_job(handlers, handlers["precedents"](upload, result["facts_summary"], result["legal_summary"],
+                                                       request=request), n, recorder, "analysis.precedents")
+    recorder.record("analysis.precedents", (time.perf_counter() - t0) * 1000, result is not None)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=8, help="sesiones de chat concurrentes")
+    parser.add_argument("--turns", type=int, default=5, help="consultas por sesión")
+    parser.add_argument("--queries", help="archivo con una consulta por línea")
+    parser.add_argument("--pdf", help="documento para las sesiones de análisis")
+    parser.add_argument("--analysis-sessions", type=int, default=0)
+    parser.add_argument("--think-ms", type=float, default=0, help="pausa entre consultas de una sesión")
+    parser.add_argument("--ramp-s", type=float, default=0, help="segundos para arrancar todas las sesiones")
+    parser.add_argument("--daily-limit", type=int, default=10 ** 6, help="límite diario por código en la prueba")
+    parser.add_argument("--sync", action="store_true", help="lanzar la sincronización con Drive")
+    parser.add_argument("--out", default="load_test.json")
+    args = parser.parse_args()
+
+    os.environ.setdefault("GEMINI_REPLAY", "replay")
+    os.environ.setdefault("USAGE_BACKEND", "memory")
+    os.environ.setdefault("JOBS_DB", os.path.join(tempfile.gettempdir(), "load_test_jobs.db"))
+    if os.environ["GEMINI_REPLAY"] == "replay":
+        os.environ.setdefault("GEMINI_API_KEY", "replay")  # rag_chain la exige al importarse
+
+    import rag_chain
+    if not args.sync:
+        rag_chain.READINESS = "ready"  # start_background_init() no lanza la ingestión
+    import app
+    import metrics
+    import replay
+    import tracing
+
+    app.auth_manager.daily_limit = args.daily_limit
+    code = app.auth_manager.access_codes[0].strip()
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        queries = [q.strip() for q in Path(args.queries).read_text(encoding="utf-8").splitlines() if q.strip()]
+    handlers = getattr(getattr(app, "analysis_interface", None), "handlers", None)
+    if args.analysis_sessions and not (args.pdf and handlers):
+        parser.error("--analysis-sessions necesita --pdf y la pestaña de análisis configurada")
+
+    recorder = Recorder()
+    jobs = args.sessions + args.analysis_sessions
+    delay = args.ramp_s / jobs if jobs else 0
+    print(f"🚦 {args.sessions} sesiones de chat × {args.turns} consultas, {args.analysis_sessions} análisis "
+          f"(Gemini: {replay.MODE})")
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(jobs, 1), thread_name_prefix="load") as pool:
+        futures = []
+        for n in range(args.analysis_sessions):
+            futures.append(pool.submit(analysis_session, handlers, n, args.pdf, recorder))
+            time.sleep(delay)
+        for n in range(args.sessions):
+            futures.append(pool.submit(chat_session, app, n, queries, args.turns, code,
+                                       args.think_ms / 1000, recorder))
+            time.sleep(delay)
+        for f in futures:
+            f.result()
+    elapsed = time.perf_counter() - t0
+
+    handlers_summary = recorder.summary(elapsed)
+    total = sum(s["requests"] for name, s in handlers_summary.items() if not name.endswith(("first_yield", "queue_wait")))
+    print(f"\n⏱️ {total} peticiones en {elapsed:.1f}s → {total / elapsed:.2f} req/s")
+    print(f"{'handler':<24}{'n':>6}{'err':>5}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for name, s in handlers_summary.items():
+        print(f"{name:<24}{s['requests']:>6}{s['errors']:>5}{s['p50_ms']:>10.0f}{s['p95_ms']:>10.0f}"
+              f"{s['p99_ms']:>10.0f}{s['max_ms']:>10.0f}")
+    print(f"\n{tracing.STATS.format()}")
+
+    gemini = {f"{labels['kind']}.{labels['outcome']}": value
+              for _, labels, value in metrics.GEMINI_CALLS.samples()}
+    output = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {**vars(args), "gemini": replay.MODE, "error_rate": replay.ERROR_RATE,
+                   "latency_scale": replay.LATENCY_SCALE},
+        "elapsed_s": round(elapsed, 2),
+        "throughput_per_s": round(total / elapsed, 3),
+        "handlers": handlers_summary,
+        "gemini_calls": gemini,
+        "replay": replay.STATS.snapshot(),
+        "stages": tracing.STATS.summary(),
+    }
+    Path(args.out).write_text(json.dumps(output, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"💾 Resultados en {args.out}")
+
+
+if __name__ == "__main__":
+    main()
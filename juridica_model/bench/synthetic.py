@@ -0,0 +1,223 @@
+# bench/synthetic.py
+# Corpus sintético de resoluciones y embeddings deterministas para los
+# benchmarks sin red:
+#   - resoluciones con encabezado, hechos, considerandos y "POR TANTO", con
+#     identificadores que cumplen res_regex / int_regex / pa_regex y una
+#     sanción que reconoce sancion_regex (se guardan los valores esperados)
+#   - HashingEmbedder: n-gramas de palabras con hashing firmado a 768
+#     dimensiones, normalizados; mismo texto → mismo vector en cualquier
+#     proceso (crc32, no hash() de Python)
+# Todo depende solo de la semilla: dos corridas generan el mismo corpus.
+from __future__ import annotations
+import re
+import random
+import zlib
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional
+
+import numpy as np
+
+VECTOR_SIZE = 768
+
+# ── Vocabulario ──────────────────────────────────
+_NOMBRES = ["María", "José", "Ana", "Luis", "Carmen", "Jorge", "Laura", "Carlos", "Sofía", "Andrés",
+            "Patricia", "Ricardo", "Gabriela", "Fernando", "Silvia", "Mauricio"]
+_APELLIDOS = ["Rodríguez", "Vargas", "Jiménez", "Mora", "Rojas", "Solano", "Chaves", "Araya",
+              "Calderón", "Quesada", "Castro", "Alfaro", "Brenes", "Villalobos", "Ureña", "Salazar"]
+_ENTIDADES = ["la Municipalidad de San Carlos", "el Instituto Costarricense de Acueductos y Alcantarillados",
+              "la Caja Costarricense de Seguro Social", "el Ministerio de Obras Públicas y Transportes",
+              "la Municipalidad de Alajuela", "el Consejo Nacional de Vialidad",
+              "el Instituto Nacional de Aprendizaje", "la Municipalidad de Pérez Zeledón"]
+_CARGOS = ["proveedor institucional", "alcalde municipal", "jefe de departamento financiero",
+           "ingeniero de proyectos", "director administrativo", "encargado de presupuesto",
+           "tesorero municipal", "coordinador de compras"]
+_FALTAS = [
+    "aprobó pagos por obras no recibidas a satisfacción de la administración",
+    "fraccionó ilícitamente la contratación para evadir el procedimiento de licitación",
+    "omitió presentar la declaración jurada de bienes dentro del plazo legal",
+    "autorizó el uso de vehículos oficiales para fines particulares",
+    "incumplió el deber de control interno sobre los fondos de caja chica",
+    "recibió dádivas de un oferente durante el procedimiento de contratación",
+    "certificó horas extra que no fueron laboradas por el personal a su cargo",
+    "adjudicó la licitación a una empresa en la que su cónyuge figuraba como socia",
+]
+_NORMAS = ["artículo 3 de la Ley contra la Corrupción y el Enriquecimiento Ilícito",
+           "artículo 110 de la Ley de la Administración Financiera de la República",
+           "artículo 39 de la Ley General de Control Interno",
+           "artículo 68 de la Ley Orgánica de la Contraloría General de la República",
+           "artículo 211 de la Ley General de la Administración Pública",
+           "artículo 96 de la Ley General de Contratación Pública"]
+_RELLENO = [
+    "Consta en el expediente administrativo la documentación aportada por la unidad fiscalizadora, "
+    "la cual fue puesta en conocimiento de la parte investigada en la audiencia oral y privada.",
+    "Este órgano decisor ha valorado la prueba conforme a las reglas de la sana crítica racional, "
+    "atendiendo a la lógica, la experiencia y la psicología.",
+    "La parte investigada alegó en su defensa que actuó siguiendo instrucciones de su superior "
+    "jerárquico, argumento que no desvirtúa su deber de probidad en el ejercicio del cargo.",
+    "El deber de probidad obliga al funcionario público a orientar su gestión a la satisfacción "
+    "del interés público y a administrar los recursos con apego a los principios de legalidad.",
+    "No existe en autos prueba que permita acreditar una causa de justificación o un error "
+    "invencible que excluya la culpa grave atribuida en el traslado de cargos.",
+    "La responsabilidad administrativa se deriva de la conducta dolosa o gravemente culposa del "
+    "servidor, lo cual se tiene por demostrado con el informe de relación de hechos.",
+]
+# (texto de la sanción, tipo que debe inferir sancion_a_tipo)
+_SANCIONES = [
+    ("despido sin responsabilidad patronal", "despido sin responsabilidad"),
+    ("suspensión sin goce de salario por un plazo de {n} días", "suspensión"),
+    ("inhabilitación para ejercer cargos de la Hacienda Pública por un plazo de {n} años", "inhabilitación"),
+    ("multa de ¢{monto}", "multa"),
+    ("separación del cargo público sin responsabilidad patronal", None),
+    ("archivo del expediente por falta de mérito", "archivo"),
+]
+_INTERNOS = ["DJ", "PA", "OR", "AL", "SG"]
+
+
+class SyntheticResolution(NamedTuple):
+    name: str
+    pages: List[str]
+    expected: Dict[str, Optional[str]]  # resolucion, interno, pa, tipo
+    facts: Dict[str, Any]               # investigado, entidad, cargo, faltas (consultas etiquetadas)
+
+
+def _persona(rng: random.Random) -> str:
+    return f"{rng.choice(_NOMBRES)} {rng.choice(_APELLIDOS)} {rng.choice(_APELLIDOS)}"
+
+
+def _de(entidad: str) -> str:
+    return "del " + entidad[3:] if entidad.startswith("el ") else "de " + entidad
+
+
+def _paragraphs(rng: random.Random, n: int) -> List[str]:
+    return [" ".join(rng.sample(_RELLENO, k=rng.randint(2, 4))) for _ in range(n)]
+
+
+def make_resolution(i: int, rng: random.Random, page_chars: int = 3000) -> SyntheticResolution:
+    year = rng.randint(2015, 2025)
+    resolucion = f"{rng.randint(1, 99999):05d}-{year}"
+    interno = f"{rng.choice(_INTERNOS)}-{rng.randint(1, 9999):04d}"
+    pa = f"{rng.choice(['CGR-', ''])}PA-{year}{rng.randint(0, 999999):06d}"
+    sancion, tipo = rng.choice(_SANCIONES)
+    sancion = sancion.format(n=rng.randint(2, 10), monto=f"{rng.randint(100, 9999)}.{rng.randint(0, 999):03d}")
+    investigado, entidad, cargo = _persona(rng), rng.choice(_ENTIDADES), rng.choice(_CARGOS)
+
+    header = (
+        "CONTRALORÍA GENERAL DE LA REPÚBLICA\nDIVISIÓN JURÍDICA\n"
+        f"RESOLUCIÓN N.º {resolucion}\n{interno}\n"
+        f"Procedimiento administrativo {pa} seguido contra {investigado}, {cargo} "
+        f"{_de(entidad)}.\n"
+        f"San José, a las {rng.randint(8, 16)} horas del {rng.randint(1, 28)} de "
+        f"{rng.choice(['enero', 'marzo', 'junio', 'agosto', 'octubre', 'diciembre'])} de {year}.\n"
+    )
+    body, faltas = ["RESULTANDO"], []
+    for n in range(1, rng.randint(4, 8)):
+        faltas.append(rng.choice(_FALTAS))
+        body.append(f"{n}. Que {investigado} {faltas[-1]}, en contravención del {rng.choice(_NORMAS)}.")
+        body.extend(_paragraphs(rng, 2))
+    body.append("CONSIDERANDO")
+    for _ in range(rng.randint(4, 10)):
+        body.append(f"Sobre el {rng.choice(_NORMAS)}. " + " ".join(_paragraphs(rng, 2)))
+        if rng.random() < 0.3:
+            # referencias a otras resoluciones después del encabezado
+            body.append(f"Véase en igual sentido la resolución {rng.randint(1, 99999):05d}-{year - 1}.")
+    body.append(f"POR TANTO: Se impone a {investigado} la sanción de {sancion}. NOTIFÍQUESE.")
+
+    pages, current = [], header
+    for paragraph in body:
+        if len(current) + len(paragraph) > page_chars and current:
+            pages.append(current)
+            current = ""
+        current += paragraph + "\n"
+    pages.append(current)
+
+    expected = {"resolucion": resolucion, "interno": interno, "pa": pa, "tipo": tipo}
+    facts = {"investigado": investigado, "entidad": entidad, "cargo": cargo, "faltas": sorted(set(faltas))}
+    return SyntheticResolution(f"RES-{i:06d}-{resolucion}.pdf", pages, expected, facts)
+
+
+def corpus(n_docs: int, seed: int = 42, page_chars: int = 3000) -> Iterator[SyntheticResolution]:
+    """`n_docs` resoluciones deterministas para `seed`."""
+    rng = random.Random(seed)
+    for i in range(n_docs):
+        yield make_resolution(i, rng, page_chars)
+
+
+def queries(n: int, seed: int = 7) -> List[str]:
+    """Consultas de usuario con el mismo vocabulario del corpus."""
+    rng = random.Random(seed)
+    templates = [
+        "¿Qué sanción se impuso al {cargo} que {falta}?",
+        "precedentes sobre {norma}",
+        "resoluciones de {entidad} con {tipo}",
+        "casos en que el funcionario {falta}",
+    ]
+    return [
+        rng.choice(templates).format(cargo=rng.choice(_CARGOS), falta=rng.choice(_FALTAS),
+                                     norma=rng.choice(_NORMAS), entidad=rng.choice(_ENTIDADES),
+                                     tipo=rng.choice(_SANCIONES)[1] or "separación del cargo")
+        for _ in range(n)
+    ]
+
+
+def labeled_queries(docs: List[SyntheticResolution], n: int, seed: int = 11) -> List[Dict[str, Any]]:
+    """
+    Consultas con sus documentos relevantes (nombres de archivo), repartidas
+    entre identificador (resolución, interno o PA), persona y tema.
+    """
+    rng = random.Random(seed)
+    kinds = ["identificador", "persona", "tema"]
+    out = []
+    for i in range(n):
+        doc, kind = rng.choice(docs), kinds[i % len(kinds)]
+        if kind == "identificador":
+            field = rng.choice(["resolucion", "interno", "pa"])
+            value = doc.expected[field]
+            query = {"resolucion": f"¿Qué se resolvió en la resolución {value}?",
+                     "interno": f"Sanción del expediente {value}",
+                     "pa": f"Resultado del procedimiento administrativo {value}"}[field]
+            relevant = [d.name for d in docs if d.expected[field] == value]
+        elif kind == "persona":
+            person = doc.facts["investigado"]
+            query = f"¿Qué sanción se le impuso a {person}?"
+            relevant = [d.name for d in docs if d.facts["investigado"] == person]
+        else:
+            falta = rng.choice(doc.facts["faltas"])
+            query = f"{doc.facts['cargo']} {_de(doc.facts['entidad'])} que {falta}"
+            relevant = [d.name for d in docs
+                        if falta in d.facts["faltas"] and d.facts["cargo"] == doc.facts["cargo"]
+                        and d.facts["entidad"] == doc.facts["entidad"]]
+        out.append({"query": query, "kind": kind, "relevant": relevant})
+    return out
+
+
+# ── Embeddings deterministas ─────────────────────
+_TOKEN_RE = re.compile(r"\w+")
+
+
+class HashingEmbedder:
+    """
+    Sustituto local de embed_documents: unigramas y bigramas de palabras
+    (en minúsculas) con hashing firmado a `dim` dimensiones y norma 1.
+    Textos con vocabulario parecido quedan cerca, como con un modelo real,
+    pero sin red ni cuota. Se puede pasar como `embed_fn` a IngestionEngine.
+    """
+
+    def __init__(self, dim: int = VECTOR_SIZE):
+        self.dim = dim
+
+    def embed(self, text: str) -> np.ndarray:
+        words = _TOKEN_RE.findall(text.lower())
+        # presencia, no frecuencia: el texto repetido de las resoluciones no domina
+        grams = set(words).union(f"{a} {b}" for a, b in zip(words, words[1:]))
+        if not grams:
+            return np.zeros(self.dim, dtype=np.float32)
+        hashes = np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint32, count=len(grams))
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0)
+        vec = np.bincount(hashes % self.dim, weights=signs, minlength=self.dim).astype(np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def embed_many(self, texts: List[str]) -> np.ndarray:
+        return np.stack([self.embed(t) for t in texts]) if texts else np.zeros((0, self.dim), np.float32)
+
+    def __call__(self, texts: List[str], model: Optional[str] = None) -> List[List[float]]:
+        return self.embed_many(texts).tolist()
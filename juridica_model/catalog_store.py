@@ -0,0 +1,203 @@
+# catalog_store.py
+# Catálogo de resoluciones (1 fila por PDF) en SQLite.
+# Reemplaza el catalog.json que ingest.py reescribía completo en cada corrida:
+# las filas se actualizan por archivo (upsert), sobreviven entre corridas y
+# se consultan por índice (resolución, número interno, PA, tipo de sanción)
+# sin cargar todo el catálogo en memoria.
+#
+# Uso:  python catalog_store.py find DJ-0612
+#       python catalog_store.py export catalog.json
+from __future__ import annotations
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+CATALOG_DB = os.getenv("CATALOG_DB", "chroma_index/catalog.db")
+
+FIELDS = ("resolucion", "interno", "pa", "sancion", "tipo")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS catalog (
+    source      TEXT PRIMARY KEY,
+    resolucion  TEXT,
+    interno     TEXT COLLATE NOCASE,
+    pa          TEXT COLLATE NOCASE,
+    sancion     TEXT,
+    tipo        TEXT,
+    file_id     TEXT,
+    status      TEXT NOT NULL DEFAULT 'ok',   -- ok | failed
+    error       TEXT,
+    updated_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_catalog_resolucion ON catalog(resolucion);
+CREATE INDEX IF NOT EXISTS idx_catalog_interno    ON catalog(interno);
+CREATE INDEX IF NOT EXISTS idx_catalog_pa         ON catalog(pa);
+CREATE INDEX IF NOT EXISTS idx_catalog_tipo       ON catalog(tipo);
+CREATE INDEX IF NOT EXISTS idx_catalog_status     ON catalog(status);
+"""
+
+
+class CatalogStore:
+    """
+    Catálogo persistente. Una conexión por hilo (Gradio atiende cada
+    consulta en su propio hilo) y modo WAL para que la ingestión pueda
+    escribir mientras el chatbot lee.
+    """
+
+    def __init__(self, path: str | Path = CATALOG_DB):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ── Escritura ────────────────────────────────
+    def upsert(self, source: str, meta: Dict[str, Any], file_id: Optional[str] = None) -> None:
+        """Inserta o actualiza la fila del PDF y la marca como correcta."""
+        values = [meta.get(f) for f in FIELDS]
+        with self._conn() as conn:
+            conn.execute(
+                """
+                INSERT INTO catalog (source, resolucion, interno, pa, sancion, tipo,
+                                     file_id, status, error, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 'ok', NULL, ?)
+                ON CONFLICT(source) DO UPDATE SET
+                    resolucion = excluded.resolucion,
+                    interno    = excluded.interno,
+                    pa         = excluded.pa,
+                    sancion    = excluded.sancion,
+                    tipo       = excluded.tipo,
+                    file_id    = COALESCE(excluded.file_id, catalog.file_id),
+                    status     = 'ok',
+                    error      = NULL,
+                    updated_at = excluded.updated_at
+                """,
+                (source, *values, file_id, time.time()),
+            )
+
+    def mark_failed(self, source: str, error: str) -> None:
+        """Marca el PDF como fallido sin borrar los metadatos que ya tenía."""
+        with self._conn() as conn:
+            conn.execute(
+                """
+                INSERT INTO catalog (source, status, error, updated_at)
+                VALUES (?, 'failed', ?, ?)
+                ON CONFLICT(source) DO UPDATE SET
+                    status = 'failed', error = excluded.error, updated_at = excluded.updated_at
+                """,
+                (source, error, time.time()),
+            )
+
+    def backfill(self, rows: Iterable[tuple]) -> int:
+        """
+        Agrega las fuentes que faltan desde (source, meta, file_id), p. ej. los
+        metadatos ya guardados en el índice vectorial; no toca las existentes.
+        """
+        values = [(source, *[(meta or {}).get(f) for f in FIELDS], file_id, time.time())
+                  for source, meta, file_id in rows]
+        with self._conn() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO catalog (source, resolucion, interno, pa, sancion, tipo, file_id, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                values,
+            )
+            return conn.total_changes - before
+
+    def import_json(self, path: str | Path) -> int:
+        """Carga un catalog.json antiguo (solo las fuentes que aún no están)."""
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        known = self.sources()
+        rows = [(name, *[(row or {}).get(f) for f in FIELDS], time.time())
+                for name, row in data.items() if name not in known]
+        with self._conn() as conn:
+            conn.executemany(
+                "INSERT INTO catalog (source, resolucion, interno, pa, sancion, tipo, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        return len(rows)
+
+    # ── Consulta ─────────────────────────────────
+    def get(self, source: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT * FROM catalog WHERE source = ?", (source,)).fetchone()
+        return dict(row) if row else None
+
+    def lookup(self, identifier: str) -> List[Dict[str, Any]]:
+        """Filas cuyo número de resolución, número interno o PA coincide con `identifier`."""
+        ident = identifier.strip()
+        rows = self._conn().execute(
+            """
+            SELECT * FROM catalog WHERE resolucion = ?1
+            UNION SELECT * FROM catalog WHERE interno = ?1
+            UNION SELECT * FROM catalog WHERE pa = ?1
+            ORDER BY source
+            """,
+            (ident,),
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    def find(self, limit: int = 100, status: Optional[str] = "ok", **filters: Any) -> List[Dict[str, Any]]:
+        """Búsqueda por igualdad en columnas indexadas, p. ej. find(tipo="multa")."""
+        unknown = set(filters) - set(FIELDS) - {"source", "file_id"}
+        if unknown:
+            raise ValueError(f"Columnas no válidas: {', '.join(sorted(unknown))}")
+        clauses = [f"{col} = ?" for col in filters]
+        params: List[Any] = list(filters.values())
+        if status:
+            clauses.append("status = ?")
+            params.append(status)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._conn().execute(
+            f"SELECT * FROM catalog {where} ORDER BY source LIMIT ?", (*params, limit)
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    def failed(self) -> List[Dict[str, Any]]:
+        return self.find(limit=-1, status="failed")
+
+    def sources(self) -> set:
+        return {r[0] for r in self._conn().execute("SELECT source FROM catalog")}
+
+    def count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM catalog").fetchone()[0]
+
+    def export_json(self, path: str | Path) -> None:
+        """Vuelca el catálogo con el formato del antiguo catalog.json."""
+        rows = self._conn().execute("SELECT * FROM catalog ORDER BY source").fetchall()
+        data = {r["source"]: {"source": r["source"], **{f: r[f] for f in FIELDS}} for r in rows}
+        Path(path).write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def record_failures(store: CatalogStore, failures: Iterable[tuple]) -> None:
+    """Registra los archivos fallidos de un IngestionReport."""
+    for name, reason in failures:
+        store.mark_failed(name, reason)
+
+
+if __name__ == "__main__":
+    store = CatalogStore()
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "count"
+    if cmd == "find" and len(sys.argv) > 2:
+        for row in store.lookup(sys.argv[2]):
+            print(row)
+    elif cmd == "export" and len(sys.argv) > 2:
+        store.export_json(sys.argv[2])
+        print(f"✅ Catálogo exportado a {sys.argv[2]}")
+    else:
+        print(f"{store.count()} documentos en {store.path} ({len(store.failed())} fallidos)")
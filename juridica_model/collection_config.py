@@ -0,0 +1,333 @@
+# collection_config.py
+# Aprovisionamiento de la colección de Qdrant: cuantización, almacenamiento en
+# disco, parámetros HNSW y parámetros de búsqueda. Incluye una ruta de migración
+# que reconstruye una colección existente con la nueva configuración y un
+# pequeño reporte (RAM estimada por millón de chunks + latencia p95).
+from __future__ import annotations
+import os
+import time
+import statistics
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List, Optional
+
+from qdrant_client import QdrantClient
+from qdrant_client.models import (
+    Distance, VectorParams, PointStruct, HnswConfigDiff, SearchParams, QuantizationSearchParams,
+    ScalarQuantization, ScalarQuantizationConfig, ScalarType,
+    ProductQuantization, ProductQuantizationConfig, CompressionRatio,
+    CreateAliasOperation, CreateAlias, DeleteAliasOperation, DeleteAlias,
+)
+
+VECTOR_SIZE = 768
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    val = os.getenv(name)
+    if val is None or not val.strip():
+        return default
+    return val.strip().lower() in ("1", "true", "yes", "si", "sí", "on")
+
+
+def _env_int(name: str, default: Optional[int]) -> Optional[int]:
+    val = os.getenv(name)
+    return int(val) if val and val.strip() else default
+
+
+def _env_float(name: str, default: Optional[float]) -> Optional[float]:
+    val = os.getenv(name)
+    return float(val) if val and val.strip() else default
+
+
+# ── Configuración ────────────────────────────────
+@dataclass(frozen=True)
+class CollectionSettings:
+    """Parámetros de almacenamiento e índice de la colección."""
+    vector_size: int = VECTOR_SIZE
+    quantization: str = "none"          # none | scalar | product
+    quantile: float = 0.99              # solo cuantización escalar
+    product_compression: str = "x16"    # x4 | x8 | x16 | x32 | x64
+    quantized_always_ram: bool = True
+    on_disk_vectors: bool = False
+    on_disk_payload: bool = False
+    hnsw_m: Optional[int] = None        # None = valor por defecto del servidor (16)
+    hnsw_ef_construct: Optional[int] = None  # None = valor por defecto (100)
+    search_ef: Optional[int] = None     # hnsw_ef en tiempo de búsqueda
+    rescore: bool = True                # re-puntuar con vectores originales
+    oversampling: Optional[float] = None
+
+    @classmethod
+    def from_env(cls) -> "CollectionSettings":
+        """Lee la configuración desde variables QDRANT_* del entorno."""
+        return cls(
+            vector_size=_env_int("QDRANT_VECTOR_SIZE", VECTOR_SIZE),
+            quantization=(os.getenv("QDRANT_QUANTIZATION") or "none").strip().lower(),
+            quantile=_env_float("QDRANT_QUANTILE", 0.99),
+            product_compression=(os.getenv("QDRANT_PQ_COMPRESSION") or "x16").strip().lower(),
+            quantized_always_ram=_env_bool("QDRANT_QUANTIZED_ALWAYS_RAM", True),
+            on_disk_vectors=_env_bool("QDRANT_ON_DISK_VECTORS", False),
+            on_disk_payload=_env_bool("QDRANT_ON_DISK_PAYLOAD", False),
+            hnsw_m=_env_int("QDRANT_HNSW_M", None),
+            hnsw_ef_construct=_env_int("QDRANT_HNSW_EF_CONSTRUCT", None),
+            search_ef=_env_int("QDRANT_SEARCH_EF", None),
+            rescore=_env_bool("QDRANT_RESCORE", True),
+            oversampling=_env_float("QDRANT_OVERSAMPLING", None),
+        )
+
+
+def quantization_config(settings: CollectionSettings):
+    """Devuelve la configuración de cuantización de Qdrant (o None)."""
+    if settings.quantization == "scalar":
+        return ScalarQuantization(scalar=ScalarQuantizationConfig(
+            type=ScalarType.INT8,
+            quantile=settings.quantile,
+            always_ram=settings.quantized_always_ram,
+        ))
+    if settings.quantization == "product":
+        return ProductQuantization(product=ProductQuantizationConfig(
+            compression=CompressionRatio(settings.product_compression),
+            always_ram=settings.quantized_always_ram,
+        ))
+    if settings.quantization not in ("", "none"):
+        raise ValueError(f"❌ Cuantización no soportada: {settings.quantization}")
+    return None
+
+
+def hnsw_config(settings: CollectionSettings) -> Optional[HnswConfigDiff]:
+    if settings.hnsw_m is None and settings.hnsw_ef_construct is None:
+        return None
+    return HnswConfigDiff(m=settings.hnsw_m, ef_construct=settings.hnsw_ef_construct)
+
+
+def vectors_config(settings: CollectionSettings) -> VectorParams:
+    return VectorParams(
+        size=settings.vector_size,
+        distance=Distance.COSINE,
+        on_disk=settings.on_disk_vectors,
+    )
+
+
+def search_params(settings: CollectionSettings) -> Optional[SearchParams]:
+    """Parámetros de búsqueda (ef y re-puntuación) para pasar a `search`."""
+    quant = None
+    if settings.quantization in ("scalar", "product"):
+        quant = QuantizationSearchParams(
+            ignore=False,
+            rescore=settings.rescore,
+            oversampling=settings.oversampling,
+        )
+    if settings.search_ef is None and quant is None:
+        return None
+    return SearchParams(hnsw_ef=settings.search_ef, quantization=quant)
+
+
+# ── Alias y existencia ────────────────────────────
+def resolve_collection(client: QdrantClient, name: str) -> Optional[str]:
+    """Nombre físico de la colección (sigue alias). None si no existe."""
+    try:
+        for alias in client.get_aliases().aliases:
+            if alias.alias_name == name:
+                return alias.collection_name
+    except Exception as e:
+        print(f"⚠️ No se pudieron leer los alias de Qdrant: {e}")
+    collections = client.get_collections().collections
+    return name if any(col.name == name for col in collections) else None
+
+
+def create_collection(client: QdrantClient, name: str, settings: CollectionSettings) -> None:
+    client.create_collection(
+        collection_name=name,
+        vectors_config=vectors_config(settings),
+        hnsw_config=hnsw_config(settings),
+        quantization_config=quantization_config(settings),
+        on_disk_payload=settings.on_disk_payload,
+    )
+
+
+def ensure_collection(client: QdrantClient, name: str, settings: CollectionSettings) -> bool:
+    """Crea la colección si no existe. Devuelve True si ya existía."""
+    if resolve_collection(client, name):
+        return True
+    print(f"Creando colección '{name}' en Qdrant ({describe(settings)})...")
+    create_collection(client, name, settings)
+    return False
+
+
+def describe(settings: CollectionSettings) -> str:
+    parts = [f"quant={settings.quantization}"]
+    if settings.on_disk_vectors:
+        parts.append("vectores en disco")
+    if settings.on_disk_payload:
+        parts.append("payload en disco")
+    if settings.hnsw_m or settings.hnsw_ef_construct:
+        parts.append(f"hnsw m={settings.hnsw_m} ef_construct={settings.hnsw_ef_construct}")
+    return ", ".join(parts)
+
+
+# ── Migración ───────────────────────────────────
+def migrate_collection(client: QdrantClient, name: str, settings: CollectionSettings,
+                       batch_size: int = 256, drop_old: bool = True) -> str:
+    """
+    Reconstruye `name` con la nueva configuración.
+
+    Copia todos los puntos (vector + payload) a una colección nueva y luego
+    apunta el alias `name` a ella, de modo que el código que consulta por
+    `name` no cambia. Si `name` era una colección física, se elimina justo
+    antes de crear el alias (ventana breve sin colección).
+    """
+    source = resolve_collection(client, name)
+    if not source:
+        raise RuntimeError(f"No existe la colección '{name}' para migrar")
+
+    target = f"{name}_{time.strftime('%Y%m%d%H%M%S')}"
+    print(f"🔁 Migrando '{source}' → '{target}' ({describe(settings)})")
+    create_collection(client, target, settings)
+
+    copied = 0
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=source,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        if points:
+            client.upsert(
+                collection_name=target,
+                points=[PointStruct(id=p.id, vector=p.vector, payload=p.payload) for p in points],
+                wait=True,
+            )
+            copied += len(points)
+            print(f"  copiados {copied} puntos...")
+        if offset is None:
+            break
+
+    expected = client.count(collection_name=source, exact=True).count
+    got = client.count(collection_name=target, exact=True).count
+    if got != expected:
+        raise RuntimeError(f"Migración incompleta: {got}/{expected} puntos copiados; '{name}' no se modificó")
+
+    ops: List[Any] = []
+    if source == name:
+        # Era una colección física: hay que liberarla para usar el nombre como alias
+        client.delete_collection(collection_name=name)
+    else:
+        ops.append(DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=name)))
+    ops.append(CreateAliasOperation(create_alias=CreateAlias(collection_name=target, alias_name=name)))
+    client.update_collection_aliases(change_aliases_operations=ops)
+
+    if drop_old and source != name:
+        client.delete_collection(collection_name=source)
+    print(f"✅ Migración completa: alias '{name}' → '{target}' ({copied} puntos)")
+    return target
+
+
+# ── Medición ────────────────────────────────────
+def estimate_ram_bytes(num_points: int, settings: CollectionSettings,
+                       avg_payload_bytes: int = 2000) -> int:
+    """
+    Estimación de RAM residente según la guía de capacidad de Qdrant:
+    vectores (float32 o cuantizados) + grafo HNSW + payload si no va a disco,
+    con un 50 % de margen de trabajo.
+    """
+    dim = settings.vector_size
+    if settings.quantization == "scalar" and settings.quantized_always_ram:
+        vec = dim  # int8
+    elif settings.quantization == "product" and settings.quantized_always_ram:
+        vec = dim * 4 // int(settings.product_compression.lstrip("x"))
+    else:
+        vec = 0 if settings.on_disk_vectors else dim * 4
+    graph = (settings.hnsw_m or 16) * 2 * 4
+    payload = 0 if settings.on_disk_payload else avg_payload_bytes
+    return int(num_points * (vec + graph + payload) * 1.5)
+
+
+def measure_search_latency(client: QdrantClient, name: str, settings: CollectionSettings,
+                           samples: int = 50, limit: int = 10) -> Dict[str, float]:
+    """Lanza `samples` búsquedas con vectores existentes y devuelve p50/p95 en ms."""
+    points, _ = client.scroll(collection_name=name, limit=samples,
+                              with_payload=False, with_vectors=True)
+    params = search_params(settings)
+    timings = []
+    for p in points:
+        t0 = time.perf_counter()
+        client.query_points(collection_name=name, query=p.vector, limit=limit,
+                            with_payload=False, search_params=params)
+        timings.append((time.perf_counter() - t0) * 1000)
+    if not timings:
+        return {"samples": 0}
+    timings.sort()
+    return {
+        "samples": len(timings),
+        "p50_ms": round(statistics.median(timings), 2),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 2),
+    }
+
+
+def settings_from_collection(info, search: CollectionSettings) -> CollectionSettings:
+    """Reconstruye la configuración vigente a partir de `get_collection`."""
+    params = info.config.params
+    vec = params.vectors
+    quant = info.config.quantization_config
+    kind, compression = "none", "x16"
+    if getattr(quant, "scalar", None) is not None:
+        kind = "scalar"
+    elif getattr(quant, "product", None) is not None:
+        kind = "product"
+        compression = str(getattr(quant.product.compression, "value", quant.product.compression))
+    return CollectionSettings(
+        vector_size=vec.size,
+        quantization=kind,
+        product_compression=compression,
+        on_disk_vectors=bool(vec.on_disk),
+        on_disk_payload=bool(params.on_disk_payload),
+        hnsw_m=info.config.hnsw_config.m,
+        hnsw_ef_construct=info.config.hnsw_config.ef_construct,
+        search_ef=search.search_ef,
+        rescore=search.rescore,
+        oversampling=search.oversampling,
+    )
+
+
+def report(client: QdrantClient, name: str, settings: CollectionSettings) -> Dict[str, Any]:
+    """Configuración vigente, RAM estimada y latencia de la colección `name`."""
+    physical = resolve_collection(client, name)
+    if not physical:
+        return {"collection": name, "exists": False}
+    info = client.get_collection(physical)
+    settings = settings_from_collection(info, settings)
+    return {
+        "collection": name,
+        "physical": physical,
+        "points": info.points_count,
+        "settings": asdict(settings),
+        "ram_per_million_mb": round(estimate_ram_bytes(1_000_000, settings) / 2**20, 1),
+        "ram_estimated_mb": round(estimate_ram_bytes(info.points_count or 0, settings) / 2**20, 1),
+        "latency": measure_search_latency(client, physical, settings),
+    }
+
+
+if __name__ == "__main__":
+    # Uso:  python collection_config.py report
+    #       python collection_config.py migrate
+    import sys
+    import json
+
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "report"
+    name = os.getenv("QDRANT_COLLECTION", "resoluciones")
+    _client = QdrantClient(url=os.getenv("QDRANT_URL"), api_key=os.getenv("QDRANT_API_KEY"))
+    _settings = CollectionSettings.from_env()
+
+    if cmd == "migrate":
+        print(json.dumps({"antes": report(_client, name, _settings)}, indent=2, ensure_ascii=False))
+        migrate_collection(_client, name, _settings)
+        print(json.dumps({"despues": report(_client, name, _settings)}, indent=2, ensure_ascii=False))
+    else:
+        print(json.dumps(report(_client, name, _settings), indent=2, ensure_ascii=False))
@@ -0,0 +1,168 @@
+# context_builder.py
+# Arma el contexto del prompt a partir de los chunks recuperados.
+#   1. Ordena por score.
+#   2. Fusiona chunks de la misma fuente y página que se traslapan o son
+#      consecutivos (usando los offsets start/end del payload; si no están,
+#      detecta el traslape del splitter comparando texto).
+#   3. Descarta duplicados y casi duplicados: bloques cuyos shingles de palabras
+#      ya están en su mayoría en un bloque elegido antes (contención).
+#   4. Llena un presupuesto de tokens en orden de score.
+from __future__ import annotations
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional
+
+from rate_control import estimate_tokens
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 3000))
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", 0.8))
+
+SEPARATOR = "\n\n---\n\n"
+# Campos del payload que lee build_context (proyección para las búsquedas)
+CONTEXT_PAYLOAD_FIELDS = ["document", "metadata.source", "metadata.page", "metadata.start",
+                          "metadata.end", "metadata.chunk"]
+_SHINGLE = 3
+_MAX_TEXT_OVERLAP = 400   # mayor que el traslape del splitter (150/200)
+_MIN_TEXT_OVERLAP = 20
+
+
+@dataclass
+class ContextBlock:
+    text: str
+    score: float
+    source: str
+    page: Optional[int]
+    start: Optional[int] = None
+    end: Optional[int] = None
+    chunks: List[Optional[int]] = field(default_factory=list)
+    metadatas: List[Dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def header(self) -> str:
+        page = f", pág. {self.page + 1}" if isinstance(self.page, int) else ""
+        return f"[{self.source}{page}]"
+
+
+@dataclass
+class PackedContext:
+    text: str
+    blocks: List[ContextBlock]
+    tokens: int
+    stats: Dict[str, int]
+
+    @property
+    def metadatas(self) -> List[Dict[str, Any]]:
+        return [m for b in self.blocks for m in b.metadatas]
+
+
+def _shingles(text: str) -> set:
+    words = text.lower().split()
+    if len(words) < _SHINGLE:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + _SHINGLE]) for i in range(len(words) - _SHINGLE + 1)}
+
+
+def _text_overlap(a: str, b: str) -> int:
+    """Largo del sufijo de `a` que es prefijo de `b` (traslape del splitter)."""
+    for k in range(min(len(a), len(b), _MAX_TEXT_OVERLAP), _MIN_TEXT_OVERLAP - 1, -1):
+        if a.endswith(b[:k]):
+            return k
+    return 0
+
+
+def _merge(a: ContextBlock, b: ContextBlock) -> Optional[ContextBlock]:
+    """Une `b` a continuación de `a` si son contiguos; None si no lo son."""
+    if a.source != b.source or a.page != b.page:
+        return None
+    if None not in (a.start, a.end, b.start, b.end):
+        if b.start < a.start:
+            a, b = b, a
+        if b.start > a.end + 2:
+            return None
+        if b.end <= a.end:
+            text, end = a.text, a.end
+        elif b.start >= a.end:
+            text, end = a.text + " " + b.text, b.end
+        else:
+            text, end = a.text + b.text[a.end - b.start:], b.end
+    else:
+        consecutive = None not in (a.chunks[-1], b.chunks[0]) and b.chunks[0] - a.chunks[-1] == 1
+        k = _text_overlap(a.text, b.text)
+        if not k and not consecutive:
+            return None
+        text, end = (a.text + b.text[k:]) if k else (a.text + " " + b.text), None
+    return ContextBlock(text, max(a.score, b.score), a.source, a.page, a.start, end,
+                        a.chunks + b.chunks, a.metadatas + b.metadatas)
+
+
+def _block_from_hit(hit: Any) -> ContextBlock:
+    payload = hit.payload if hasattr(hit, "payload") else hit
+    meta = payload.get("metadata") or {}
+    return ContextBlock(
+        text=payload.get("document") or "",
+        score=float(getattr(hit, "score", 0.0) or 0.0),
+        source=meta.get("source", ""),
+        page=meta.get("page"),
+        start=meta.get("start"),
+        end=meta.get("end"),
+        chunks=[meta.get("chunk")],
+        metadatas=[meta],
+    )
+
+
+def merge_adjacent(blocks: List[ContextBlock]) -> List[ContextBlock]:
+    """Fusiona chunks contiguos de la misma fuente y página."""
+    groups: Dict[tuple, List[ContextBlock]] = {}
+    for b in blocks:
+        groups.setdefault((b.source, b.page), []).append(b)
+    out: List[ContextBlock] = []
+    for group in groups.values():
+        group.sort(key=lambda b: (b.start if b.start is not None else -1,
+                                  b.chunks[0] if b.chunks[0] is not None else -1))
+        current = group[0]
+        for nxt in group[1:]:
+            merged = _merge(current, nxt)
+            if merged is None:
+                out.append(current)
+                current = nxt
+            else:
+                current = merged
+        out.append(current)
+    out.sort(key=lambda b: b.score, reverse=True)
+    return out
+
+
+def build_context(hits: Iterable[Any], token_budget: int = CONTEXT_TOKEN_BUDGET,
+                  dedup_threshold: float = NEAR_DUPLICATE_THRESHOLD, headers: bool = True) -> PackedContext:
+    """
+    Contexto deduplicado y acotado a `token_budget` tokens.
+    `hits` son SearchHit (o payloads {"document", "metadata"}) en cualquier orden.
+    """
+    blocks = [_block_from_hit(h) for h in hits]
+    blocks = [b for b in blocks if b.text.strip()]
+    stats = {"chunks_in": len(blocks), "merged": 0, "duplicates": 0, "over_budget": 0}
+
+    blocks.sort(key=lambda b: b.score, reverse=True)
+    merged = merge_adjacent(blocks)
+    stats["merged"] = len(blocks) - len(merged)
+
+    kept: List[ContextBlock] = []
+    kept_shingles: List[set] = []
+    tokens = 0
+    for block in merged:
+        sh = _shingles(block.text)
+        if any(len(sh & other) / (len(sh) or 1) >= dedup_threshold for other in kept_shingles):
+            stats["duplicates"] += 1
+            continue
+        text = f"{block.header}\n{block.text}" if headers else block.text
+        cost = estimate_tokens(text)
+        if tokens + cost > token_budget and kept:
+            stats["over_budget"] += 1
+            continue
+        kept.append(block)
+        kept_shingles.append(sh)
+        tokens += cost
+
+    parts = [f"{b.header}\n{b.text}" if headers else b.text for b in kept]
+    stats["blocks_out"] = len(kept)
+    return PackedContext(SEPARATOR.join(parts), kept, tokens, stats)
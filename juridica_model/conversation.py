@@ -0,0 +1,156 @@
+# conversation.py
+# Estado de conversación por sesión para el chat.
+# Guarda los últimos turnos y las entidades activas (resolución, número
+# interno, PA, persona, archivo) de cada sesión. Con eso:
+#   - una pregunta de seguimiento ("¿y qué sanción recibió?") se reescribe
+#     como consulta independiente agregando las entidades activas
+#   - si el seguimiento es corto, no nombra nada nuevo y el turno anterior ya
+#     trajo el contexto de esa resolución, se reutiliza sin volver a buscar
+from __future__ import annotations
+import os
+import re
+import time
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional
+
+from metadata_extractor import int_regex, pa_regex, res_regex
+
+MAX_TURNS = int(os.getenv("CHAT_MEMORY_TURNS", 6))
+SESSION_TTL = float(os.getenv("CHAT_MEMORY_TTL", 3600))
+MAX_SESSIONS = int(os.getenv("CHAT_MEMORY_SESSIONS", 1000))
+
+# "contra Carlos Francisco Soto", "de María Pérez"
+_NAME = r"[A-ZÁÉÍÓÚÑ][a-záéíóúñ]+"
+PERSON_RE = re.compile(rf"\b(?:contra|de|del|a|sobre)\s+({_NAME}(?:\s+(?:de\s+)?{_NAME}){{1,3}})")
+# Marcas de seguimiento: conector al inicio ("¿Y cuál fue el plazo?") o
+# demostrativo con el asunto ("esa resolución"). Los posesivos y clíticos
+# sueltos (su, sus, le, mismo) no cuentan: aparecen en preguntas nuevas
+# ("resoluciones con multa y su monto").
+LEADING_RE = re.compile(r"^\s*[¿¡]?\s*(?:y|e|entonces|pero|adem[aá]s|tambi[eé]n)\b", re.IGNORECASE)
+ANAPHORA_RE = re.compile(
+    r"\b(?:es[ae]s?|dich[oa]s?|aquel(?:la|los|las)?|(?:el|la) mism[oa])\s+"
+    r"(?:resoluci[oó]n|caso|expediente|procedimiento|persona|funcionari[oa]|investigad[oa]|sanci[oó]n|documento)\b",
+    re.IGNORECASE,
+)
+# Pregunta corta sin sujeto ("¿Qué sanción recibió?"): probable seguimiento
+QUESTION_RE = re.compile(r"^\s*¿?\s*(?:qu[eé]|cu[aá]l(?:es)?|cu[aá]ndo|c[oó]mo|qui[eé]n(?:es)?|d[oó]nde|cu[aá]nt[oa]s?)\b",
+                         re.IGNORECASE)
+_SHORT_QUERY_WORDS = 8
+
+
+def extract_entities(text: str) -> Dict[str, str]:
+    """Identificadores y nombres citados explícitamente en `text`."""
+    found: Dict[str, str] = {}
+    if m := res_regex.search(text):
+        found["resolucion"] = m.group()
+    if m := int_regex.search(text.upper()):
+        found["interno"] = m.group()
+    if m := pa_regex.search(text):
+        found["pa"] = m.group().upper()
+    if m := PERSON_RE.search(text):
+        found["persona"] = m.group(1)
+    return found
+
+
+@dataclass
+class Turn:
+    query: str
+    standalone: str
+    answer: str
+    hits: List[Any]
+    at: float = field(default_factory=time.time)
+
+
+@dataclass
+class QueryPlan:
+    query: str                        # consulta independiente para buscar y para el prompt
+    follow_up: bool = False
+    reuse_hits: Optional[List[Any]] = None
+
+
+@dataclass
+class ConversationState:
+    turns: Deque[Turn] = field(default_factory=lambda: deque(maxlen=MAX_TURNS))
+    entities: Dict[str, str] = field(default_factory=dict)
+    updated: float = field(default_factory=time.time)
+
+    def plan(self, query: str) -> QueryPlan:
+        """Decide si `query` es un seguimiento y cómo resolverla."""
+        mentioned = extract_entities(query)
+        if not self.turns or not self.entities:
+            return QueryPlan(query)
+        explicit = bool(LEADING_RE.search(query) or ANAPHORA_RE.search(query))
+        short = len(query.split()) <= _SHORT_QUERY_WORDS and not mentioned
+        short_question = short and bool(QUESTION_RE.search(query))
+        if not explicit and not short_question:
+            return QueryPlan(query)
+
+        # Entidades activas que la pregunta no reemplaza
+        carry = {k: v for k, v in self.entities.items() if k not in mentioned}
+        parts = []
+        if carry.get("resolucion"):
+            parts.append(f"resolución {carry['resolucion']}")
+        if carry.get("interno"):
+            parts.append(f"número interno {carry['interno']}")
+        if carry.get("pa"):
+            parts.append(f"expediente {carry['pa']}")
+        if carry.get("persona"):
+            parts.append(carry["persona"])
+        standalone = f"{query} ({', '.join(parts)})" if parts else query
+
+        last = self.turns[-1]
+        reuse = None
+        if explicit and short and last.hits and self.entities.get("source"):
+            # Seguimiento corto sin asunto nuevo: el turno anterior ya trajo el
+            # contexto del mismo documento. Una pregunta más larga se reescribe
+            # pero se busca de nuevo.
+            sources = {(h.payload.get("metadata") or {}).get("source") for h in last.hits}
+            if self.entities["source"] in sources:
+                reuse = last.hits
+        return QueryPlan(standalone, follow_up=True, reuse_hits=reuse)
+
+    def record(self, query: str, plan: QueryPlan, hits: List[Any], answer: str) -> None:
+        mentioned = extract_entities(query)
+        if mentioned:
+            # Un identificador nuevo cambia de asunto: no arrastrar el archivo anterior
+            if {"resolucion", "interno", "pa"} & set(mentioned):
+                self.entities.pop("source", None)
+            self.entities.update(mentioned)
+        if hits and plan.reuse_hits is None:
+            # El documento mejor rankeado pasa a ser el asunto activo
+            top = hits[0].payload.get("metadata") or {}
+            if top.get("source"):
+                self.entities["source"] = top["source"]
+            for key in ("resolucion", "interno", "pa"):
+                if top.get(key) and key not in mentioned:
+                    self.entities[key] = top[key]
+        self.turns.append(Turn(query, plan.query, answer, hits))
+        self.updated = time.time()
+
+
+class ConversationStore:
+    """Estados por sesión (LRU acotado, con expiración por inactividad)."""
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, ttl: float = SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, ConversationState]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> ConversationState:
+        now = time.time()
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is None or now - state.updated > self.ttl:
+                state = ConversationState()
+                self._sessions[session_id] = state
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return state
+
+    def reset(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
@@ -1,35 +1,88 @@
 import os
-import uuid
-import google.generativeai as genai
-from typing import List, Dict, Tuple, Optional
-from qdrant_client import QdrantClient
-from qdrant_client.models import PointStruct, Distance, VectorParams
-import PyPDF2
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Dict, Tuple, Optional
+import services
+from vector_store import SearchHit, VectorStore
+from gemini_utils import configure, embed_queries, embed_query, generate
+from rate_control import QuotaExceeded
+from google.api_core.exceptions import ResourceExhausted
+from retrieval import CutoffConfig, Retriever
+from tracing import traced, wrap
 from datetime import datetime
+# PyPDF2 y reportlab se importan al leer / generar el PDF (arranque en frío)
+
+# Sin cuota de Gemini (local o de la API): el análisis falla en vez de degradarse
+QUOTA_ERRORS = (QuotaExceeded, ResourceExhausted)
+
+# "ARGUMENTO 3: Título" (formato pedido en generate_legal_summary)
+ARGUMENT_RE = re.compile(r"^\s*ARGUMENTO\s+(\d+)\s*[:.\-]\s*(.*)$", re.IGNORECASE | re.MULTILINE)
+
+# Llamadas de Gemini en paralelo al calificar precedentes
+GRADING_WORKERS = int(os.getenv("ANALYZER_GRADING_WORKERS", 4))
+# El análisis de precedentes toma minutos: puede esperar más cuota que el chat
+LLM_MAX_WAIT = float(os.getenv("ANALYZER_LLM_MAX_WAIT", 120))
+# Campos del payload que usa la calificación y el reporte de precedentes
+PRECEDENT_PAYLOAD_FIELDS = ["document", "metadata.source", "metadata.resolucion",
+                            "metadata.interno", "metadata.page", "metadata.chunk"]
+
+
+def split_arguments(legal_summary: str) -> List[Dict[str, str]]:
+   """Argumentos numerados del resumen jurídico: [{numero, titulo, texto}]"""
+   matches = list(ARGUMENT_RE.finditer(legal_summary or ""))
+   arguments = []
+   for i, m in enumerate(matches):
+       end = matches[i + 1].start() if i + 1 < len(matches) else len(legal_summary)
+       text = legal_summary[m.start():end].strip()
+       if text:
+           arguments.append({"numero": m.group(1), "titulo": m.group(2).strip(), "texto": text})
+   return arguments
+
 
 class DocumentAnalyzer:
-   def __init__(self, gemini_api_key: str, qdrant_url: str, qdrant_api_key: str, collection_name: str = "resoluciones"):
+   def __init__(self, gemini_api_key: str, qdrant_url: str, qdrant_api_key: str, collection_name: str = "resoluciones",
+                vector_store: Optional[VectorStore] = None):
        """
-       Inicializa el analizador de documentos
+       Inicializa el analizador de documentos.
+       Si no se pasa `vector_store`, se usa el almacén compartido del proceso
+       (services.shared_vector_store); el cliente y el modelo se crean en el primer uso.
        """
        self.gemini_api_key = gemini_api_key
        self.qdrant_url = qdrant_url
        self.qdrant_api_key = qdrant_api_key
        self.collection_name = collection_name
        
-       # Configurar Gemini
-       genai.configure(api_key=gemini_api_key)
-       self.llm = genai.GenerativeModel('gemini-1.5-flash')
-       
-       # Configurar Qdrant
-       self.qdrant_client = QdrantClient(url=qdrant_url, api_key=qdrant_api_key)
+       # Configurar almacén vectorial
+       self.vector_store = vector_store or services.shared_vector_store(
+           collection_name, qdrant_url=qdrant_url, qdrant_api_key=qdrant_api_key
+       )
+       # Cada precedente cuesta una llamada de Gemini: solo los que destacan en score
+       self.retriever = Retriever(
+           self.vector_store,
+           CutoffConfig.from_env(CutoffConfig(fetch_k=20, min_k=2, max_k=15)),
+           label="precedentes",
+           payload_fields=PRECEDENT_PAYLOAD_FIELDS,
+       )
+   
+   def _configure(self):
+       """Configura Gemini con la clave del analizador (una vez por proceso; el SDK se importa aquí)"""
+       configure(api_key=self.gemini_api_key)
    
+   @property
+   def llm(self):
+       """Modelo de Gemini compartido (se crea en la primera llamada)"""
+       self._configure()
+       return services.llm('gemini-1.5-flash')
+   
+   def _generate(self, prompt: str):
+       """Generación con admisión por cuota (ver rate_control)"""
+       return generate(self.llm, prompt, max_wait=LLM_MAX_WAIT)
+   
+   @traced("analysis.extract_pdf")
    def extract_text_from_pdf(self, pdf_path: str) -> str:
        """Extrae texto de un archivo PDF"""
+       import PyPDF2
        try:
            with open(pdf_path, 'rb') as file:
                reader = PyPDF2.PdfReader(file)
@@ -40,6 +93,7 @@ class DocumentAnalyzer:
        except Exception as e:
            raise Exception(f"Error al extraer texto del PDF: {str(e)}")
    
+   @traced("analysis.facts_summary")
    def generate_facts_summary(self, document_text: str) -> str:
        """Genera resumen conciso de hechos y personas usando Gemini"""
        prompt_facts = """
@@ -76,11 +130,12 @@ class DocumentAnalyzer:
                sample_text = f"{start_chunk}\n\n{middle_chunk}\n\n{end_chunk}"
                document_text = sample_text
            
-           response = self.llm.generate_content(prompt_facts.format(document_text=document_text))
+           response = self._generate(prompt_facts.format(document_text=document_text))
            return response.text
        except Exception as e:
            return f"Error al generar resumen de hechos: {str(e)}"
    
+   @traced("analysis.legal_summary")
    def generate_legal_summary(self, document_text: str) -> str:
        """Genera resumen de los 5 principales argumentos jurídicos usando Gemini"""
        prompt_legal = """
@@ -132,7 +187,7 @@ class DocumentAnalyzer:
                sample_text = f"{start_chunk}\n\n{middle_chunk}\n\n{end_chunk}"
                document_text = sample_text
            
-           response = self.llm.generate_content(prompt_legal.format(document_text=document_text))
+           response = self._generate(prompt_legal.format(document_text=document_text))
            return response.text
        except Exception as e:
            return f"Error al generar resumen jurídico: {str(e)}"
@@ -159,7 +214,7 @@ class DocumentAnalyzer:
        """
        
        try:
-           response = self.llm.generate_content(extracted_norms_prompt)
+           response = self._generate(extracted_norms_prompt)
            return response.text if response else legal_arguments
        except Exception as e:
            return legal_arguments
@@ -197,89 +252,158 @@ class DocumentAnalyzer:
        
        return chunks
    
+   @staticmethod
+   def _sample_text(text: str) -> str:
+       """Si el texto es muy largo, usar solo una muestra representativa"""
+       if len(text) <= 30000:
+           return text
+       # Tomar el inicio, medio y final del documento
+       start_chunk = text[:10000]
+       middle_start = len(text) // 2 - 5000
+       middle_chunk = text[middle_start:middle_start + 10000]
+       end_chunk = text[-10000:]
+       
+       # Combinar las muestras
+       sample_text = f"{start_chunk}\n\n[...CONTENIDO INTERMEDIO...]\n\n{middle_chunk}\n\n[...CONTENIDO FINAL...]\n\n{end_chunk}"
+       return sample_text[:29000]  # Asegurar que esté bajo el límite
+   
    def get_document_embedding(self, text: str) -> List[float]:
-       """Genera embedding del documento usando Gemini con manejo de tamaño"""
+       """
+       Genera embedding del documento usando Gemini con manejo de tamaño.
+       Sin cuota, o si también falla con el primer tramo, la excepción sube:
+       buscar con un vector en cero solo gastaría calificaciones en resultados sin sentido.
+       """
+       text = self._sample_text(text)
+       self._configure()
        try:
-           # Si el texto es muy largo, usar solo una muestra representativa
-           if len(text) > 30000:
-               # Tomar el inicio, medio y final del documento
-               start_chunk = text[:10000]
-               middle_start = len(text) // 2 - 5000
-               middle_chunk = text[middle_start:middle_start + 10000]
-               end_chunk = text[-10000:]
-               
-               # Combinar las muestras
-               sample_text = f"{start_chunk}\n\n[...CONTENIDO INTERMEDIO...]\n\n{middle_chunk}\n\n[...CONTENIDO FINAL...]\n\n{end_chunk}"
-               text = sample_text[:29000]  # Asegurar que esté bajo el límite
-           
-           result = genai.embed_content(
-               model="models/embedding-001",
-               content=text,
-               task_type="retrieval_query"
-           )
-           return result['embedding']
+           return embed_query(text, model="models/embedding-001")
+       except QUOTA_ERRORS:
+           raise
        except Exception as e:
            print(f"Error generando embedding: {e}")
            # Como fallback, usar el primer chunk pequeño
-           try:
-               first_chunk = text[:20000]
-               result = genai.embed_content(
-                   model="models/embedding-001",
-                   content=first_chunk,
-                   task_type="retrieval_query"
-               )
-               return result['embedding']
-           except:
-               print("Usando embedding por defecto debido a errores")
-               return [0.0] * 768
+           return embed_query(text[:20000], model="models/embedding-001")
    
+   def get_query_embeddings(self, texts: List[str]) -> List[List[float]]:
+       """Embeddings de varias consultas en una sola llamada; si falla (salvo por cuota), uno por uno"""
+       texts = [self._sample_text(t) for t in texts]
+       self._configure()
+       try:
+           return embed_queries(texts, model="models/embedding-001")
+       except QUOTA_ERRORS:
+           raise
+       except Exception as e:
+           print(f"Error generando embeddings en lote: {e}")
+           return [self.get_document_embedding(t) for t in texts]
+   
+   @traced("analysis.precedents_fused")
    def search_precedents(self, legal_arguments: str, limit: int = 15) -> List[Dict]:
        """Busca precedentes relacionados basándose en argumentos jurídicos"""
        try:
            # Extraer normas específicas antes de la búsqueda
            specific_norms = self.extract_specific_norms(legal_arguments)
            
-           # Usar las normas específicas para la búsqueda de embedding
-           search_text = specific_norms if specific_norms else legal_arguments
-           query_embedding = self.get_document_embedding(search_text)
+           # Sub-consultas: normas específicas y argumentos (un embedding por lote,
+           # un solo request al almacén, resultados fusionados con RRF)
+           queries = [q for q in dict.fromkeys([specific_norms, legal_arguments]) if q and q.strip()]
+           query_embeddings = self.get_query_embeddings(queries)
            
-           # Buscar en Qdrant
-           search_results = self.qdrant_client.search(
-               collection_name=self.collection_name,
-               query_vector=query_embedding,
-               limit=limit,
-               with_payload=True
-           )
+           # Buscar en el almacén vectorial (corte adaptativo, máximo `limit`)
+           search_results = self.retriever.search_fused(query_embeddings, max_k=limit).hits
            
            precedents = []
            for result in search_results:
-               # Analizar relación jurídica con validación balanceada
-               relation_analysis = self._analyze_legal_relation(legal_arguments, result.payload.get("document", ""))
-               
-               # Validar la relación de manera menos estricta
-               validated_analysis = self.validate_relation_analysis(
-                   relation_analysis, 
-                   legal_arguments, 
-                   result.payload.get("document", "")
-               )
-               
-               # Solo incluir precedentes con relación ALTA, MEDIA o BAJA (no NINGUNA)
-               if validated_analysis["nivel"] in ["ALTA", "MEDIA", "BAJA"]:
-                   precedent = {
-                       'document': result.payload.get("document", ""),
-                       'metadata': result.payload.get("metadata", {}),
-                       'source': result.payload.get("metadata", {}).get("source", "Desconocido"),
-                       'relation_level': validated_analysis["nivel"],
-                       'relation_justification': validated_analysis["justificacion"]
-                   }
+               precedent = self._grade_precedent(legal_arguments, result)
+               if precedent:
                    precedents.append(precedent)
            
            return precedents
            
+       except QUOTA_ERRORS:
+           raise
        except Exception as e:
            print(f"Error buscando precedentes: {e}")
            return []
    
+   @traced("analysis.precedents")
+   def search_precedents_by_argument(self, legal_arguments: str, limit_per_argument: int = 5,
+                                     on_stage: Optional[Callable[[float, str], None]] = None) -> List[Dict]:
+       """
+       Precedentes agrupados por argumento jurídico.
+       Los argumentos numerados se embeben en un solo lote y se buscan en un
+       solo request; cada precedente se asigna al argumento donde obtuvo mejor
+       score (sin duplicados) y se califica contra ese argumento, en paralelo.
+       `on_stage(fracción, descripción)` informa el avance (una vez por precedente calificado).
+       Devuelve [{numero, titulo, texto, precedents}].
+       """
+       on_stage = on_stage or (lambda fraction, desc: None)
+       arguments = split_arguments(legal_arguments)
+       if not arguments:
+           # Sin formato "ARGUMENTO n:": un solo grupo con el texto completo
+           on_stage(0.1, "Buscando y calificando precedentes...")
+           return [{"numero": "", "titulo": "Argumentos jurídicos", "texto": legal_arguments,
+                    "precedents": self.search_precedents(legal_arguments, limit=limit_per_argument * 3)}]
+       try:
+           on_stage(0.05, f"Buscando precedentes para {len(arguments)} argumentos...")
+           embeddings = self.get_query_embeddings([a["texto"] for a in arguments])
+           results = self.retriever.search_many(embeddings, max_k=limit_per_argument)
+       except QUOTA_ERRORS:
+           raise
+       except Exception as e:
+           print(f"Error buscando precedentes por argumento: {e}")
+           return [{**a, "precedents": []} for a in arguments]
+       
+       # Cada precedente va al argumento donde obtuvo mejor score
+       best: Dict[object, Tuple[int, SearchHit]] = {}
+       for idx, result in enumerate(results):
+           for hit in result.hits:
+               if hit.id not in best or hit.score > best[hit.id][1].score:
+                   best[hit.id] = (idx, hit)
+       jobs = sorted(best.values(), key=lambda job: (job[0], -job[1].score))
+       on_stage(0.2, f"Calificando {len(jobs)} precedentes...")
+       graded_count = [0]
+       lock = threading.Lock()
+       
+       def grade(job):
+           precedent = self._grade_precedent(arguments[job[0]]["texto"], job[1])
+           with lock:
+               graded_count[0] += 1
+               on_stage(0.2 + 0.8 * graded_count[0] / len(jobs), f"Precedente {graded_count[0]} de {len(jobs)} calificado")
+           return precedent
+       
+       with ThreadPoolExecutor(max_workers=GRADING_WORKERS) as pool:
+           # wrap: la calificación en otros hilos queda dentro de la traza del análisis
+           graded = list(pool.map(wrap(grade), jobs))
+       
+       groups = [{**a, "precedents": []} for a in arguments]
+       for (idx, _), precedent in zip(jobs, graded):
+           if precedent:
+               precedent["argument"] = arguments[idx]["numero"]
+               groups[idx]["precedents"].append(precedent)
+       return groups
+   
+   @traced("analysis.grade")
+   def _grade_precedent(self, legal_arguments: str, result: SearchHit) -> Optional[Dict]:
+       """Califica un resultado con Gemini; None si la relación es NINGUNA"""
+       document = result.payload.get("document", "")
+       # Analizar relación jurídica con validación balanceada
+       relation_analysis = self._analyze_legal_relation(legal_arguments, document)
+       
+       # Validar la relación de manera menos estricta
+       validated_analysis = self.validate_relation_analysis(relation_analysis, legal_arguments, document)
+       
+       # Solo incluir precedentes con relación ALTA, MEDIA o BAJA (no NINGUNA)
+       if validated_analysis["nivel"] not in ["ALTA", "MEDIA", "BAJA"]:
+           return None
+       return {
+           'document': document,
+           'metadata': result.payload.get("metadata", {}),
+           'source': result.payload.get("metadata", {}).get("source", "Desconocido"),
+           'score': result.score,
+           'relation_level': validated_analysis["nivel"],
+           'relation_justification': validated_analysis["justificacion"]
+       }
+   
    def _verify_shared_norms(self, doc1: str, doc2: str, justification: str) -> bool:
        """Verifica si las normas mencionadas en la justificación tienen fundamento en ambos documentos"""
        try:
@@ -300,9 +424,11 @@ class DocumentAnalyzer:
            FUNDAMENTO_DÉBIL = La conexión es forzada o menciona normas que no aparecen en los documentos
            """
            
-           response = self.llm.generate_content(verification_prompt)
+           response = self._generate(verification_prompt)
            return response and "FUNDAMENTO_VÁLIDO" in response.text.upper()
            
+       except QUOTA_ERRORS:
+           raise
        except Exception as e:
            return True  # En caso de error, ser permisivo
    
@@ -345,7 +471,7 @@ class DocumentAnalyzer:
            - No seas excesivamente restrictivo con conexiones que tienen fundamento legal válido
            """
            
-           response = self.llm.generate_content(relation_prompt)
+           response = self._generate(relation_prompt)
            
            if response and response.text:
                text = response.text.strip()
@@ -384,6 +510,8 @@ class DocumentAnalyzer:
                "justificacion": "No se pudo analizar la relación"
            }
            
+       except QUOTA_ERRORS:
+           raise
        except Exception as e:
            return {
                "nivel": "NINGUNA", 
@@ -420,6 +548,7 @@ class DocumentAnalyzer:
        
        return analysis
    
+   @traced("analysis.report")
    def generate_pdf_report(self, 
                          document_name: str,
                          facts_summary: str, 
@@ -430,6 +559,9 @@ class DocumentAnalyzer:
                          output_path: str,
                          search_note: str = "") -> bool:
        """Genera un reporte PDF con toda la información"""
+       from reportlab.lib.pagesizes import letter
+       from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+       from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
        try:
            doc = SimpleDocTemplate(output_path, pagesize=letter,
                                  leftMargin=72, rightMargin=72, 
@@ -508,7 +640,8 @@ class DocumentAnalyzer:
                    relation_level = precedent.get('relation_level', 'NO DETERMINADO')
                    relation_justification = precedent.get('relation_justification', 'Justificación no disponible')
                    
-                   story.append(Paragraph(f"<b>Precedente {i} - Nivel de relación: {relation_level}</b>", normal_style))
+                   argument = f" (Argumento {precedent['argument']})" if precedent.get('argument') else ""
+                   story.append(Paragraph(f"<b>Precedente {i}{argument} - Nivel de relación: {relation_level}</b>", normal_style))
                    story.append(Paragraph(f"<b>Fuente:</b> {precedent['source']}", normal_style))
                    story.append(Paragraph(f"<b>Justificación de la relación (argumento/precedente):</b> {relation_justification}", normal_style))
                    story.append(Paragraph(f"<b>Contenido:</b> {precedent['document'][:500]}...", normal_style))
@@ -535,14 +668,22 @@ class DocumentAnalyzer:
            print(f"Error generando PDF: {e}")
            return False
    
-   def analyze_document(self, pdf_path: str) -> Dict:
-       """Función principal que analiza un documento completo"""
+   @traced("analysis.document")
+   def analyze_document(self, pdf_path: str, on_stage: Optional[Callable[[float, str], None]] = None) -> Dict:
+       """
+       Función principal que analiza un documento completo.
+       `on_stage(fracción, descripción)` informa el avance real de cada etapa.
+       """
+       on_stage = on_stage or (lambda fraction, desc: None)
        try:
            # Extraer texto del PDF
+           on_stage(0.05, "Extrayendo texto del PDF...")
            document_text = self.extract_text_from_pdf(pdf_path)
            
            # Generar resúmenes
+           on_stage(0.2, "Resumiendo hechos y personas...")
            facts_summary = self.generate_facts_summary(document_text)
+           on_stage(0.6, "Extrayendo argumentos jurídicos...")
            legal_summary = self.generate_legal_summary(document_text)
            
            # Los prompts usados (actualizados)
@@ -1,20 +1,19 @@
 # drive_utils.py (Adaptado para Cloud Run)
 import io
 import os
-import google.auth
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseDownload
 
+import services
+
 # Define los permisos que la aplicación necesita.
-SCOPES = ["https://www.googleapis.com/auth/drive.readonly"]
+SCOPES = services.DRIVE_SCOPES
 
 def _get_drive_service():
-    """Función helper para autenticar y crear el servicio de Drive."""
+    """Servicio de Drive compartido (ver services.drive); None si falla la autenticación."""
     try:
         # Usa las credenciales del entorno de Cloud Run (la cuenta de servicio)
-        creds, _ = google.auth.default(scopes=SCOPES)
-        return build("drive", "v3", credentials=creds)
+        return services.drive()
     except Exception as e:
         print(f"Error fatal durante la autenticación con Google Drive: {e}")
         return None
@@ -72,3 +71,20 @@ def download_file_from_drive(file_id: str, output_filename: str) -> str | None:
     except Exception as e:
         print(f"Error inesperado: {e}")
         return None
+
+
+def list_pdfs(folder_id: str) -> list:
+    """Alias usado por ingest.py."""
+    return list_pdf_files_in_folder(folder_id)
+
+def download_file(file_id: str, dst) -> None:
+    """Descarga un archivo de Drive directamente a `dst` (lanza excepción si falla)."""
+    service = _get_drive_service()
+    if not service:
+        raise RuntimeError("No hay servicio de Google Drive disponible")
+    request = service.files().get_media(fileId=file_id)
+    with open(dst, "wb") as fh:
+        downloader = MediaIoBaseDownload(fh, request)
+        done = False
+        while not done:
+            _, done = downloader.next_chunk()
@@ -0,0 +1,161 @@
+# gemini_utils.py
+# Llamadas a Gemini compartidas por rag_chain, document_analyzer e ingestión.
+# Todas pasan por el control de admisión del proceso (rate_control.get_admission).
+import os
+import time
+from typing import Any, List, Optional
+
+from google.api_core.exceptions import ResourceExhausted
+
+import replay
+from metrics import GEMINI_CALLS, GEMINI_TOKENS
+from tracing import span
+from rate_control import (PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, QuotaExceeded, estimate_tokens,
+                          get_admission, retry_after_from)
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "models/embedding-001")
+EMBEDDING_DIM = 768
+# Límite de textos por llamada de embeddings en lote (batchEmbedContents)
+EMBED_BATCH_LIMIT = 100
+# Timeout por llamada (segundos); sin él una conexión colgada retiene el hilo
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", 60))
+_REQUEST_OPTIONS = {"timeout": GEMINI_TIMEOUT}
+
+_genai = None
+
+
+def configure(api_key: Optional[str] = None):
+    """
+    Configura la API key de Gemini una sola vez por proceso y devuelve el SDK.
+    `api_key` tiene prioridad sobre GEMINI_API_KEY (la primera llamada la fija).
+    google.generativeai se importa aquí y no al importar el módulo (arranque en frío).
+    Con GEMINI_REPLAY=record|replay devuelve el SDK de grabación de replay.py.
+    """
+    global _genai
+    if _genai is None:
+        if replay.MODE == "replay":
+            # respuestas grabadas: ni SDK ni API key (pruebas de carga)
+            _genai = replay.sdk()
+            return _genai
+        api_key = api_key or os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("API_KEY de Gemini no configurada")
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        _genai = replay.sdk(real=genai) if replay.MODE == "record" else genai
+    return _genai
+
+
+def _admitted(kind: str, fn, tokens: int, requests: int, priority: int,
+              max_wait: Optional[float] = None):
+    """Ejecuta `fn` dentro de la cuota local de `kind`; informa los rechazos de la API."""
+    gate = get_admission(kind)
+    with span(f"gemini.{kind}", tokens=tokens, requests=requests, priority=priority) as s:
+        t0 = time.perf_counter()
+        try:
+            reserved = gate.acquire(tokens, requests=requests, priority=priority, max_wait=max_wait)
+        except QuotaExceeded:
+            GEMINI_CALLS.inc(kind=kind, outcome="shed")
+            raise
+        s.set(admission_wait_ms=round((time.perf_counter() - t0) * 1000, 1))
+        try:
+            result = fn()
+        except ResourceExhausted as e:
+            GEMINI_CALLS.inc(kind=kind, outcome="quota")
+            gate.on_quota(retry_after_from(e))
+            raise
+        except Exception:
+            GEMINI_CALLS.inc(kind=kind, outcome="error")
+            raise
+        GEMINI_CALLS.inc(kind=kind, outcome="ok")
+        usage = getattr(result, "usage_metadata", None)
+        if usage is not None and getattr(usage, "total_token_count", None):
+            gate.settle(reserved, usage.total_token_count)
+            s.set(total_tokens=usage.total_token_count)
+            GEMINI_TOKENS.inc(usage.total_token_count, kind=kind)
+        else:
+            GEMINI_TOKENS.inc(tokens, kind=kind)  # embeddings: no informan uso, se usa la estimación
+        return result
+
+
+def embed_documents(texts: List[str], model: Optional[str] = None,
+                    batch_size: int = EMBED_BATCH_LIMIT,
+                    priority: int = PRIORITY_BACKGROUND) -> List[List[float]]:
+    """Embeddings de documentos en lotes de hasta `batch_size` textos por llamada."""
+    genai = configure()
+    vectors: List[List[float]] = []
+    for i in range(0, len(texts), batch_size):
+        batch = texts[i:i + batch_size]
+        result = _admitted(
+            "embed",
+            lambda: genai.embed_content(
+                model=model or EMBEDDING_MODEL,
+                content=batch,
+                task_type="retrieval_document",
+                request_options=_REQUEST_OPTIONS,
+            ),
+            tokens=sum(estimate_tokens(t) for t in batch),
+            requests=len(batch),
+            priority=priority,
+        )
+        vectors.extend(result["embedding"])
+    return vectors
+
+
+def embed_query(text: str, model: Optional[str] = None,
+                priority: int = PRIORITY_INTERACTIVE) -> List[float]:
+    """Embedding de una consulta."""
+    genai = configure()
+    result = _admitted(
+        "embed",
+        lambda: genai.embed_content(
+            model=model or EMBEDDING_MODEL,
+            content=text,
+            task_type="retrieval_query",
+            request_options=_REQUEST_OPTIONS,
+        ),
+        tokens=estimate_tokens(text),
+        requests=1,
+        priority=priority,
+    )
+    return result["embedding"]
+
+
+def embed_queries(texts: List[str], model: Optional[str] = None,
+                  priority: int = PRIORITY_INTERACTIVE) -> List[List[float]]:
+    """Embeddings de varias consultas en una sola llamada (sub-consultas, argumentos)."""
+    genai = configure()
+    if not texts:
+        return []
+    result = _admitted(
+        "embed",
+        lambda: genai.embed_content(
+            model=model or EMBEDDING_MODEL,
+            content=list(texts),
+            task_type="retrieval_query",
+            request_options=_REQUEST_OPTIONS,
+        ),
+        tokens=sum(estimate_tokens(t) for t in texts),
+        requests=len(texts),
+        priority=priority,
+    )
+    return result["embedding"]
+
+
+def generate(llm: Any, prompt: str, generation_config: Optional[dict] = None,
+             priority: int = PRIORITY_INTERACTIVE, max_wait: Optional[float] = None) -> Any:
+    """
+    `llm.generate_content` con admisión por cuota. Reserva los tokens del
+    prompt más el máximo de salida y se corrige con `usage_metadata`.
+    Lanza rate_control.QuotaExceeded si la cuota no alcanzaría a tiempo.
+    """
+    max_output = (generation_config or {}).get("max_output_tokens", 1024)
+    return _admitted(
+        "generate",
+        lambda: llm.generate_content(prompt, generation_config=generation_config,
+                                     request_options=_REQUEST_OPTIONS),
+        tokens=estimate_tokens(prompt) + max_output,
+        requests=1,
+        priority=priority,
+        max_wait=max_wait,
+    )
@@ -1,13 +1,19 @@
 # ingest.py
 from dotenv import load_dotenv
-import os, time, re, json
+import os
 from pathlib import Path
+from typing import Optional
 from PyPDF2 import PdfReader
 from PyPDF2.errors import EmptyFileError, PdfReadError
 import chromadb
 from chromadb.utils import embedding_functions
 from google.api_core.exceptions import ResourceExhausted
 from drive_utils import list_pdfs, download_file
+from metadata_extractor import extract_metadata
+from catalog_store import CatalogStore, record_failures
+from gemini_utils import EMBED_BATCH_LIMIT
+from rate_control import AdaptiveRateController
+from ingestion import ChunkingConfig, IngestionEngine, Sink, VectorStoreSink, local_documents
 
 # =========================
 # 1. CONFIGURACIÓN GENERAL
@@ -18,14 +24,19 @@ DATA_DIR    = Path("pdfs")
 INDEX_DIR   = Path("chroma_index")
 TMP_DIR     = Path("pdfs_tmp")
 FAILED_DIR  = Path("pdfs_fallidos")
-CATALOG_PATH = INDEX_DIR / "catalog.json"
-catalog: dict[str, dict] = {}
+CATALOG_PATH = INDEX_DIR / "catalog.json"   # formato anterior (solo se importa una vez)
+CATALOG_DB   = Path(os.getenv("CATALOG_DB", INDEX_DIR / "catalog.db"))
 
 DATA_DIR.mkdir(exist_ok=True)
 INDEX_DIR.mkdir(exist_ok=True)
 TMP_DIR.mkdir(exist_ok=True)
 FAILED_DIR.mkdir(exist_ok=True)
 
+# Catálogo incremental (SQLite); el catalog.json anterior se importa una sola vez
+catalog = CatalogStore(CATALOG_DB)
+if CATALOG_PATH.exists() and not catalog.count():
+    print(f"📥 Importando {catalog.import_json(CATALOG_PATH)} filas de {CATALOG_PATH}")
+
 FOLDER_ID = os.getenv("DRIVE_FOLDER_ID")
 if not FOLDER_ID:
     raise ValueError("🚨 Falta DRIVE_FOLDER_ID en .env")
@@ -43,62 +54,8 @@ def is_valid_pdf(path: Path) -> bool:
     except (EmptyFileError, PdfReadError, OSError):
         return False
 
-def pdf_to_text(path: Path) -> str:
-    """Extrae texto de todas las páginas; si falla, lanza excepción."""
-    reader = PdfReader(str(path))
-    return "\n".join((p.extract_text() or "") for p in reader.pages)
-
-# =========================
-# 3. REGEX PARA METADATOS
-# =========================
-# Números de resolución e interno (tus reglas)
-res_regex = re.compile(r"\b\d{4,6}-\d{4}\b")      # 07685-2025
-int_regex = re.compile(r"\b[A-Z]{2}-\d{3,4}\b")   # DJ-0612
-pa_regex = re.compile(r"\b(?:CGR-)?PA-\d{8,10}\b", re.I)
-
-# Sanitiza sanciones + detecta "archivo"
-sancion_regex = re.compile(
-    r"(separaci[oó]n del cargo[^\n]*?|despido[^\n]*?responsabilidad[^\n]*?|"
-    r"suspensi[oó]n[^\n]*?(d[ií]as|meses|años)|inhabilitaci[oó]n[^\n]*?años?|"
-    r"prohibici[oó]n de ingreso[^\n]*?|multa[^\n]*?¢[\d\.]+|archivo)",
-    re.IGNORECASE | re.DOTALL
-)
-
-TIPO_PATTERNS = {
-    "despido sin responsabilidad": r"despido\s+sin\s+responsabilidad",
-    "despido con responsabilidad": r"despido\s+con\s+responsabilidad",
-    "suspensión":                   r"suspensi[oó]n",
-    "inhabilitación":               r"inhabilitaci[oó]n",
-    "multa":                        r"\bmulta\b",
-    "archivo":                      r"\barchivo\b",
-    "apercibimiento":               r"apercibimiento",
-}
-
-def sancion_a_tipo(s: str | None) -> str | None:
-    if not s:
-        return None
-    low = s.lower()
-    for tipo, patt in TIPO_PATTERNS.items():
-        if re.search(patt, low, re.I):
-            return tipo
-    return None
-
-def scan_pdf_metadata(pdf_path: Path) -> dict:
-    text = pdf_to_text(pdf_path)
-    meta = {}
-    if m := res_regex.search(text):
-        meta["resolucion"] = m.group()
-    if m := int_regex.search(text):
-        meta["interno"] = m.group()
-    if m := pa_regex.search(text):
-        meta["pa"] = m.group()
-    if m := sancion_regex.search(text):
-        sanc = " ".join(m.group().split())
-        meta["sancion"] = sanc
-    return meta
-
 # =========================
-# 4. DESCARGA DESDE DRIVE
+# 3. DESCARGA DESDE DRIVE
 # =========================
 MAX_DL_RETRIES = 2  # total 3 intentos
 
@@ -139,6 +96,7 @@ for f in list_pdfs(FOLDER_ID):
         tmp_dst.replace(final_dst)  # mover atómico
     else:
         print(f"🚫  Archivo inválido tras reintentos: {f['name']}. Lo marco como fallido.")
+        catalog.mark_failed(f["name"], "descarga inválida tras reintentos")
         if bad_dst.exists():
             try: bad_dst.unlink()
             except OSError: pass
@@ -146,8 +104,15 @@ for f in list_pdfs(FOLDER_ID):
             tmp_dst.replace(bad_dst)
 
 # =========================
-# 5. EMBEDDINGS DE GEMINI
+# 4. DESTINOS + EMBEDDINGS
 # =========================
+# El motor genera los embeddings una sola vez y los pasa a cada destino.
+# Chroma conserva el modelo con el que se creó su índice (gemini-embedding-001);
+# si INGEST_SINKS incluye "qdrant", el almacén vectorial de rag_chain recibe los
+# mismos chunks con su propio modelo (models/embedding-001).
+CHROMA_EMBEDDING_MODEL = "models/gemini-embedding-001"
+SINKS = [s.strip() for s in os.getenv("INGEST_SINKS", "chroma").split(",") if s.strip()]
+
 emb_fn = embedding_functions.GoogleGenerativeAiEmbeddingFunction(
     api_key=os.getenv("GEMINI_API_KEY"),
     model_name="gemini-embedding-001"
@@ -156,92 +121,90 @@ emb_fn = embedding_functions.GoogleGenerativeAiEmbeddingFunction(
 client = chromadb.PersistentClient(path=str(INDEX_DIR))
 col = client.get_or_create_collection("resoluciones", embedding_function=emb_fn)
 
-def chunkify_text(text: str, chunk=1800, overlap=200):
-    tokens = text.split()
-    i = 0
-    while i < len(tokens):
-        yield " ".join(tokens[i:i + chunk])
-        i += max(1, chunk - overlap)
-
 # =========================
-# 6. INDEXACIÓN + CATALOGO
+# 5. INDEXACIÓN + CATALOGO
 # =========================
-def safe_add(chunk: str, meta: dict, uid: str, max_retries=3, sleep_secs=65) -> bool:
-    retries = 0
-    while retries <= max_retries:
+# Lotes de escritura: con embeddings ya calculados el límite es el de Chroma;
+# si Chroma tuviera que generarlos, manda el tamaño de lote del controlador.
+CHROMA_MAX_BATCH = getattr(client, "get_max_batch_size", lambda: 5000)()
+rate = AdaptiveRateController(batch_size=EMBED_BATCH_LIMIT, max_batch=EMBED_BATCH_LIMIT)
+
+def safe_add(chunks: list[str], metas: list[dict], uids: list[str], embeddings=None, max_retries=3) -> int:
+    """Agrega chunks en lotes; devuelve cuántos quedaron indexados."""
+    added = 0
+    i = 0
+    while i < len(uids):
+        n = CHROMA_MAX_BATCH if embeddings is not None else rate.batch_size
+        batch = slice(i, i + n)
+        add = lambda: col.add(documents=chunks[batch], metadatas=metas[batch], ids=uids[batch],
+                              embeddings=embeddings[batch] if embeddings is not None else None)
         try:
-            col.add(documents=[chunk], metadatas=[meta], ids=[uid])
-            return True
+            if embeddings is not None:
+                add()
+            else:
+                rate.call(add, max_retries=max_retries, label="chroma")
+            added += len(uids[batch])
         except ResourceExhausted:
-            if retries == max_retries:
-                print(f"🚫 No se pudo indexar {uid} por límite de cuota. Lo salto.")
-                return False
-            retries += 1
-            print(f"⏳ Cuota agotada; espero {sleep_secs}s… (reintento {retries}/{max_retries})")
-            time.sleep(sleep_secs)
+            print(f"🚫 No se pudieron indexar {len(uids[batch])} chunks ({uids[batch][0]}…) por límite de cuota. Los salto.")
         except Exception as e:
-            print(f"⚠️ Error indexando {uid}: {e}. Lo salto.")
-            return False
+            print(f"⚠️ Error indexando {len(uids[batch])} chunks ({uids[batch][0]}…): {e}. Los salto.")
+        i += n
+    return added
 
-pendientes = []
-for pdf in sorted(DATA_DIR.glob("*.pdf")):
-    if not is_valid_pdf(pdf):
-        print(f"⚠️  PDF inválido detectado durante indexación: {pdf.name}. Lo salto.")
-        continue
 
-    try:
-        # Extrae metadatos (y de paso lee el texto para chunkear)
-        text = pdf_to_text(pdf)
-        doc_meta = scan_pdf_metadata(pdf)
-    except (EmptyFileError, PdfReadError, OSError) as e:
-        print(f"⚠️  No se pudo procesar {pdf.name}: {e}. Lo salto.")
-        continue
-    except Exception as e:
-        print(f"⚠️  Error inesperado leyendo {pdf.name}: {e}. Lo salto.")
-        continue
+class ChromaSink(Sink):
+    """Índice Chroma local (chroma_index/), con IDs "<archivo>_<n>"."""
+
+    name = "chroma"
+    embedding_model = CHROMA_EMBEDDING_MODEL
+
+    def filter_new(self, ids):
+        # Una sola consulta por documento en lugar de un get por chunk
+        existing = set(col.get(ids=ids, include=[])["ids"])
+        return {uid for uid in ids if uid not in existing}
+
+    def write(self, ids, documents, metadatas, vectors):
+        return safe_add(documents, metadatas, ids, embeddings=vectors)
 
-    # ► Catálogo (1 fila por PDF)
-    catalog[pdf.name] = {
-        "source": pdf.name,
-        "resolucion": doc_meta.get("resolucion"),
-        "interno": doc_meta.get("interno"),
-        "pa": doc_meta.get("pa"),                          
-        "tipo": sancion_a_tipo(doc_meta.get("sancion")),
-    }
-
-    # Genera pendientes por chunk
-    for n, chunk in enumerate(chunkify_text(text, chunk=1800, overlap=200)):
-        uid = f"{pdf.name}_{n}"
-        if col.get(ids=[uid], include=[])["ids"]:
+
+def catalog_row(name: str, doc_meta: dict, file_id: Optional[str] = None) -> None:
+    # ► Catálogo (1 fila por PDF, upsert inmediato)
+    catalog.upsert(name, doc_meta, file_id)
+
+
+def valid_documents():
+    for doc in local_documents(DATA_DIR):
+        if not is_valid_pdf(doc.path):
+            print(f"⚠️  PDF inválido detectado durante indexación: {doc.name}. Lo salto.")
+            catalog.mark_failed(doc.name, "PDF inválido")
             continue
+        yield doc
+
+
+sinks = []
+if "chroma" in SINKS:
+    sinks.append(ChromaSink())
+if "qdrant" in SINKS:
+    from services import shared_vector_store
+    store = shared_vector_store("resoluciones")
+    store.ensure_collection()
+    sinks.append(VectorStoreSink(store))
+
+engine = IngestionEngine(
+    sinks,
+    batch_size=EMBED_BATCH_LIMIT,
+    rate_controller=rate,
+    chunking=ChunkingConfig.from_env(ChunkingConfig(unit="words", size=1800, overlap=200)),
+    metadata_fn=extract_metadata,
+    on_document=catalog_row,
+)
+report = engine.run(valid_documents())
+report.log()
+record_failures(catalog, report.files_failed)
 
-        # construir metadatos sin 'sancion'
-        meta_chunk = {
-            "source": pdf.name,
-            "chunk": n,
-            "resolucion": doc_meta.get("resolucion"),
-            "interno": doc_meta.get("interno"),
-            "pa": doc_meta.get("pa"),
-            "tipo": sancion_a_tipo(doc_meta.get("sancion")),
-        }
-        pendientes.append((
-            uid, chunk,
-            {**doc_meta, "source": pdf.name, "chunk": n,
-            "tipo": sancion_a_tipo(doc_meta.get("sancion"))}
-        ))
-
-
-if not pendientes:
+if not report.chunks_total:
     print("✅ Base vectorial actualizada (no había nada nuevo)")
 else:
-    print(f"🧩 Chunks pendientes por indexar: {len(pendientes)}")
-    for uid, chunk, meta in pendientes:
-        safe_add(chunk, meta, uid)
     print("✅ Base vectorial actualizada")
 
-# Guarda el catálogo al final
-INDEX_DIR.mkdir(exist_ok=True)
-with CATALOG_PATH.open("w", encoding="utf-8") as f:
-    json.dump(catalog, f, ensure_ascii=False, indent=2)
-
-print(f"✅ Catálogo actualizado en {CATALOG_PATH}")
\ No newline at end of file
+print(f"✅ Catálogo actualizado en {CATALOG_DB} ({catalog.count()} documentos)")
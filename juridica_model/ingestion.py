@@ -0,0 +1,503 @@
+# ingestion.py
+# Motor de ingestión único: lee cada PDF una vez, lo divide en chunks con una
+# configuración compartida, genera los embeddings una sola vez por modelo y
+# escribe el resultado en uno o varios destinos ("sinks").
+#   - rag_chain.py lo usa con VectorStoreSink (Qdrant o backend local)
+#   - ingest.py lo usa con su ChromaSink (y opcionalmente VectorStoreSink)
+from __future__ import annotations
+import os
+import re
+import time
+import uuid
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_right
+from functools import lru_cache
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from rate_control import AdaptiveRateController
+from vector_store import VectorStore
+
+# Espacio de nombres para IDs deterministas (misma fuente + chunk → mismo ID)
+_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "cgr-dj/resoluciones")
+
+
+# ── Chunking ─────────────────────────────────────
+@dataclass(frozen=True)
+class ChunkingConfig:
+    """unit="chars": RecursiveCharacterTextSplitter por página; unit="words": ventanas de palabras."""
+    unit: str = "chars"
+    size: int = 1500
+    overlap: int = 150
+
+    @classmethod
+    def from_env(cls, default: "ChunkingConfig") -> "ChunkingConfig":
+        """Permite sobreescribir el valor por defecto con INGEST_CHUNK_UNIT/SIZE/OVERLAP."""
+        return cls(
+            unit=(os.getenv("INGEST_CHUNK_UNIT") or default.unit).strip().lower(),
+            size=int(os.getenv("INGEST_CHUNK_SIZE") or default.size),
+            overlap=int(os.getenv("INGEST_CHUNK_OVERLAP") or default.overlap),
+        )
+
+
+_LEADING_WS = re.compile(r"\s*")
+
+
+class Chunk(NamedTuple):
+    text: str
+    page: int
+    start: int  # offset de inicio en el texto del documento (páginas unidas con "\n")
+    end: int
+
+
+@lru_cache(maxsize=16)
+def _window_patterns(chunk: int, step: int) -> Tuple[re.Pattern, re.Pattern, Optional[re.Pattern]]:
+    # ventana completa, salto de `step` palabras y cola de traslape tras el salto
+    overlap = chunk - step
+    return (re.compile(rf"(?:\S+\s+){{0,{chunk - 1}}}\S+"),
+            re.compile(rf"(?:\S+\s+){{{step}}}"),
+            re.compile(rf"(?:\S+\s+){{0,{overlap - 1}}}\S+") if overlap > 0 else None)
+
+
+def word_windows(text: str, chunk=1800, overlap=200) -> Iterator[Tuple[int, int]]:
+    """
+    (inicio, fin) en caracteres de cada ventana de `chunk` palabras con `overlap`
+    de traslape. Los límites los encuentra el motor de regex sobre el texto
+    original: cada palabra se recorre una vez (más el traslape), sin crear
+    una lista de palabras ni volver a unirlas.
+    """
+    chunk = max(1, chunk)
+    step = max(1, chunk - overlap)
+    window_re, skip_re, tail_re = _window_patterns(chunk, step)
+    pos = _LEADING_WS.match(text).end()
+    n = len(text)
+    while pos < n:
+        m = skip_re.match(text, pos)
+        if m and tail_re is not None and m.end() < n:
+            # la ventana termina `chunk - step` palabras después del siguiente inicio
+            end = tail_re.match(text, m.end()).end()
+        elif m and step == chunk:
+            end = m.end()
+            while text[end - 1].isspace():
+                end -= 1
+        else:
+            end = window_re.match(text, pos).end()
+        yield pos, end
+        if not m:
+            break
+        pos = m.end()
+
+
+def chunkify_text(text: str, chunk=1800, overlap=200):
+    """
+    Mismas ventanas que el antiguo `" ".join(text.split()[i:i+chunk])`, pero cada
+    chunk es un único slice del texto original (conserva los saltos de línea)
+    en vez de copiar y volver a unir ~1800 palabras por ventana. Para citar
+    posiciones exactas use `word_windows`/`split_pages`, que devuelven offsets.
+    """
+    for start, end in word_windows(text, chunk, overlap):
+        yield text[start:end]
+
+
+def _page_of(page_starts: List[int], offset: int) -> int:
+    return bisect_right(page_starts, offset) - 1
+
+
+def split_pages(pages: List[str], config: ChunkingConfig) -> List[Chunk]:
+    """Chunks no vacíos con su página y offsets dentro del documento."""
+    page_starts, pos = [], 0
+    for page in pages:
+        page_starts.append(pos)
+        pos += len(page) + 1
+
+    if config.unit == "words":
+        text = "\n".join(pages)
+        return [
+            Chunk(text[s:e], _page_of(page_starts, s), s, e)
+            for s, e in word_windows(text, chunk=config.size, overlap=config.overlap)
+        ]
+    if config.unit != "chars":
+        raise ValueError(f"❌ Unidad de chunking no soportada: {config.unit}")
+
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    splitter = RecursiveCharacterTextSplitter(chunk_size=config.size, chunk_overlap=config.overlap,
+                                              add_start_index=True)
+    out = []
+    for page_no, page in enumerate(pages):
+        for piece in splitter.create_documents([page]):
+            if piece.page_content.strip():
+                start = page_starts[page_no] + piece.metadata["start_index"]
+                out.append(Chunk(piece.page_content, page_no, start, start + len(piece.page_content)))
+    return out
+
+
+# ── Fuentes ──────────────────────────────────────
+@dataclass
+class SourceDocument:
+    name: str
+    path: Optional[Path]
+    file_id: Optional[str] = None
+    cleanup: bool = False  # borrar `path` al terminar (descargas temporales)
+    pages: Optional[List[str]] = None  # texto ya extraído (benchmarks): no se lee `path`
+
+
+def load_pdf_pages(path: Path) -> List[str]:
+    """Texto de cada página (lanza excepción si el PDF no se puede leer)."""
+    from PyPDF2 import PdfReader
+    reader = PdfReader(str(path))
+    return [(p.extract_text() or "") for p in reader.pages]
+
+
+def local_documents(folder: Path) -> Iterator[SourceDocument]:
+    for pdf in sorted(folder.glob("*.pdf")):
+        yield SourceDocument(name=pdf.name, path=pdf)
+
+
+def drive_documents(pdf_files: List[dict], skip: Optional[Set[str]] = None) -> Iterator[SourceDocument]:
+    """Descarga bajo demanda los PDFs de Drive (uno a la vez) que no estén en `skip`."""
+    from drive_utils import download_file_from_drive
+    for pdf_info in pdf_files:
+        if skip and pdf_info["name"] in skip:
+            continue
+        local = download_file_from_drive(pdf_info["id"], pdf_info["name"])
+        yield SourceDocument(
+            name=pdf_info["name"],
+            path=Path(local) if local else None,
+            file_id=pdf_info["id"],
+            cleanup=True,
+        )
+
+
+# ── Sinks ────────────────────────────────────────
+class Sink(ABC):
+    """Destino de escritura. `embedding_model=None` usa el modelo del motor."""
+
+    name = "sink"
+    embedding_model: Optional[str] = None
+
+    def known_sources(self) -> Set[str]:
+        """Archivos ya indexados por completo (se saltan sin leerlos)."""
+        return set()
+
+    def filter_new(self, ids: List[str]) -> Set[str]:
+        """Subconjunto de `ids` que todavía no está en el destino."""
+        return set(ids)
+
+    @abstractmethod
+    def write(self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]],
+              vectors: List[List[float]]) -> int:
+        """Escribe el lote y devuelve cuántos chunks quedaron indexados."""
+
+
+class VectorStoreSink(Sink):
+    """Escribe en un VectorStore con payload {"document", "metadata"}."""
+
+    def __init__(self, store: VectorStore, batch_size: int = 100):
+        self.store = store
+        self.name = f"vector_store:{store.collection_name}"
+        self.batch_size = batch_size
+        # IDs ya guardados de las fuentes incompletas (filter_new solo agrega los que faltan)
+        self._partial: Set[str] = set()
+
+    def scan_sources(self, fields: Iterable[str] = ()) -> Dict[str, Dict[str, Any]]:
+        """
+        Una pasada por la colección (sin el texto de cada chunk):
+        {fuente: {"stored": chunks guardados, "complete": bool, "metadata": `fields` del primer chunk}}.
+        Una fuente queda incompleta si se guardaron menos chunks de los que
+        tenía (p. ej. falló un lote de embeddings); las indexadas antes de
+        guardar "chunks" se dan por completas.
+        """
+        sources: Dict[str, Dict[str, Any]] = {}
+        stored: Dict[str, Set[int]] = {}
+        selector = ["metadata.source", "metadata.chunk", "metadata.chunks"] + [f"metadata.{f}" for f in fields]
+        for payload in self.store.scroll_payloads(fields=selector):
+            meta = payload.get("metadata", {})
+            source = meta.get("source", "")
+            if not source:
+                continue
+            if source not in sources:
+                sources[source] = {"metadata": meta}
+                stored[source] = set()
+            stored[source].add(meta.get("chunk"))
+        self._partial = set()
+        for source, info in sources.items():
+            expected = info["metadata"].get("chunks")
+            info["stored"] = len(stored[source])
+            info["complete"] = expected is None or info["stored"] >= expected
+            if not info["complete"]:
+                self._partial.update(f"{source}_{n}" for n in stored[source])
+        return sources
+
+    def known_sources(self) -> Set[str]:
+        return {source for source, info in self.scan_sources().items() if info["complete"]}
+
+    def filter_new(self, ids: List[str]) -> Set[str]:
+        return {uid for uid in ids if uid not in self._partial}
+
+    def write(self, ids, documents, metadatas, vectors) -> int:
+        point_ids = [str(uuid.uuid5(_ID_NAMESPACE, uid)) for uid in ids]
+        payloads = [{"document": d, "metadata": m} for d, m in zip(documents, metadatas)]
+        for i in range(0, len(ids), self.batch_size):
+            self.store.upsert(point_ids[i:i + self.batch_size], vectors[i:i + self.batch_size],
+                              payloads[i:i + self.batch_size])
+        return len(ids)
+
+
+# ── Reporte ──────────────────────────────────────
+@dataclass
+class IngestionReport:
+    files_expected: int = 0   # total anunciado al iniciar (0 = desconocido)
+    files_seen: int = 0
+    files_indexed: int = 0
+    files_skipped: int = 0
+    files_failed: List[Tuple[str, str]] = field(default_factory=list)
+    chunks_total: int = 0
+    chunks_written: Dict[str, int] = field(default_factory=dict)
+    chunks_failed: int = 0
+    chunks_pending: int = 0   # en el lote a la espera de embeddings
+    embed_calls: int = 0
+    running: bool = False
+    started: float = field(default_factory=time.time)
+    elapsed: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "files_seen": self.files_seen,
+            "files_indexed": self.files_indexed,
+            "files_skipped": self.files_skipped,
+            "files_failed": [{"source": s, "error": e} for s, e in self.files_failed],
+            "chunks_total": self.chunks_total,
+            "chunks_written": dict(self.chunks_written),
+            "chunks_failed": self.chunks_failed,
+            "embed_calls": self.embed_calls,
+            "elapsed_s": round(self.elapsed, 2),
+        }
+
+    def log(self) -> None:
+        print(f"📊 Ingestión: {self.files_indexed}/{self.files_seen} archivos indexados, "
+              f"{self.files_skipped} sin cambios, {len(self.files_failed)} con error, "
+              f"{self.chunks_total} chunks nuevos en {self.elapsed:.1f}s")
+        for sink, n in self.chunks_written.items():
+            print(f"   ↳ {sink}: {n} chunks escritos")
+        if self.chunks_failed:
+            print(f"   ⚠️ {self.chunks_failed} chunks no se pudieron indexar")
+        for source, error in self.files_failed:
+            print(f"   ❌ {source}: {error}")
+
+
+# Reporte de la ingestión en curso o de la última del proceso (métricas de avance)
+LAST_RUN: Optional[IngestionReport] = None
+
+
+# ── Lote pendiente ───────────────────────────────
+class PendingBatch:
+    """
+    Chunks a la espera de embeddings, en columnas.
+
+    Los metadatos del documento se guardan una sola vez y cada fila solo
+    lleva su posición (página, chunk, offsets) en arrays de enteros y una
+    máscara de bits con los sinks destino. El dict de metadatos por chunk
+    se arma recién al escribir.
+    """
+    __slots__ = ("sinks", "ids", "texts", "doc", "page", "chunk", "start", "end", "mask", "_docs")
+
+    def __init__(self, sinks: List[Sink]):
+        self.sinks = sinks
+        self._docs: List[Dict[str, Any]] = []
+        self.ids: List[str] = []
+        self.texts: List[str] = []
+        self.doc = array("l")
+        self.page = array("l")
+        self.chunk = array("l")
+        self.start = array("l")
+        self.end = array("l")
+        self.mask = array("l")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add_document(self, meta: Dict[str, Any]) -> int:
+        """Registra los metadatos compartidos de un documento y devuelve su índice."""
+        # Chroma no acepta valores None en metadatos
+        self._docs.append({k: v for k, v in meta.items() if v is not None})
+        return len(self._docs) - 1
+
+    def append(self, uid: str, chunk: Chunk, n: int, doc: int, mask: int) -> None:
+        self.ids.append(uid)
+        self.texts.append(chunk.text)
+        self.doc.append(doc)
+        self.page.append(chunk.page)
+        self.chunk.append(n)
+        self.start.append(chunk.start)
+        self.end.append(chunk.end)
+        self.mask.append(mask)
+
+    def sink_mask(self, sinks: Iterable[Sink]) -> int:
+        mask = 0
+        for s in sinks:
+            mask |= 1 << self.sinks.index(s)
+        return mask
+
+    def metadata(self, i: int) -> Dict[str, Any]:
+        return {**self._docs[self.doc[i]], "page": self.page[i], "chunk": self.chunk[i],
+                "start": self.start[i], "end": self.end[i]}
+
+
+# ── Motor ────────────────────────────────────────
+EmbedFn = Callable[[List[str], Optional[str]], List[List[float]]]
+
+
+def _default_embed(texts: List[str], model: Optional[str]) -> List[List[float]]:
+    from gemini_utils import embed_documents
+    return embed_documents(texts, model=model)
+
+
+class IngestionEngine:
+    def __init__(self, sinks: List[Sink], chunking: ChunkingConfig,
+                 embed_fn: Optional[EmbedFn] = None,
+                 embedding_model: Optional[str] = None,
+                 metadata_fn: Optional[Callable[[List[str]], Dict[str, Any]]] = None,
+                 on_document: Optional[Callable[[str, Dict[str, Any], Optional[str]], None]] = None,
+                 batch_size: int = 100,
+                 rate_controller: Optional[AdaptiveRateController] = None):
+        if not sinks:
+            raise ValueError("IngestionEngine necesita al menos un sink")
+        self.sinks = sinks
+        self.chunking = chunking
+        self.embed_fn = embed_fn or _default_embed
+        self.embedding_model = embedding_model
+        self.metadata_fn = metadata_fn
+        self.on_document = on_document
+        self.batch_size = batch_size
+        # Los lotes de embeddings los dimensiona el controlador (máx. = límite de la API)
+        self.rate = rate_controller or AdaptiveRateController(batch_size=batch_size, max_batch=batch_size)
+        self._pending = PendingBatch(sinks)
+
+    def run(self, documents: Iterable[SourceDocument], expected: int = 0,
+            known: Optional[Dict[Sink, Set[str]]] = None) -> IngestionReport:
+        """
+        Indexa `documents`; `expected` es cuántos se esperan (para informar el avance).
+        `known` son los archivos ya indexados por sink, si quien llama ya los
+        consultó (cada known_sources() recorre la colección completa).
+        """
+        global LAST_RUN
+        report = IngestionReport(files_expected=expected, running=True)
+        LAST_RUN = report
+        known = known or {}
+        try:
+            known = {id(s): known[s] if s in known else s.known_sources() for s in self.sinks}
+            for doc in documents:
+                report.files_seen += 1
+                targets = [s for s in self.sinks if doc.name not in known[id(s)]]
+                try:
+                    if not targets:
+                        report.files_skipped += 1
+                        continue
+                    self._ingest_document(doc, targets, report)
+                finally:
+                    if doc.cleanup and doc.path and doc.path.exists():
+                        doc.path.unlink()
+            self._flush(report)
+        finally:
+            report.elapsed = time.time() - report.started
+            report.running = False
+        return report
+
+    def _ingest_document(self, doc: SourceDocument, targets: List[Sink], report: IngestionReport) -> None:
+        pages = doc.pages
+        if pages is None:
+            if not doc.path or not doc.path.exists():
+                report.files_failed.append((doc.name, "no se pudo descargar"))
+                return
+            if doc.path.stat().st_size == 0:
+                report.files_failed.append((doc.name, "archivo vacío (0 bytes)"))
+                return
+            try:
+                pages = load_pdf_pages(doc.path)
+            except Exception as e:
+                report.files_failed.append((doc.name, f"no se pudo leer: {e}"))
+                return
+
+        doc_meta = self.metadata_fn(pages) if self.metadata_fn else {}
+        if self.on_document:
+            self.on_document(doc.name, doc_meta, doc.file_id)
+
+        chunks = split_pages(pages, self.chunking)
+        if not chunks:
+            report.files_failed.append((doc.name, "sin contenido válido"))
+            return
+
+        ids = [f"{doc.name}_{n}" for n in range(len(chunks))]
+        missing = [(self._pending.sink_mask([s]), s.filter_new(ids)) for s in targets]
+        doc_index = None
+        added = 0
+        for n, (chunk, uid) in enumerate(zip(chunks, ids)):
+            mask = 0
+            for bit, new_ids in missing:
+                if uid in new_ids:
+                    mask |= bit
+            if not mask:
+                continue
+            if doc_index is None:
+                doc_index = self._pending.add_document(
+                    {**doc_meta, "source": doc.name, "file_id": doc.file_id, "chunks": len(chunks)})
+            self._pending.append(uid, chunk, n, doc_index, mask)
+            added += 1
+
+        report.chunks_total += added
+        report.chunks_pending = len(self._pending)
+        if added:
+            report.files_indexed += 1
+            print(f"✅ {doc.name}: {added} chunks nuevos")
+        else:
+            report.files_skipped += 1
+        if len(self._pending) >= self.batch_size:
+            self._flush(report)
+
+    def _flush(self, report: IngestionReport) -> None:
+        """Embeddings una vez por modelo y escritura en cada sink."""
+        pending, self._pending = self._pending, PendingBatch(self.sinks)
+        if not len(pending):
+            return
+        model_of = [s.embedding_model or self.embedding_model for s in self.sinks]
+        for model in dict.fromkeys(model_of):
+            model_mask = pending.sink_mask(s for s, m in zip(self.sinks, model_of) if m == model)
+            rows = [i for i, mask in enumerate(pending.mask) if mask & model_mask]
+            if not rows:
+                continue
+            vectors = self._embed([pending.texts[i] for i in rows], model, report)
+            done = [(i, v) for i, v in zip(rows, vectors) if v is not None]
+
+            for bit, sink in enumerate(self.sinks):
+                if model_of[bit] != model:
+                    continue
+                sel = [(i, v) for i, v in done if pending.mask[i] >> bit & 1]
+                if not sel:
+                    continue
+                written = sink.write(
+                    [pending.ids[i] for i, _ in sel],
+                    [pending.texts[i] for i, _ in sel],
+                    [pending.metadata(i) for i, _ in sel],
+                    [v for _, v in sel],
+                )
+                report.chunks_written[sink.name] = report.chunks_written.get(sink.name, 0) + written
+        report.chunks_pending = len(self._pending)
+
+    def _embed(self, texts: List[str], model: Optional[str],
+               report: IngestionReport) -> List[Optional[List[float]]]:
+        """Embeddings en lotes del tamaño que indique el controlador; None si el lote falló."""
+        vectors: List[Optional[List[float]]] = []
+        i = 0
+        while i < len(texts):
+            batch = texts[i:i + self.rate.batch_size]
+            try:
+                vectors.extend(self.rate.call(lambda: self.embed_fn(batch, model), label="embeddings"))
+                report.embed_calls += 1
+            except Exception as e:
+                print(f"❌ Error generando embeddings ({model or 'por defecto'}): {e}")
+                report.chunks_failed += len(batch)
+                vectors.extend([None] * len(batch))
+            i += len(batch)
+        return vectors
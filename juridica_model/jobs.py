@@ -0,0 +1,252 @@
+# jobs.py
+# Cola local de trabajos para la pestaña de análisis de documentos.
+# El análisis (extracción, dos resúmenes) y la búsqueda de precedentes
+# (embeddings, búsqueda y hasta 20 calificaciones) tardan minutos: en vez de
+# ocupar el hilo del evento de Gradio, se encolan y los ejecuta un pool fijo
+# de ANALYSIS_WORKERS hilos por instancia.
+#   - cada trabajo tiene un ID y guarda en SQLite (JOBS_DB) su estado, la
+#     etapa en curso con su fracción de avance y el resultado (JSON)
+#   - la UI consulta el trabajo por ID (también después, desde otra sesión)
+#   - al arrancar, los trabajos en cola o en curso de una instancia anterior
+#     quedan como 'interrupted' y se borran los de más de JOBS_RETENTION_DAYS
+# La base es local a la instancia (cada instancia tiene su propio pool).
+#
+# Uso:  python jobs.py [ID]
+from __future__ import annotations
+import os
+import sys
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from tracing import span
+
+JOBS_DB = os.getenv("JOBS_DB", "analysis_jobs.db")
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", 2))
+JOBS_RETENTION_DAYS = float(os.getenv("JOBS_RETENTION_DAYS", 7))
+
+STATUSES = ("queued", "running", "done", "failed", "interrupted")
+FINISHED = ("done", "failed", "interrupted")
+
+# fn(on_stage) → resultado serializable en JSON; on_stage(fracción, descripción)
+JobFn = Callable[[Callable[[float, str], None]], Any]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          TEXT PRIMARY KEY,
+    kind        TEXT NOT NULL,
+    owner       TEXT,
+    status      TEXT NOT NULL,                -- queued | running | done | failed | interrupted
+    progress    REAL NOT NULL DEFAULT 0,
+    stage       TEXT,
+    params      TEXT,                         -- JSON
+    result      TEXT,                         -- JSON
+    error       TEXT,
+    created_at  REAL NOT NULL,
+    started_at  REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status  ON jobs(status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_owner   ON jobs(owner, created_at);
+"""
+
+
+class JobStore:
+    """
+    Trabajos persistentes. Una conexión por hilo (los workers escriben el
+    avance mientras los eventos de Gradio lo leen) y modo WAL.
+    """
+
+    def __init__(self, path: str | Path = JOBS_DB):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ── Escritura ────────────────────────────────
+    def create(self, job_id: str, kind: str, owner: Optional[str] = None,
+               params: Optional[Dict[str, Any]] = None) -> None:
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, owner, status, stage, params, created_at) "
+                "VALUES (?, ?, ?, 'queued', 'En cola', ?, ?)",
+                (job_id, kind, owner, json.dumps(params or {}, ensure_ascii=False), time.time()),
+            )
+
+    def start(self, job_id: str) -> None:
+        with self._conn() as conn:
+            conn.execute("UPDATE jobs SET status = 'running', stage = 'Iniciando...', started_at = ? WHERE id = ?",
+                         (time.time(), job_id))
+
+    def progress(self, job_id: str, fraction: float, stage: str) -> None:
+        with self._conn() as conn:
+            conn.execute("UPDATE jobs SET progress = ?, stage = ? WHERE id = ?",
+                         (max(0.0, min(1.0, fraction)), stage, job_id))
+
+    def finish(self, job_id: str, result: Any) -> None:
+        with self._conn() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', progress = 1, stage = 'Completado', result = ?, "
+                "finished_at = ? WHERE id = ?",
+                (json.dumps(result, ensure_ascii=False, default=str), time.time(), job_id),
+            )
+
+    def fail(self, job_id: str, error: str) -> None:
+        with self._conn() as conn:
+            conn.execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                         (error, time.time(), job_id))
+
+    def interrupt_stale(self) -> int:
+        """Trabajos que quedaron en cola o en curso cuando se detuvo la instancia anterior."""
+        with self._conn() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = 'interrupted', error = 'La instancia se reinició antes de terminar', "
+                "finished_at = ? WHERE status IN ('queued', 'running')",
+                (time.time(),),
+            )
+        return cur.rowcount
+
+    def purge(self, older_than_days: float = JOBS_RETENTION_DAYS) -> int:
+        cutoff = time.time() - older_than_days * 86400
+        with self._conn() as conn:
+            cur = conn.execute("DELETE FROM jobs WHERE created_at < ? AND status IN ('done', 'failed', 'interrupted')",
+                               (cutoff,))
+        return cur.rowcount
+
+    # ── Consulta ─────────────────────────────────
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _decode(row) if row else None
+
+    def position(self, job_id: str) -> int:
+        """Trabajos en cola antes de `job_id` (0 si ya empezó o no existe)."""
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued' "
+            "AND created_at < (SELECT created_at FROM jobs WHERE id = ? AND status = 'queued')",
+            (job_id,),
+        ).fetchone()[0]
+
+    def recent(self, owner: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """Últimos trabajos (de `owner` si se indica), sin el resultado."""
+        where, params = ("WHERE owner = ?", (owner,)) if owner else ("", ())
+        rows = self._conn().execute(
+            f"SELECT id, kind, owner, status, progress, stage, error, created_at, started_at, finished_at "
+            f"FROM jobs {where} ORDER BY created_at DESC LIMIT ?",
+            (*params, limit),
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    def counts(self) -> Dict[str, int]:
+        rows = self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {**{status: 0 for status in STATUSES}, **{r[0]: r[1] for r in rows}}
+
+
+def _decode(row: sqlite3.Row) -> Dict[str, Any]:
+    job = dict(row)
+    for key in ("params", "result"):
+        job[key] = json.loads(job[key]) if job[key] else None
+    return job
+
+
+# ── Cola ─────────────────────────────────────────
+class JobQueue:
+    """
+    Pool fijo de `workers` hilos que ejecuta los trabajos en orden de llegada.
+    submit() vuelve de inmediato con el ID; el avance y el resultado quedan
+    en el JobStore.
+    """
+
+    def __init__(self, store: JobStore, workers: int = ANALYSIS_WORKERS):
+        self.store = store
+        self.workers = max(1, workers)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="analysis-job")
+        self._done: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, fn: JobFn, owner: Optional[str] = None,
+               params: Optional[Dict[str, Any]] = None) -> str:
+        job_id = uuid.uuid4().hex
+        self.store.create(job_id, kind, owner, params)
+        with self._lock:
+            self._done[job_id] = threading.Event()
+        self._pool.submit(self._run, job_id, kind, fn)
+        print(f"🗂️ Trabajo {kind} {job_id[:8]} en cola")
+        return job_id
+
+    def _run(self, job_id: str, kind: str, fn: JobFn) -> None:
+        self.store.start(job_id)
+        t0 = time.perf_counter()
+        try:
+            with span(f"jobs.{kind}", job=job_id):
+                result = fn(lambda fraction, stage: self.store.progress(job_id, fraction, stage))
+            self.store.finish(job_id, result)
+            print(f"✅ Trabajo {kind} {job_id[:8]} completado en {time.perf_counter() - t0:.1f}s")
+        except Exception as e:
+            self.store.fail(job_id, str(e))
+            print(f"❌ Trabajo {kind} {job_id[:8]} falló: {e}")
+        finally:
+            with self._lock:
+                event = self._done.pop(job_id, None)
+            if event:
+                event.set()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self.store.get(job_id)
+        if job and job["status"] == "queued":
+            job["position"] = self.store.position(job_id)
+        return job
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Bloquea hasta que el trabajo termine (o venza `timeout`) y lo devuelve."""
+        with self._lock:
+            event = self._done.get(job_id)
+        if event:
+            event.wait(timeout)
+        return self.get(job_id)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait)
+
+
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+
+def default_queue() -> JobQueue:
+    """Cola de la instancia (se crea en el primer uso, con la limpieza de arranque)."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            store = JobStore()
+            interrupted, purged = store.interrupt_stale(), store.purge()
+            if interrupted or purged:
+                print(f"🗂️ Trabajos: {interrupted} interrumpidos por reinicio, {purged} antiguos borrados")
+            _queue = JobQueue(store)
+            print(f"🗂️ Cola de análisis: {_queue.workers} workers, base {store.path}")
+        return _queue
+
+
+if __name__ == "__main__":
+    store = JobStore()
+    if len(sys.argv) > 1:
+        print(json.dumps(store.get(sys.argv[1]), ensure_ascii=False, indent=2))
+    else:
+        for job in store.recent():
+            print(f"{job['id']}  {job['kind']:<12}{job['status']:<12}{job['progress']:>5.0%}  {job['stage'] or ''}")
+        print(store.counts())
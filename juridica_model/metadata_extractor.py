@@ -0,0 +1,137 @@
+# metadata_extractor.py
+# Extracción de metadatos de resoluciones en una sola pasada.
+# Una única regex precompilada recorre el texto una vez y reporta número de
+# resolución, número interno, PA y sanción, cada uno con su offset y página.
+from __future__ import annotations
+import re
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# ── Patrones (mismas reglas que usaba ingest.py) ─────────────────
+res_regex = re.compile(r"\b\d{4,6}-\d{4}\b")      # 07685-2025
+int_regex = re.compile(r"\b[A-Z]{2}-\d{3,4}\b")   # DJ-0612
+pa_regex = re.compile(r"\b(?:CGR-)?PA-\d{8,10}\b", re.I)
+
+# Sanitiza sanciones + detecta "archivo"
+sancion_regex = re.compile(
+    r"(separaci[oó]n del cargo[^\n]*?|despido[^\n]*?responsabilidad[^\n]*?|"
+    r"suspensi[oó]n[^\n]*?(d[ií]as|meses|años)|inhabilitaci[oó]n[^\n]*?años?|"
+    r"prohibici[oó]n de ingreso[^\n]*?|multa[^\n]*?¢[\d\.]+|archivo)",
+    re.IGNORECASE
+)
+
+TIPO_PATTERNS = {
+    "despido sin responsabilidad": r"despido\s+sin\s+responsabilidad",
+    "despido con responsabilidad": r"despido\s+con\s+responsabilidad",
+    "suspensión":                   r"suspensi[oó]n",
+    "inhabilitación":               r"inhabilitaci[oó]n",
+    "multa":                        r"\bmulta\b",
+    "archivo":                      r"\barchivo\b",
+    "apercibimiento":               r"apercibimiento",
+}
+_TIPO_COMPILED = [(tipo, re.compile(patt, re.I)) for tipo, patt in TIPO_PATTERNS.items()]
+
+# Pasada única: todo identificador (resolución, interno, PA) contiene un guion
+# seguido de dígito, y toda sanción empieza con una de estas palabras. La
+# alternancia de literales se busca sobre el texto en minúsculas (sin
+# IGNORECASE, que es lo que hacía lenta la regex de sanciones) y cada
+# coincidencia se valida con la regex original anclada en esa posición.
+_KEYWORDS = (r"separaci[oó]n del cargo|despido|suspensi[oó]n|inhabilitaci[oó]n"
+             r"|prohibici[oó]n de ingreso|multa|archivo")
+_HIT_RE = re.compile(r"-\d|" + _KEYWORDS)
+_HIT_RE_I = re.compile(r"-\d|" + _KEYWORDS, re.I)
+
+
+class MetadataMatch(NamedTuple):
+    kind: str    # resolucion | interno | pa | sancion
+    value: str
+    start: int   # offset en el texto del documento (páginas unidas con "\n")
+    end: int
+    page: int
+
+
+@lru_cache(maxsize=256)
+def sancion_a_tipo(s: str | None) -> str | None:
+    if not s:
+        return None
+    for tipo, patt in _TIPO_COMPILED:
+        if patt.search(s):
+            return tipo
+    return None
+
+
+def _page_starts(pages: List[str]) -> List[int]:
+    starts, pos = [], 0
+    for page in pages:
+        starts.append(pos)
+        pos += len(page) + 1
+    return starts
+
+
+def _identifier_at(text: str, hyphen: int) -> Optional[Tuple[str, re.Match]]:
+    """Identificador cuyo guion está en `hyphen` (mismas reglas \\b que las regex)."""
+    j = hyphen
+    while j > 0 and text[j - 1].isdigit():
+        j -= 1
+    if j < hyphen:
+        m = res_regex.match(text, j)
+        return ("resolucion", m) if m else None
+    while j > 0 and text[j - 1].isalpha():
+        j -= 1
+    if j == hyphen:
+        return None
+    if j >= 4 and text[j - 4:j].upper() == "CGR-" and (m := pa_regex.match(text, j - 4)):
+        return "pa", m
+    if m := pa_regex.match(text, j):
+        return "pa", m
+    if m := int_regex.match(text, j):
+        return "interno", m
+    return None
+
+
+def scan_document(pages: List[str], first_only: bool = False) -> List[MetadataMatch]:
+    """
+    Todas las coincidencias del documento, en orden, con su página.
+    Con `first_only=True` se detiene cuando ya tiene una de cada tipo.
+    """
+    text = "\n".join(pages)
+    low = text.lower()
+    if len(low) == len(text):
+        hits = _HIT_RE.finditer(low)
+    else:  # algún carácter cambia de longitud al pasar a minúsculas
+        hits = _HIT_RE_I.finditer(text)
+    starts = _page_starts(pages)
+    found: List[MetadataMatch] = []
+    seen = set()
+    for hit in hits:
+        pos = hit.start()
+        if text[pos] == "-":
+            ident = _identifier_at(text, pos)
+            if not ident:
+                continue
+            kind, m = ident
+            value = m.group()
+        else:
+            kind = "sancion"
+            m = sancion_regex.match(text, pos)
+            if not m:
+                continue
+            value = " ".join(m.group().split())
+        if first_only and kind in seen:
+            continue
+        found.append(MetadataMatch(kind, value, m.start(), m.end(), bisect_right(starts, m.start()) - 1))
+        seen.add(kind)
+        if first_only and len(seen) == 4:
+            break
+    return found
+
+
+def extract_metadata(pages: List[str]) -> Dict[str, Optional[str]]:
+    """Metadatos de la resolución (primera coincidencia de cada tipo + tipo de sanción)."""
+    meta: Dict[str, Optional[str]] = {}
+    for match in scan_document(pages, first_only=True):
+        meta[match.kind] = match.value
+        if match.kind == "sancion":
+            meta["tipo"] = sancion_a_tipo(match.value)
+    return meta
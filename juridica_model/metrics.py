@@ -0,0 +1,274 @@
+# metrics.py
+# Métricas en formato de texto de Prometheus (0.0.4) para GET /metrics.
+#   - Counter / Gauge / Histogram con etiquetas, registrados en REGISTRY
+#   - colectores: funciones que se evalúan en cada scrape y leen el estado
+#     que ya llevan otros módulos (cuota de Gemini, corte de recuperación,
+#     ingestión, consultas por código, cassette de replay.py, cola de jobs.py)
+#   - la duración de cada span de tracing.py alimenta rag_stage_duration_seconds
+#     (latencia de Qdrant = stage="retrieval.search")
+# Solo biblioteca estándar; los módulos observados se importan al hacer scrape.
+from __future__ import annotations
+import os
+import math
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import tracing
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")  # si está definido, /metrics exige "Bearer <token>"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = Tuple[str, ...]
+# (nombre, tipo, ayuda, [(etiquetas, valor)])
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelKey:
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def _dict(self, key: LabelKey) -> Dict[str, str]:
+        return dict(zip(self.label_names, key))
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            return [(self.name, self._dict(k), v) for k, v in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[LabelKey, List[int]] = {}
+        self._sums: Dict[LabelKey, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            counts[i] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        out = []
+        with self._lock:
+            for key, counts in self._counts.items():
+                labels = self._dict(key)
+                total = 0
+                for bound, n in zip(self.buckets + (math.inf,), counts):
+                    total += n
+                    out.append((f"{self.name}_bucket", {**labels, "le": _number(bound)}, total))
+                out.append((f"{self.name}_count", labels, total))
+                out.append((f"{self.name}_sum", labels, self._sums[key]))
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def register_collector(self, fn: Callable[[], Iterable[Family]]) -> None:
+        """`fn()` devuelve familias (nombre, tipo, ayuda, [(etiquetas, valor)]) en cada scrape."""
+        with self._lock:
+            self._collectors.append(fn)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+        for m in metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            lines.extend(f"{name}{_labels(labels)} {_number(value)}" for name, labels, value in m.samples())
+        for collect in collectors:
+            try:
+                families = list(collect())
+            except Exception as e:
+                print(f"⚠️ Error en colector de métricas {getattr(collect, '__name__', collect)}: {e}")
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(f"{name}{_labels(labels)} {_number(value)}" for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# ── Métricas instrumentadas ──────────────────────
+QUERIES = REGISTRY.counter("rag_chat_queries_total", "Consultas del chat por ruta de respuesta", ["route"])
+CACHE = REGISTRY.counter("rag_cache_requests_total", "Accesos a cachés por resultado (hit/miss)",
+                         ["cache", "result"])
+GEMINI_CALLS = REGISTRY.counter("rag_gemini_calls_total",
+                                "Llamadas a Gemini por tipo y resultado (ok/quota/shed/error)",
+                                ["kind", "outcome"])
+GEMINI_TOKENS = REGISTRY.counter("rag_gemini_tokens_total", "Tokens consumidos en Gemini (usage_metadata "
+                                 "o estimación)", ["kind"])
+STAGE_SECONDS = REGISTRY.histogram("rag_stage_duration_seconds", "Duración de cada etapa (spans de tracing)",
+                                   ["stage"])
+
+
+def _observe_span(span: "tracing.Span") -> None:
+    STAGE_SECONDS.observe(span.duration_ms / 1000, stage=span.name)
+
+
+tracing.TRACER.listeners.append(_observe_span)
+
+
+# ── Colectores ───────────────────────────────────
+def _admission_families() -> Iterable[Family]:
+    from rate_control import _admission
+    available, admitted, shed = [], [], []
+    for kind, gate in list(_admission.items()):
+        s = gate.stats()
+        available.append(({"kind": kind, "unit": "requests"}, s["requests_available"]))
+        available.append(({"kind": kind, "unit": "tokens"}, s["tokens_available"]))
+        admitted += [({"kind": kind, "priority": str(p)}, n) for p, n in s["admitted"].items()]
+        shed += [({"kind": kind, "priority": str(p)}, n) for p, n in s["shed"].items()]
+    yield ("rag_gemini_quota_available", "gauge", "Cuota local disponible en el minuto actual", available)
+    yield ("rag_gemini_admitted_total", "counter", "Llamadas admitidas por prioridad", admitted)
+    yield ("rag_gemini_shed_total", "counter", "Llamadas rechazadas localmente por falta de cuota", shed)
+
+
+def _retrieval_families() -> Iterable[Family]:
+    from retrieval import STATS
+    totals = STATS.snapshot()
+    yield ("rag_retrieval_queries_total", "counter", "Búsquedas con corte adaptativo",
+           [({}, totals["queries"])])
+    yield ("rag_retrieval_hits_total", "counter", "Candidatos de las búsquedas por destino",
+           [({"stage": k}, totals[k]) for k in ("fetched", "kept", "by_score", "by_gap", "by_max_k")])
+
+
+def _ingestion_families() -> Iterable[Family]:
+    from ingestion import LAST_RUN
+    report = LAST_RUN
+    if report is None:
+        return
+    yield ("rag_ingestion_running", "gauge", "1 si hay una ingestión en curso", [({}, int(report.running))])
+    yield ("rag_ingestion_files", "gauge", "Archivos de la última ingestión por estado", [
+        ({"state": "expected"}, report.files_expected),
+        ({"state": "seen"}, report.files_seen),
+        ({"state": "indexed"}, report.files_indexed),
+        ({"state": "skipped"}, report.files_skipped),
+        ({"state": "failed"}, len(report.files_failed)),
+    ])
+    yield ("rag_ingestion_chunks", "gauge", "Chunks de la última ingestión por estado", [
+        ({"state": "pending"}, report.chunks_pending),
+        ({"state": "total"}, report.chunks_total),
+        ({"state": "failed"}, report.chunks_failed),
+    ] + [({"state": "written", "sink": sink}, n) for sink, n in report.chunks_written.items()])
+
+
+def _trace_families() -> Iterable[Family]:
+    samples = []
+    for name, s in tracing.STATS.summary().items():
+        for q in ("p50", "p95", "p99"):
+            samples.append(({"stage": name, "quantile": str(int(q[1:]) / 100)}, s[q] / 1000))
+    yield ("rag_stage_latency_seconds", "gauge", "Percentiles recientes por etapa (ventana de tracing.STATS)",
+           samples)
+
+
+def _replay_families() -> Iterable[Family]:
+    import replay
+    if not replay.enabled():
+        return
+    samples = [({"kind": kind, "result": result}, n)
+               for kind, counts in replay.STATS.snapshot().items() for result, n in counts.items()]
+    yield ("rag_gemini_replay_total", "counter", f"Llamadas a Gemini servidas por el cassette ({replay.MODE})",
+           samples)
+
+
+def _job_families() -> Iterable[Family]:
+    import jobs
+    queue = jobs._queue
+    if queue is None:
+        return
+    yield ("rag_analysis_jobs", "gauge", "Trabajos de análisis guardados por estado",
+           [({"status": status}, n) for status, n in queue.store.counts().items()])
+    yield ("rag_analysis_workers", "gauge", "Workers de la cola de análisis", [({}, queue.workers)])
+
+
+for _collector in (_admission_families, _retrieval_families, _ingestion_families, _trace_families,
+                   _replay_families, _job_families):
+    REGISTRY.register_collector(_collector)
+
+
+def authorized(header: Optional[str]) -> bool:
+    """Verifica el encabezado Authorization si METRICS_TOKEN está definido."""
+    return not METRICS_TOKEN or header == f"Bearer {METRICS_TOKEN}"
+
+
+def render() -> str:
+    return REGISTRY.render()
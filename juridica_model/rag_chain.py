@@ -4,22 +4,28 @@ import os
 import re
 import json
 import time
-import uuid
+import threading
 from pathlib import Path
-from typing import Any, Dict, List, Tuple, Optional
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple, Optional
 
 # --- Dependencias Clave ---
-import google.generativeai as genai
+# (el SDK de Gemini, qdrant_client, la API de Drive y los lectores de PDF se
+# cargan en su primer uso: importar este módulo no abre conexiones)
 from google.api_core.exceptions import ResourceExhausted
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 
-# Qdrant imports
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
-
-# Importamos las funciones para descargar desde Drive
-from drive_utils import download_file_from_drive, list_pdf_files_in_folder
+# Almacén vectorial (Qdrant Cloud o backend local, según VECTOR_BACKEND) y Gemini compartidos
+import services
+from gemini_utils import embed_query, generate, EMBEDDING_DIM
+from rate_control import QuotaExceeded
+from context_builder import CONTEXT_PAYLOAD_FIELDS, CONTEXT_TOKEN_BUDGET, PackedContext, build_context, SEPARATOR
+from retrieval import CutoffConfig, Retriever
+from conversation import ConversationStore, QueryPlan, extract_entities
+from tracing import span, traced
+import metrics
+from metrics import CACHE, QUERIES
+from ingestion import ChunkingConfig, IngestionEngine, VectorStoreSink, drive_documents
+from metadata_extractor import extract_metadata
+from catalog_store import FIELDS as CATALOG_FIELDS, CatalogStore, record_failures
 
 # Al inicio de rag_chain.py, después de todos los imports
 try:
@@ -35,6 +41,7 @@ API_KEY = os.getenv("GEMINI_API_KEY")
 MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
 
 # Configuración de Qdrant
+VECTOR_BACKEND = (os.getenv("VECTOR_BACKEND") or "qdrant").strip().lower()
 QDRANT_URL = os.getenv("QDRANT_URL")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 COLLECTION_NAME = "resoluciones"
@@ -42,8 +49,15 @@ COLLECTION_NAME = "resoluciones"
 # ID de la CARPETA de Google Drive
 DRIVE_FOLDER_ID = "16as2spSPhK7027oqYer372k4Cxt_XOyf"
 
+# Corte adaptativo de resultados (configurable con RETRIEVAL_*)
+RETRIEVAL = CutoffConfig.from_env(CutoffConfig(fetch_k=20, min_k=3, max_k=10))
+
+# Chunking del índice (1500 caracteres, 150 de traslape; configurable con INGEST_CHUNK_*)
+CHUNKING = ChunkingConfig.from_env(ChunkingConfig(unit="chars", size=1500, overlap=150))
+
 print("🚀 Iniciando rag_chain.py...")
 print(f"Variables configuradas - GEMINI_API_KEY: {'OK' if API_KEY else 'FALTA'}")
+print(f"VECTOR_BACKEND: {VECTOR_BACKEND}")
 print(f"QDRANT_URL: {'OK' if QDRANT_URL else 'FALTA'}")
 print(f"QDRANT_API_KEY: {'OK' if QDRANT_API_KEY else 'FALTA'}")
 print(f"DRIVE_FOLDER_ID: {DRIVE_FOLDER_ID}")
@@ -51,66 +65,58 @@ print(f"DRIVE_FOLDER_ID: {DRIVE_FOLDER_ID}")
 # Verificar variables críticas
 if not API_KEY:
     raise ValueError("❌ GEMINI_API_KEY no está configurada en las variables de entorno")
-if not QDRANT_URL:
+if VECTOR_BACKEND == "qdrant" and not QDRANT_URL:
     raise ValueError("❌ QDRANT_URL no está configurada en las variables de entorno")
-if not QDRANT_API_KEY:
+if VECTOR_BACKEND == "qdrant" and not QDRANT_API_KEY:
     raise ValueError("❌ QDRANT_API_KEY no está configurada en las variables de entorno")
 
-if API_KEY:
-    genai.configure(api_key=API_KEY)
-
 # --- Variables Globales y de Estado ---
-IS_INITIALIZED = False
-_LAST_ACTIVE: Dict[str, str] = {}
-
-# --- Inicialización del Cliente Qdrant y Modelos ---
-qdrant_client = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
-llm = genai.GenerativeModel(MODEL) if API_KEY else None
+# Sincronización con Drive en segundo plano: cold → warming → ready | degraded
+READINESS = "cold"
+INIT_ERROR: Optional[str] = None
+INIT_RETRY_SECONDS = float(os.getenv("RAG_INIT_RETRY_SECONDS", 300))
+# Filas como máximo en los listados del catálogo (se avisa cuántas hay en total)
+CATALOG_LIST_LIMIT = int(os.getenv("CATALOG_LIST_LIMIT", 50))
+_INIT_LOCK = threading.Lock()
+_INIT_THREAD: Optional[threading.Thread] = None
+_INIT_STARTED = 0.0
+_HAS_INDEX = False
+# Turnos recientes y entidades activas por sesión (seguimientos del chat)
+_CONVERSATIONS = ConversationStore()
+
+# --- Almacén Vectorial (el cliente se crea en la primera búsqueda) ---
+vector_store = services.shared_vector_store(COLLECTION_NAME, qdrant_url=QDRANT_URL, qdrant_api_key=QDRANT_API_KEY)
+# Payload: lo que arma el contexto más los identificadores que sigue la conversación
+CHAT_PAYLOAD_FIELDS = CONTEXT_PAYLOAD_FIELDS + ["metadata.resolucion", "metadata.interno", "metadata.pa"]
+retriever = Retriever(vector_store, RETRIEVAL, label="chat", payload_fields=CHAT_PAYLOAD_FIELDS)
+# Catálogo de resoluciones (SQLite, ruta en CATALOG_DB)
+catalog = CatalogStore()
 
 # --- Función para generar embeddings ---
-def get_embeddings_batch(texts: List[str]) -> List[List[float]]:
-    """Genera embeddings usando Gemini para una lista de textos."""
-    if not API_KEY:
-        raise ValueError("API_KEY de Gemini no configurada")
-    
-    embeddings = []
-    for i, text in enumerate(texts):
-        try:
-            result = genai.embed_content(
-                model="models/embedding-001",
-                content=text,
-                task_type="retrieval_document"
-            )
-            embeddings.append(result['embedding'])
-            if (i + 1) % 10 == 0:
-                print(f"Generados {i + 1}/{len(texts)} embeddings...")
-        except Exception as e:
-            print(f"Error generando embedding para texto {i}: {e}")
-            embeddings.append([0.0] * 768)
-    
-    return embeddings
-
 def get_query_embedding(query: str) -> List[float]:
     """Genera embedding para una consulta."""
     if not API_KEY:
         raise ValueError("API_KEY de Gemini no configurada")
     
     try:
-        result = genai.embed_content(
-            model="models/embedding-001",
-            content=query,
-            task_type="retrieval_query"
-        )
-        return result['embedding']
+        return embed_query(query)
+    except (QuotaExceeded, ResourceExhausted):
+        raise  # sin cuota: mejor avisar que buscar con un vector en cero
     except Exception as e:
         print(f"Error generando embedding de consulta: {e}")
-        return [0.0] * 768
+        return [0.0] * EMBEDDING_DIM
 
 # ── Regex & Claves ────────────────────────────────
 RES_RE = re.compile(r"\b\d{4,6}-\d{4}\b")
 INT_RE = re.compile(r"\b[A-Z]{2}-\d{3,4}\b")
 YEAR_RE = re.compile(r"\b(19|20)\d{2}\b")
-LIST_RE = re.compile(r"\b(lista|listado|muestr[ae]|mostrar|dame|ens[eñ]a|ensena)\b", re.I)
+LIST_RE = re.compile(r"\b(lista|listado|mu[eé]str(?:[ae]|ame)|mostrar|dame|ens[eñ]a|ensena)\b", re.I)
+# Listado explícito por tipo de sanción: "resoluciones con multa", "casos de suspensión"
+LISTING_RE = re.compile(
+    r"\b(?:resoluciones|casos|expedientes|procedimientos)\s+(?:\w+\s+){0,2}?(?:con|de|por)\s+(?:una?\s+|la\s+|el\s+)?"
+    r"(?P<tipo>despido\s+(?:sin|con)\s+responsabilidad|suspensi[oó]n|inhabilitaci[oó]n|multa|archivo|apercibimiento)",
+    re.I,
+)
 HELLO_RE = re.compile(r"\b(hola|buen[oa]s(?:\s*d[ií]as|\s*tardes|\s*noches)?|saludos|qu[eé] tal)\b", re.I)
 GOODBYE_RE = re.compile(r"\b(ad[ií]os|hasta luego|nos vemos|chao|bye|hasta pronto)\b", re.I)
 COURTESY_RE = re.compile(r"\b(gracias|muchas gracias|perfecto|de acuerdo|entendido)\b", re.I)
@@ -125,266 +131,118 @@ SANCION_KEYS = {
     "apercibimiento": re.compile(r"apercibimiento", re.I),
 }
 
-def process_new_files(all_pdf_files: List[dict], new_file_names: set):
-    """Procesa solo los archivos nuevos y los agrega a Qdrant."""
-    print("🔄 Procesando archivos nuevos...")
-    
-    new_docs = []
-    new_metadatas = []
-    processed_count = 0
-    
-    for pdf_info in all_pdf_files:
-        pdf_name = pdf_info['name']
-        if pdf_name not in new_file_names:
-            continue  # Saltar archivos ya procesados
-            
-        pdf_id = pdf_info['id']
-        print(f"📄 Procesando nuevo archivo: {pdf_name}")
-        
-        local_pdf_path = download_file_from_drive(pdf_id, pdf_name)
-        if not local_pdf_path or not os.path.exists(local_pdf_path):
-            print(f"⚠️ No se pudo descargar: {pdf_name}")
-            continue
-            
-        if os.path.getsize(local_pdf_path) == 0:
-            print(f"⚠️ Archivo vacío: {pdf_name}")
-            os.remove(local_pdf_path)
-            continue
-        
-        try:
-            loader = PyPDFLoader(local_pdf_path)
-            pages = loader.load_and_split()
-            
-            if not pages:
-                print(f"⚠️ No se pudieron extraer páginas: {pdf_name}")
-                continue
-            
-            text_splitter = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=150)
-            docs = text_splitter.split_documents(pages)
-            
-            valid_chunks = 0
-            for doc in docs:
-                if doc.page_content.strip():
-                    new_docs.append(doc.page_content)
-                    new_metadatas.append({
-                        "source": pdf_name,
-                        "page": doc.metadata.get("page", 0),
-                        "file_id": pdf_id
-                    })
-                    valid_chunks += 1
-            
-            if valid_chunks > 0:
-                print(f"✅ {pdf_name}: {valid_chunks} chunks nuevos")
-                processed_count += 1
-            
-        except Exception as e:
-            print(f"❌ Error procesando {pdf_name}: {e}")
-        finally:
-            if os.path.exists(local_pdf_path):
-                os.remove(local_pdf_path)
-    
-    # Insertar nuevos documentos en Qdrant
-    if new_docs:
-        print(f"📊 Insertando {len(new_docs)} chunks nuevos en Qdrant...")
-        
-        embeddings = get_embeddings_batch(new_docs)
-        points = []
-        
-        for doc, metadata, embedding in zip(new_docs, new_metadatas, embeddings):
-            points.append(
-                PointStruct(
-                    id=str(uuid.uuid4()),
-                    vector=embedding,
-                    payload={"document": doc, "metadata": metadata}
-                )
-            )
-        
-        # Insertar en lotes
-        batch_size = 100
-        for i in range(0, len(points), batch_size):
-            batch = points[i:i + batch_size]
-            qdrant_client.upsert(collection_name=COLLECTION_NAME, points=batch)
-        
-        print(f"✅ {processed_count} archivos nuevos procesados exitosamente!")
-    else:
-        print("⚠️ No se encontraron chunks válidos en los archivos nuevos")
-
-# --- FUNCIÓN DE INICIALIZACIÓN CON DETECCIÓN DE ARCHIVOS NUEVOS ---
 def initialize_rag_system():
     """
-    Descarga los PDFs, los procesa y los carga en Qdrant.
-    Maneja archivos corruptos/vacíos de forma robusta.
+    Sincroniza la carpeta de Drive con el almacén vectorial.
+    Solo se descargan y procesan los PDFs que todavía no están indexados;
+    los archivos corruptos/vacíos se saltan y quedan en el reporte.
+    Se ejecuta en segundo plano (ver start_background_init).
     """
-    global IS_INITIALIZED
-    print("Iniciando sistema RAG con Qdrant...")
+    from drive_utils import list_pdf_files_in_folder
+    print(f"Iniciando sistema RAG con {VECTOR_BACKEND}...")
     
     try:
-        # 1. Verificar si la colección ya existe
-        collections = qdrant_client.get_collections().collections
-        collection_exists = any(col.name == COLLECTION_NAME for col in collections)
-        
-        if not collection_exists:
-            print(f"Creando colección '{COLLECTION_NAME}' en Qdrant...")
-            qdrant_client.create_collection(
-                collection_name=COLLECTION_NAME,
-                vectors_config=VectorParams(size=768, distance=Distance.COSINE)
-            )
-        else:
-            # Verificar si hay archivos nuevos
-            collection_info = qdrant_client.get_collection(COLLECTION_NAME)
-            if collection_info.points_count > 0:
-                print(f"Colección '{COLLECTION_NAME}' ya existe con {collection_info.points_count} puntos")
-                
-                # Verificar si hay archivos nuevos para procesar
-                print("Verificando archivos nuevos...")
-                pdf_files = list_pdf_files_in_folder(DRIVE_FOLDER_ID)
-                
-                # Obtener archivos ya procesados
-                existing_files = set()
-                try:
-                    # Buscar todos los puntos existentes para obtener los nombres de archivos
-                    scroll_result = qdrant_client.scroll(
-                        collection_name=COLLECTION_NAME,
-                        limit=10000,  # Ajustar según necesidades
-                        with_payload=True
-                    )
-                    
-                    for point in scroll_result[0]:
-                        source = point.payload.get("metadata", {}).get("source", "")
-                        if source:
-                            existing_files.add(source)
-                    
-                    print(f"Archivos ya procesados: {len(existing_files)}")
-                    
-                except Exception as e:
-                    print(f"Error obteniendo archivos existentes: {e}")
-                    existing_files = set()
-                
-                # Encontrar archivos nuevos
-                current_files = {pdf['name'] for pdf in pdf_files}
-                new_files = current_files - existing_files
-                
-                if new_files:
-                    print(f"🆕 Archivos nuevos detectados: {len(new_files)}")
-                    for new_file in sorted(new_files):
-                        print(f"  - {new_file}")
-                    
-                    # Procesar solo archivos nuevos
-                    process_new_files(pdf_files, new_files)
-                else:
-                    print("✅ No hay archivos nuevos para procesar")
-                
-                IS_INITIALIZED = True
-                return
+        # 1. Crear la colección si no existe (cuantización/HNSW configurados)
+        collection_exists = vector_store.ensure_collection()
         
         # 2. Listar archivos PDF
         pdf_files = list_pdf_files_in_folder(DRIVE_FOLDER_ID)
-        if not pdf_files:
+        if not pdf_files and not collection_exists:
             raise RuntimeError(f"No se encontraron archivos PDF en la carpeta: {DRIVE_FOLDER_ID}")
 
-        all_docs = []
-        all_metadatas = []
-        processed_files = 0
-        
-        # 3. Procesar cada archivo con manejo robusto de errores
-        for pdf_info in pdf_files:
-            pdf_id = pdf_info['id']
-            pdf_name = pdf_info['name']
-            print(f"Procesando: {pdf_name}")
-            
-            local_pdf_path = download_file_from_drive(pdf_id, pdf_name)
-            if not local_pdf_path:
-                print(f"⚠️ No se pudo descargar: {pdf_name}")
-                continue
-
-            # Verificar que el archivo existe y no está vacío
-            if not os.path.exists(local_pdf_path):
-                print(f"⚠️ Archivo no existe: {pdf_name}")
-                continue
-                
-            if os.path.getsize(local_pdf_path) == 0:
-                print(f"⚠️ Archivo vacío (0 bytes): {pdf_name}")
-                os.remove(local_pdf_path)
-                continue
-            
-            try:
-                # Intentar cargar y procesar el PDF
-                loader = PyPDFLoader(local_pdf_path)
-                pages = loader.load_and_split()
-                
-                if not pages:
-                    print(f"⚠️ No se pudieron extraer páginas: {pdf_name}")
-                    continue
-                
-                text_splitter = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=150)
-                docs = text_splitter.split_documents(pages)
-                
-                if not docs:
-                    print(f"⚠️ No se pudieron crear chunks: {pdf_name}")
-                    continue
-                
-                # Solo agregar chunks con contenido real
-                valid_chunks = 0
-                for doc in docs:
-                    if doc.page_content.strip():
-                        all_docs.append(doc.page_content)
-                        all_metadatas.append({
-                            "source": pdf_name,
-                            "page": doc.metadata.get("page", 0),
-                            "file_id": pdf_id
-                        })
-                        valid_chunks += 1
-                
-                if valid_chunks > 0:
-                    print(f"✅ {pdf_name}: {valid_chunks} chunks procesados")
-                    processed_files += 1
-                else:
-                    print(f"⚠️ {pdf_name}: sin contenido válido")
-                
-            except Exception as e:
-                print(f"❌ Error procesando {pdf_name}: {e}")
-            finally:
-                # Siempre limpiar el archivo temporal
-                if os.path.exists(local_pdf_path):
-                    os.remove(local_pdf_path)
-
-        # 4. Verificar que tenemos documentos para procesar
-        if not all_docs:
-            print("⚠️ No se procesaron documentos válidos, creando colección vacía")
-            IS_INITIALIZED = True
+        # 3. Detectar archivos ya indexados y procesar solo los nuevos. La misma
+        #    pasada completa el catálogo con los metadatos del índice (CATALOG_DB
+        #    puede ser efímero: solo los archivos nuevos pasan por on_document)
+        sink = VectorStoreSink(vector_store)
+        indexed = sink.scan_sources(fields=(*CATALOG_FIELDS, "file_id")) if collection_exists else {}
+        existing_files = {source for source, info in indexed.items() if info["complete"]}
+        if len(existing_files) < len(indexed):
+            print(f"🔁 {len(indexed) - len(existing_files)} archivos indexados a medias: se completan")
+        print(f"Archivos ya procesados: {len(existing_files)}")
+        added = catalog.backfill((source, info["metadata"], info["metadata"].get("file_id"))
+                                 for source, info in indexed.items())
+        if added:
+            print(f"📇 Catálogo completado desde el índice: {added} resoluciones")
+        new_files = {pdf['name'] for pdf in pdf_files} - existing_files
+        if not new_files:
+            print("✅ No hay archivos nuevos para procesar")
             return
         
-        print(f"📊 Resumen: {processed_files} archivos procesados, {len(all_docs)} chunks totales")
-
-        # 5. Generar embeddings
-        print("Generando embeddings...")
-        embeddings = get_embeddings_batch(all_docs)
+        print(f"🆕 Archivos nuevos detectados: {len(new_files)}")
+        for new_file in sorted(new_files):
+            print(f"  - {new_file}")
+
+        engine = IngestionEngine([sink], chunking=CHUNKING,
+                                 metadata_fn=extract_metadata, on_document=catalog.upsert)
+        report = engine.run(drive_documents(pdf_files, skip=existing_files), expected=len(new_files),
+                            known={sink: existing_files})
+        report.log()
+        record_failures(catalog, report.files_failed)
         
-        # 6. Insertar en Qdrant
-        points = []
-        for i, (doc, metadata, embedding) in enumerate(zip(all_docs, all_metadatas, embeddings)):
-            points.append(
-                PointStruct(
-                    id=str(uuid.uuid4()),
-                    vector=embedding,
-                    payload={"document": doc, "metadata": metadata}
-                )
-            )
-        
-        # Insertar en lotes
-        batch_size = 100
-        for i in range(0, len(points), batch_size):
-            batch = points[i:i + batch_size]
-            qdrant_client.upsert(collection_name=COLLECTION_NAME, points=batch)
-            print(f"Lote {i//batch_size + 1}/{(len(points) + batch_size - 1)//batch_size} insertado")
-        
-        IS_INITIALIZED = True
         print("✅ Sistema RAG inicializado exitosamente!")
         
     except Exception as e:
         print(f"❌ ERROR FATAL DURANTE LA INICIALIZACIÓN: {e}")
         raise e
 
+
+def _run_background_init() -> None:
+    global READINESS, INIT_ERROR
+    try:
+        initialize_rag_system()
+        READINESS, INIT_ERROR = "ready", None
+    except Exception as e:
+        # Se sigue respondiendo con lo que ya esté indexado
+        READINESS, INIT_ERROR = "degraded", str(e)
+        print(f"⚠️ Sistema RAG en modo degradado: {e}")
+
+
+def start_background_init(force: bool = False) -> str:
+    """
+    Lanza la sincronización con Drive en un hilo de fondo (una sola a la vez).
+    En estado degradado se reintenta tras INIT_RETRY_SECONDS, o de inmediato
+    con `force`. Devuelve el estado de preparación.
+    """
+    global READINESS, _INIT_THREAD, _INIT_STARTED
+    with _INIT_LOCK:
+        if _INIT_THREAD is not None and _INIT_THREAD.is_alive():
+            return READINESS
+        due = READINESS == "cold" or (READINESS == "degraded" and
+                                      (force or time.monotonic() - _INIT_STARTED >= INIT_RETRY_SECONDS))
+        if not due:
+            return READINESS
+        READINESS, _INIT_STARTED = "warming", time.monotonic()
+        _INIT_THREAD = threading.Thread(target=_run_background_init, name="rag-init", daemon=True)
+        _INIT_THREAD.start()
+        print("🔥 Sincronización del índice iniciada en segundo plano")
+        return READINESS
+
+
+def index_available() -> bool:
+    """True si la colección ya tiene puntos para responder (aunque siga sincronizando)."""
+    global _HAS_INDEX
+    if not _HAS_INDEX:
+        try:
+            _HAS_INDEX = vector_store.count() > 0
+        except Exception:
+            return False  # la colección todavía no existe
+    return _HAS_INDEX
+
+
+def _readiness_families():
+    states = ("cold", "warming", "ready", "degraded")
+    yield ("rag_readiness", "gauge", "Estado de la sincronización del índice (1 = estado actual)",
+           [({"state": s}, int(READINESS == s)) for s in states])
+    yield ("rag_index_available", "gauge", "1 si la colección ya tiene puntos", [({}, int(_HAS_INDEX))])
+
+
+metrics.REGISTRY.register_collector(_readiness_families)
+
+
+def readiness() -> Dict[str, Any]:
+    """Estado de preparación para la UI y los health checks."""
+    return {"state": READINESS, "index_available": index_available(), "error": INIT_ERROR}
+
 # ── Helpers ────────────────────────────────
 _norm = lambda s: " ".join((s or "").split())
 
@@ -396,6 +254,17 @@ def _sancion_tipo_simple(texto: str | None, tipo: str | None = None) -> str | No
         if patt.search(low): return etiqueta
     return None
 
+def _listing_tipo(q: str) -> str | None:
+    """
+    Tipo de sanción si `q` pide un listado ("dame las resoluciones con multa").
+    Si nombra una resolución, número interno, PA o persona no es un listado:
+    esas consultas van a la búsqueda, con las fichas del catálogo en el contexto.
+    """
+    if not LIST_RE.search(q) or extract_entities(q):
+        return None
+    m = LISTING_RE.search(q)
+    return _sancion_tipo_simple(m.group("tipo")) if m else None
+
 def _table(rows: List[Dict[str, Any]], headers: List[str]) -> str:
     if not rows: return "No se encontraron registros que cumplan con la condición solicitada."
     sep = "|".join(["---" for _ in headers])
@@ -403,6 +272,24 @@ def _table(rows: List[Dict[str, Any]], headers: List[str]) -> str:
     out += [" | ".join(str(r.get(h, "")) for h in headers) for r in rows]
     return "\n".join(out)
 
+CATALOG_HEADERS = ["resolucion", "interno", "pa", "tipo", "source"]
+
+def _catalog_rows(q: str) -> List[Dict[str, Any]]:
+    """Fichas del catálogo para los números de resolución / internos citados en la consulta."""
+    idents = RES_RE.findall(q) + INT_RE.findall(q.upper())
+    rows: Dict[str, Dict[str, Any]] = {}
+    try:
+        for ident in dict.fromkeys(idents):
+            for row in catalog.lookup(ident):
+                rows[row["source"]] = row
+    except Exception as e:
+        print(f"⚠️ Error consultando el catálogo: {e}")
+    return list(rows.values())
+
+def _ficha(row: Dict[str, Any]) -> str:
+    campos = [f"{h}: {row[h]}" for h in ("resolucion", "interno", "pa", "sancion", "tipo") if row.get(h)]
+    return f"Ficha de catálogo ({row['source']}): " + "; ".join(campos)
+
 # ── Prompt ───────────────────────────
 PROMPT_FICHA = (
     "Usted es **Lexi**, asistente virtual de la División Jurídica de la CGR (Costa Rica).\n"
@@ -418,16 +305,24 @@ build_prompt = lambda **kw: PROMPT_FICHA.format(
 )
 
 # ── Generación robusta ─────────────────────
+MSG_CUOTA = "⚠️ Hay mucha demanda en este momento. Inténtelo de nuevo en {seg} segundos."
+
+def _msg_cuota(retry_after: float | None = None) -> str:
+    return MSG_CUOTA.format(seg=max(1, round(retry_after or 30)))
+
 def safe_generate(prompt: str, retries: int = 2) -> str:
-    if not llm: return ""
+    if not API_KEY: return ""
     delay = 2.0
     for a in range(retries + 1):
         try:
-            resp = llm.generate_content(prompt, generation_config={"temperature":0.2, "max_output_tokens":1024})
+            resp = generate(services.llm(MODEL), prompt, generation_config={"temperature":0.2, "max_output_tokens":1024})
             txt = (getattr(resp, "text", "") or "").strip()
             if txt: return txt
+        except QuotaExceeded as e:
+            return _msg_cuota(e.retry_after)
         except ResourceExhausted:
-            if a >= retries: return "⚠️ Se alcanzó la cuota de Gemini. Inténtelo más tarde."
+            if a >= retries: return _msg_cuota()
+            continue  # la admisión ya registró la pausa que pidió la API
         except Exception:
             pass
         time.sleep(delay); delay = min(delay*1.8, 10.0)
@@ -439,60 +334,138 @@ MSG_INICIAL = (
     "**número de resolución** (p. ej. 07685-2025) o el **número interno** (p. ej. DJ-0612)."
 )
 MSG_DESPEDIDA = "¡Gracias por escribir! Si necesita otra consulta, aquí estaré. 👋"
+MSG_PREPARANDO = ("⏳ Estoy terminando de preparar la base de resoluciones. "
+                  "Por favor, intente de nuevo en unos minutos.")
+MSG_NO_INICIADO = "⚠️ Lo siento, el sistema no pudo iniciarse correctamente. Por favor, contacte al administrador."
+
+# ── Recuperación ───────────────────────
+class Retrieved(NamedTuple):
+    hits: List[Any]
+    context: PackedContext
+    timings: Dict[str, float]  # ms por etapa: embed, search, context
+
+
+def retrieve(query: str, k: int = 10, *, reuse_hits: Optional[List[Any]] = None,
+             searcher: Optional[Retriever] = None,
+             embed_fn: Optional[Callable[[str], List[float]]] = None,
+             token_budget: int = CONTEXT_TOKEN_BUDGET) -> Retrieved:
+    """
+    Etapa de recuperación de answer(): embedding de la consulta, búsqueda con
+    corte adaptativo (hasta `k` chunks) y contexto empaquetado. `searcher` y
+    `embed_fn` permiten evaluarla sobre otro índice (bench/eval_retrieval.py).
+    """
+    timings = {"embed": 0.0, "search": 0.0}
+    if reuse_hits is not None:
+        hits = reuse_hits
+    else:
+        t0 = time.perf_counter()
+        query_embedding = (embed_fn or get_query_embedding)(query)
+        t1 = time.perf_counter()
+        hits = (searcher or retriever).search(query_embedding, max_k=k).hits
+        timings.update(embed=(t1 - t0) * 1000, search=(time.perf_counter() - t1) * 1000)
+
+    # Contexto sin duplicados ni traslapes, dentro del presupuesto de tokens
+    t0 = time.perf_counter()
+    with span("chat.context", chunks=len(hits)) as s:
+        packed = build_context(hits, token_budget=token_budget)
+        s.set(blocks=packed.stats["blocks_out"], tokens=packed.tokens)
+    timings["context"] = (time.perf_counter() - t0) * 1000
+    print(f"🧩 Contexto: {packed.stats['chunks_in']} chunks → {packed.stats['blocks_out']} bloques, "
+          f"~{packed.tokens} tokens (fusionados {packed.stats['merged']}, duplicados "
+          f"{packed.stats['duplicates']}, fuera de presupuesto {packed.stats['over_budget']})")
+    return Retrieved(hits, packed, timings)
+
 
 # ── Router principal ───────────────────
-def answer(query: str, k: int = 10, debug: bool = False):
-    """Función principal que procesa la consulta del usuario."""
-    global IS_INITIALIZED
-    
-    if not IS_INITIALIZED:
-        try:
-            initialize_rag_system()
-        except Exception as e:
-            print(f"ERROR FATAL DURANTE LA INICIALIZACIÓN: {e}")
-            return "⚠️ Lo siento, el sistema no pudo iniciarse correctamente. Por favor, contacte al administrador.", []
+@traced("chat.answer")
+def answer(query: str, k: int = 10, debug: bool = False, session_id: Optional[str] = None):
+    """
+    Función principal que procesa la consulta del usuario.
+    Con `session_id`, las preguntas de seguimiento se resuelven con la
+    memoria de la conversación (ver conversation.py).
+    """
+    # La sincronización corre en segundo plano; nunca bloquea la consulta
+    state_now = start_background_init()
 
     q = (query or "").strip()
     t = q.lower()
 
     # Lógica de conversación
+    if GOODBYE_RE.search(t) or HELLO_RE.search(t) or COURTESY_RE.search(t):
+        QUERIES.inc(route="conversacion")
     if GOODBYE_RE.search(t): return MSG_DESPEDIDA, []
     if HELLO_RE.search(t): return MSG_INICIAL, []
     if COURTESY_RE.search(t): return "¡Con mucho gusto! ¿Desea consultar alguna resolución o expediente?", []
 
-    # Búsqueda en Qdrant
-    print(f"Consultando Qdrant: '{q}'")
-    
-    try:
-        query_embedding = get_query_embedding(q)
-        search_results = qdrant_client.search(
-            collection_name=COLLECTION_NAME,
-            query_vector=query_embedding,
-            limit=k,
-            with_payload=True
-        )
-        
-        docs = []
-        metas = []
-        for result in search_results:
-            docs.append(result.payload["document"])
-            metas.append(result.payload["metadata"])
+    # Listados por tipo de sanción: se responden desde el catálogo
+    # (sin filas, p. ej. catálogo aún sin completar, sigue a la búsqueda)
+    if tipo := _listing_tipo(q):
+        try:
+            rows = [{k: v or "" for k, v in r.items()} for r in catalog.find(tipo=tipo, limit=-1)]
+            if rows:
+                QUERIES.inc(route="catalogo")
+                shown = rows[:CATALOG_LIST_LIMIT]
+                table = _table(shown, CATALOG_HEADERS)
+                if len(rows) > len(shown):
+                    table += (f"\n\nSe muestran las primeras {len(shown)} de {len(rows)} resoluciones con "
+                              f"sanción de tipo «{tipo}». Indique un número de resolución o expediente para "
+                              "consultar una en particular.")
+                return table, rows
+        except Exception as e:
+            print(f"⚠️ Error consultando el catálogo: {e}")
+
+    # Sin índice todavía (primer arranque): no hay con qué responder
+    if not index_available():
+        QUERIES.inc(route="sin_indice")
+        if state_now == "degraded":
+            return MSG_NO_INICIADO, []
+        return MSG_PREPARANDO, []
+
+    # Seguimientos: consulta independiente con las entidades activas de la sesión
+    state = _CONVERSATIONS.get(session_id) if session_id else None
+    plan = state.plan(q) if state else QueryPlan(q)
+    if plan.follow_up:
+        print(f"💬 Seguimiento reescrito: '{plan.query}'")
+        CACHE.inc(cache="conversacion", result="hit" if plan.reuse_hits is not None else "miss")
+    fichas = _catalog_rows(plan.query)
 
-        if not docs:
+    try:
+        if plan.reuse_hits is not None:
+            # Mismo asunto que el turno anterior: se reutiliza su contexto
+            print("♻️ Seguimiento: reutilizo el contexto del turno anterior")
+            QUERIES.inc(route="reutilizado")
+        else:
+            # Búsqueda vectorial
+            print(f"Consultando {VECTOR_BACKEND}: '{plan.query}'")
+            QUERIES.inc(route="busqueda")
+        found = retrieve(plan.query, k, reuse_hits=plan.reuse_hits)
+        search_results, packed = found.hits, found.context
+        metas = packed.metadatas
+
+        if not packed.blocks and not fichas:
             return "No se encontró información relevante en los documentos para su consulta.", []
 
-        context = "\n\n---\n\n".join(docs)
-        prompt = build_prompt(context=context, query=q)
+        context = SEPARATOR.join([_ficha(r) for r in fichas] + ([packed.text] if packed.text else []))
+        prompt = build_prompt(context=context, query=plan.query)
         final_response = safe_generate(prompt)
         
         if not final_response:
             final_response = "No pude generar una respuesta a partir de la información encontrada."
+        elif state:
+            state.record(q, plan, search_results, final_response)
 
         return final_response, metas
         
+    except QuotaExceeded as e:
+        QUERIES.inc(route="cuota")
+        return _msg_cuota(e.retry_after), []
+    except ResourceExhausted:
+        QUERIES.inc(route="cuota")
+        return _msg_cuota(), []
     except Exception as e:
+        QUERIES.inc(route="error")
         print(f"Error durante la búsqueda: {e}")
         return "⚠️ Ocurrió un error durante la búsqueda. Por favor, intente de nuevo.", []
 
 # Export para app.py
-__all__ = ["answer", "GOODBYE_RE"]
+__all__ = ["answer", "retrieve", "GOODBYE_RE"]
@@ -0,0 +1,266 @@
+# rate_control.py
+# Control de ritmo para llamadas a Gemini.
+# AdaptiveRateController: AIMD (aumento aditivo / reducción multiplicativa)
+# guiado por las señales de cuota que devuelve la API, sin esperas fijas.
+# AdmissionController: token buckets RPM/TPM compartidos por el proceso, con
+# prioridad para las llamadas interactivas sobre la ingestión.
+from __future__ import annotations
+import os
+import re
+import threading
+import time
+from typing import Callable, Optional, TypeVar
+
+from google.api_core.exceptions import ResourceExhausted
+
+T = TypeVar("T")
+
+_RETRY_PATTERNS = (
+    re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)", re.I),
+    re.compile(r"retry in\s*([\d.]+)\s*s", re.I),
+)
+
+
+def retry_after_from(exc: BaseException) -> Optional[float]:
+    """Segundos sugeridos por la API para reintentar (RetryInfo), si vienen en el error."""
+    text = str(exc)
+    for patt in _RETRY_PATTERNS:
+        if m := patt.search(text):
+            return float(m.group(1))
+    return None
+
+
+class AdaptiveRateController:
+    """
+    Regula llamadas por segundo y tamaño de lote.
+
+    Cada éxito sube el ritmo en `increase` llamadas/s y, tras
+    `grow_after` éxitos seguidos, duplica el lote. Cada señal de cuota
+    divide ritmo y lote por `1/decrease` y abre una pausa igual al
+    `retry_delay` de la API o, si no viene, al intervalo actual.
+    """
+
+    def __init__(self, rate: float = 2.0, min_rate: float = 0.05, max_rate: float = 20.0,
+                 increase: float = 0.25, decrease: float = 0.5,
+                 batch_size: int = 100, min_batch: int = 1, max_batch: int = 100,
+                 grow_after: int = 5):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self._batch = float(batch_size)
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.grow_after = grow_after
+        self._streak = 0
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def batch_size(self) -> int:
+        return max(self.min_batch, min(self.max_batch, int(self._batch)))
+
+    def acquire(self) -> None:
+        """Bloquea hasta el siguiente turno permitido por el ritmo actual."""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_at)
+            self._next_at = start + 1.0 / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+            self._streak += 1
+            if self._streak >= self.grow_after:
+                self._batch = min(self.max_batch, self._batch * 2)
+                self._streak = 0
+
+    def on_quota(self, retry_after: Optional[float] = None) -> float:
+        """Registra una señal de cuota y devuelve la pausa aplicada (s)."""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._batch = max(self.min_batch, self._batch * self.decrease)
+            self._streak = 0
+            pause = retry_after if retry_after is not None else 1.0 / self.rate
+            self._next_at = max(self._next_at, time.monotonic() + pause)
+            return pause
+
+    def call(self, fn: Callable[[], T], max_retries: int = 5, label: str = "") -> T:
+        """Ejecuta `fn` respetando el ritmo; reintenta solo ante ResourceExhausted."""
+        retries = 0
+        while True:
+            self.acquire()
+            try:
+                result = fn()
+            except ResourceExhausted as e:
+                if retries >= max_retries:
+                    raise
+                retries += 1
+                pause = self.on_quota(retry_after_from(e))
+                print(f"⏳ Cuota agotada{f' ({label})' if label else ''}; "
+                      f"ritmo {self.rate:.2f}/s, lote {self.batch_size}, "
+                      f"reintento {retries}/{max_retries} en {pause:.1f}s")
+                continue
+            self.on_success()
+            return result
+
+
+# ── Admisión por cuota (RPM / TPM) ───────────────
+# Un controlador por tipo de llamada ("generate", "embed") compartido por todo
+# el proceso. Cada llamada reserva 1..n solicitudes y un estimado de tokens en
+# dos token buckets (por minuto) antes de salir a la API; si la espera para
+# obtenerlos supera el máximo de su prioridad, se rechaza localmente
+# (QuotaExceeded) en vez de dejar que la API responda ResourceExhausted.
+PRIORITY_INTERACTIVE = 0   # chat y análisis pedidos por un usuario
+PRIORITY_BACKGROUND = 1    # ingestión
+
+_DEFAULT_MAX_WAIT = {PRIORITY_INTERACTIVE: 15.0, PRIORITY_BACKGROUND: 600.0}
+
+
+class QuotaExceeded(Exception):
+    """La llamada no se admitió: la cuota local no alcanzaría a tiempo."""
+
+    def __init__(self, kind: str, retry_after: float):
+        super().__init__(f"Cuota de {kind} agotada; reintentar en {retry_after:.1f}s")
+        self.kind = kind
+        self.retry_after = retry_after
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimado barato (~4 caracteres por token en español)."""
+    return max(1, len(text) // 4)
+
+
+class TokenBucket:
+    """Capacidad `capacity` por minuto, recargada de forma continua."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.refill = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float, keep: float = 0.0) -> float:
+        """Segundos hasta tener `amount` dejando `keep` sin tocar."""
+        self._refill(now)
+        amount = min(amount, self.capacity - keep)
+        missing = amount + keep - self.tokens
+        return max(0.0, missing / self.refill)
+
+    def take(self, amount: float) -> None:
+        self.tokens -= amount
+
+    def drain(self, now: float, pause: float) -> None:
+        """Tras un rechazo de la API: vacío y sin recarga durante `pause` s."""
+        self.tokens = 0.0
+        self.updated = now + pause
+
+
+class AdmissionController:
+    """
+    Token buckets de solicitudes y tokens por minuto con dos prioridades.
+
+    Las llamadas de fondo solo usan la cuota que excede `reserve` (fracción
+    de cada bucket) y ceden el turno mientras haya llamadas interactivas
+    esperando, así la ingestión nunca deja al chat sin cuota.
+    """
+
+    def __init__(self, kind: str, rpm: float, tpm: float, reserve: float = 0.25,
+                 max_wait: Optional[dict] = None):
+        self.kind = kind
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.reserve = reserve
+        self.max_wait = {**_DEFAULT_MAX_WAIT, **(max_wait or {})}
+        self._interactive_waiting = 0
+        self._cond = threading.Condition()
+        self.admitted = {PRIORITY_INTERACTIVE: 0, PRIORITY_BACKGROUND: 0}
+        self.shed = {PRIORITY_INTERACTIVE: 0, PRIORITY_BACKGROUND: 0}
+
+    def _wait_for(self, requests: int, tokens: int, priority: int, now: float) -> float:
+        background = priority == PRIORITY_BACKGROUND
+        return max(
+            self.requests.wait_time(requests, now, self.requests.capacity * self.reserve if background else 0.0),
+            self.tokens.wait_time(tokens, now, self.tokens.capacity * self.reserve if background else 0.0),
+        )
+
+    def acquire(self, tokens: int, requests: int = 1, priority: int = PRIORITY_INTERACTIVE,
+                max_wait: Optional[float] = None) -> int:
+        """Bloquea hasta admitir la llamada; devuelve los tokens reservados."""
+        limit = self.max_wait[priority] if max_wait is None else max_wait
+        deadline = time.monotonic() + limit
+        with self._cond:
+            if priority == PRIORITY_INTERACTIVE:
+                self._interactive_waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_for(requests, tokens, priority, now)
+                    if priority == PRIORITY_BACKGROUND and self._interactive_waiting:
+                        wait = max(wait, 0.05)
+                    if wait <= 0:
+                        self.requests.take(requests)
+                        self.tokens.take(tokens)
+                        self.admitted[priority] += 1
+                        return tokens
+                    if now + wait > deadline:
+                        self.shed[priority] += 1
+                        raise QuotaExceeded(self.kind, wait)
+                    self._cond.wait(min(wait, deadline - now))
+            finally:
+                if priority == PRIORITY_INTERACTIVE:
+                    self._interactive_waiting -= 1
+                    self._cond.notify_all()
+
+    def settle(self, reserved: int, actual: int) -> None:
+        """Corrige el estimado de tokens con el uso real que informa la API."""
+        with self._cond:
+            self.tokens.take(actual - reserved)
+            self._cond.notify_all()
+
+    def on_quota(self, retry_after: Optional[float] = None) -> None:
+        """La API rechazó igual: se vacían los buckets por `retry_after` s."""
+        with self._cond:
+            now = time.monotonic()
+            pause = retry_after if retry_after is not None else 60.0 / self.requests.capacity
+            self.requests.drain(now, pause)
+            self.tokens.drain(now, pause)
+
+    def stats(self) -> dict:
+        with self._cond:
+            now = time.monotonic()
+            self.requests._refill(now)
+            self.tokens._refill(now)
+            return {"kind": self.kind, "requests_available": max(0.0, self.requests.tokens),
+                    "tokens_available": max(0.0, self.tokens.tokens),
+                    "admitted": dict(self.admitted), "shed": dict(self.shed)}
+
+
+# Cuotas por minuto (valores del nivel gratuito; ajustar con variables de entorno)
+_QUOTAS = {
+    "generate": ("GEMINI_GENERATE_RPM", 15, "GEMINI_GENERATE_TPM", 1_000_000),
+    "embed": ("GEMINI_EMBED_RPM", 1500, "GEMINI_EMBED_TPM", 1_000_000),
+}
+_admission: dict = {}
+_admission_lock = threading.Lock()
+
+
+def get_admission(kind: str) -> AdmissionController:
+    """Controlador de admisión compartido por el proceso para `kind`."""
+    with _admission_lock:
+        if kind not in _admission:
+            rpm_var, rpm, tpm_var, tpm = _QUOTAS[kind]
+            _admission[kind] = AdmissionController(
+                kind,
+                rpm=float(os.getenv(rpm_var, rpm)),
+                tpm=float(os.getenv(tpm_var, tpm)),
+                reserve=float(os.getenv("GEMINI_INTERACTIVE_RESERVE", 0.25)),
+            )
+        return _admission[kind]
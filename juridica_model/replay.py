@@ -0,0 +1,262 @@
+# replay.py
+# Grabación y reproducción de las llamadas a Gemini (embed_content y
+# generate_content) para pruebas de carga deterministas sin gastar cuota.
+#   GEMINI_REPLAY=record  responde desde el cassette y solo llama a la API
+#                         (y graba la respuesta) si la petición no está grabada
+#   GEMINI_REPLAY=replay  nunca llama a la API ni necesita GEMINI_API_KEY
+#   GEMINI_CASSETTE       archivo JSONL con las respuestas (gemini_cassette.jsonl)
+# Al reproducir se simula la latencia grabada (× REPLAY_LATENCY_SCALE) o una
+# fija (REPLAY_EMBED_LATENCY_MS / REPLAY_GENERATE_LATENCY_MS), con ±REPLAY_JITTER,
+# y una fracción REPLAY_ERROR_RATE de llamadas falla con ResourceExhausted
+# (429, "retry in REPLAY_RETRY_DELAY s"), igual que la API sin cuota.
+# Los embeddings se graban por texto: un lote se reproduce aunque se arme distinto.
+# Peticiones no grabadas: vector/texto sintético determinista, o error con
+# REPLAY_ON_MISS=error.
+from __future__ import annotations
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from google.api_core.exceptions import ResourceExhausted
+
+MODE = (os.getenv("GEMINI_REPLAY") or "off").strip().lower()  # off | record | replay
+CASSETTE = os.getenv("GEMINI_CASSETTE", "gemini_cassette.jsonl")
+LATENCY_SCALE = float(os.getenv("REPLAY_LATENCY_SCALE", 1.0))
+FIXED_LATENCY_MS = {
+    "embed": os.getenv("REPLAY_EMBED_LATENCY_MS"),
+    "generate": os.getenv("REPLAY_GENERATE_LATENCY_MS"),
+}
+# Latencia para peticiones sin grabación (y sin latencia fija)
+MISS_LATENCY_MS = {"embed": 80.0, "generate": 1500.0}
+JITTER = float(os.getenv("REPLAY_JITTER", 0.2))
+ERROR_RATE = float(os.getenv("REPLAY_ERROR_RATE", 0.0))
+RETRY_DELAY = float(os.getenv("REPLAY_RETRY_DELAY", 5))
+ON_MISS = (os.getenv("REPLAY_ON_MISS") or "synthetic").strip().lower()  # synthetic | error
+SEED = os.getenv("REPLAY_SEED")
+EMBEDDING_DIM = 768
+
+MISS_TEXT = "[replay] Sin respuesta grabada para este prompt."
+
+
+def request_key(kind: str, **request: Any) -> str:
+    """Clave estable de una petición (mismo modelo y contenido → misma clave)."""
+    raw = json.dumps({"kind": kind, **request}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ReplayStats:
+    def __init__(self):
+        self._counts: Dict[tuple, int] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, kind: str, result: str, n: int = 1) -> None:
+        with self._lock:
+            self._counts[(kind, result)] = self._counts.get((kind, result), 0) + n
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        """{kind: {hit|miss|recorded|injected_error: n}}"""
+        out: Dict[str, Dict[str, int]] = {}
+        with self._lock:
+            for (kind, result), n in self._counts.items():
+                out.setdefault(kind, {})[result] = n
+        return out
+
+
+STATS = ReplayStats()
+
+
+# ── Cassette ─────────────────────────────────────
+class Cassette:
+    """Respuestas grabadas en JSONL: {"key", "kind", "model", "response", "latency_ms"} por línea."""
+
+    def __init__(self, path: str = CASSETTE):
+        self.path = path
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries[entry["key"]] = entry
+        print(f"📼 Cassette de Gemini ({MODE}): {len(self._entries)} respuestas en {path}")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self._entries.get(key)
+
+    def put(self, entries: List[Dict[str, Any]]) -> None:
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            for entry in entries:
+                self._entries[entry["key"]] = entry
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+# ── Simulación ───────────────────────────────────
+class _Simulator:
+    def __init__(self):
+        self._rng = random.Random(SEED)
+        self._lock = threading.Lock()
+
+    def _uniform(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def latency_ms(self, kind: str, recorded: Optional[float]) -> float:
+        fixed = FIXED_LATENCY_MS.get(kind)
+        if fixed:
+            base = float(fixed)
+        elif recorded is not None:
+            base = recorded * LATENCY_SCALE
+        else:
+            base = MISS_LATENCY_MS[kind] * LATENCY_SCALE
+        return max(0.0, base * (1 + JITTER * (2 * self._uniform() - 1)))
+
+    def maybe_fail(self, kind: str) -> None:
+        if ERROR_RATE and self._uniform() < ERROR_RATE:
+            STATS.inc(kind, "injected_error")
+            raise ResourceExhausted(f"Quota exceeded (replay simulado). Please retry in {RETRY_DELAY:g}s.")
+
+
+_simulator = _Simulator()
+
+
+def _synthetic_embedding(key: str) -> List[float]:
+    rng = random.Random(key)
+    vec = [rng.gauss(0.0, 1.0) for _ in range(EMBEDDING_DIM)]
+    norm = sum(v * v for v in vec) ** 0.5 or 1.0
+    return [v / norm for v in vec]
+
+
+def _miss(kind: str, key: str) -> None:
+    STATS.inc(kind, "miss")
+    if ON_MISS == "error":
+        raise KeyError(f"Petición de {kind} sin grabar en {CASSETTE} ({key[:12]})")
+
+
+# ── SDK de reemplazo ─────────────────────────────
+class ReplayModel:
+    """GenerativeModel con generate_content grabado/reproducido."""
+
+    def __init__(self, sdk: "ReplaySDK", model_name: str):
+        self._sdk = sdk
+        self.model_name = model_name
+        self._real = sdk.real.GenerativeModel(model_name) if sdk.real is not None else None
+
+    def generate_content(self, contents, generation_config=None, request_options=None, **kwargs):
+        key = request_key("generate", model=self.model_name, contents=contents,
+                          generation_config=generation_config)
+        entry = self._sdk.cassette.get(key)
+        if entry is None and self._real is not None:
+            t0 = time.perf_counter()
+            response = self._real.generate_content(contents, generation_config=generation_config,
+                                                   request_options=request_options, **kwargs)
+            latency = (time.perf_counter() - t0) * 1000
+            self._sdk.cassette.put([{"key": key, "kind": "generate", "model": self.model_name,
+                                     "response": _serialize_generation(response),
+                                     "latency_ms": round(latency, 1)}])
+            STATS.inc("generate", "recorded")
+            return response
+
+        _simulator.maybe_fail("generate")
+        if entry is None:
+            _miss("generate", key)
+            data, recorded = {"text": MISS_TEXT, "usage": None}, None
+        else:
+            STATS.inc("generate", "hit")
+            data, recorded = entry["response"], entry.get("latency_ms")
+        time.sleep(_simulator.latency_ms("generate", recorded) / 1000)
+        return _deserialize_generation(data)
+
+
+class ReplaySDK:
+    """
+    Reemplazo de google.generativeai para gemini_utils.configure(): mismas
+    llamadas (embed_content, GenerativeModel). Con `real` (modo record) las
+    peticiones no grabadas van a la API y se agregan al cassette.
+    """
+
+    def __init__(self, cassette: Cassette, real: Any = None):
+        self.cassette = cassette
+        self.real = real
+
+    def configure(self, **kwargs) -> None:
+        if self.real is not None:
+            self.real.configure(**kwargs)
+
+    def GenerativeModel(self, model_name: str, **kwargs) -> ReplayModel:  # noqa: N802 (API del SDK)
+        return ReplayModel(self, model_name)
+
+    def embed_content(self, model, content, task_type=None, request_options=None, **kwargs):
+        texts = content if isinstance(content, list) else [content]
+        keys = [request_key("embed", model=model, task_type=task_type, text=t) for t in texts]
+        entries = [self.cassette.get(k) for k in keys]
+        missing = [i for i, e in enumerate(entries) if e is None]
+
+        if missing and self.real is not None:
+            t0 = time.perf_counter()
+            result = self.real.embed_content(model=model, content=[texts[i] for i in missing],
+                                             task_type=task_type, request_options=request_options, **kwargs)
+            latency = round((time.perf_counter() - t0) * 1000, 1)
+            new = [{"key": keys[i], "kind": "embed", "model": model, "response": vector, "latency_ms": latency}
+                   for i, vector in zip(missing, result["embedding"])]
+            self.cassette.put(new)
+            STATS.inc("embed", "recorded", len(new))
+            for i, entry in zip(missing, new):
+                entries[i] = entry
+            vectors = [e["response"] for e in entries]
+            return {"embedding": vectors if isinstance(content, list) else vectors[0]}
+
+        _simulator.maybe_fail("embed")
+        vectors, recorded = [], []
+        for key, entry in zip(keys, entries):
+            if entry is None:
+                _miss("embed", key)
+                vectors.append(_synthetic_embedding(key))
+            else:
+                STATS.inc("embed", "hit")
+                vectors.append(entry["response"])
+                if entry.get("latency_ms") is not None:
+                    recorded.append(entry["latency_ms"])
+        # un lote reproducido tarda como la llamada grabada más lenta de sus textos
+        time.sleep(_simulator.latency_ms("embed", max(recorded) if recorded else None) / 1000)
+        return {"embedding": vectors if isinstance(content, list) else vectors[0]}
+
+
+def _serialize_generation(response: Any) -> Dict[str, Any]:
+    try:
+        text = response.text
+    except Exception:
+        text = ""  # respuesta bloqueada o sin candidatos
+    usage = getattr(response, "usage_metadata", None)
+    return {
+        "text": text,
+        "usage": {
+            "prompt_token_count": getattr(usage, "prompt_token_count", 0),
+            "candidates_token_count": getattr(usage, "candidates_token_count", 0),
+            "total_token_count": getattr(usage, "total_token_count", 0),
+        } if usage is not None else None,
+    }
+
+
+def _deserialize_generation(data: Dict[str, Any]) -> Any:
+    usage = SimpleNamespace(**data["usage"]) if data.get("usage") else None
+    return SimpleNamespace(text=data["text"], usage_metadata=usage)
+
+
+def enabled() -> bool:
+    return MODE in ("record", "replay")
+
+
+def sdk(real: Any = None) -> ReplaySDK:
+    """SDK de reemplazo según GEMINI_REPLAY (`real` es google.generativeai en modo record)."""
+    if MODE not in ("record", "replay"):
+        raise ValueError(f"❌ GEMINI_REPLAY no soportado: {MODE}")
+    return ReplaySDK(Cassette(CASSETTE), real=real if MODE == "record" else None)
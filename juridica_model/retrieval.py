@@ -0,0 +1,189 @@
+# retrieval.py
+# Recuperación con corte adaptativo sobre los scores de similitud.
+# En vez de pasar siempre k resultados fijos al LLM (y, en el analizador,
+# una llamada de Gemini por cada uno), se piden `fetch_k` candidatos y se
+# cortan por:
+#   - umbral absoluto de score (min_score)
+#   - salto ("codo") en la curva de scores: el mayor descenso entre dos
+#     resultados consecutivos, si destaca sobre el descenso promedio
+#   - límites min_k / max_k
+# Varias sub-consultas (argumentos, reformulaciones) se resuelven en un solo
+# request al almacén (search_batch) y, si se piden fusionadas, se combinan
+# con reciprocal-rank fusion.
+from __future__ import annotations
+import os
+import threading
+from dataclasses import dataclass, replace
+from typing import Dict, List, Optional, Sequence
+
+from tracing import span
+from vector_store import PayloadSelector, SearchHit, VectorStore
+
+
+@dataclass(frozen=True)
+class CutoffConfig:
+    fetch_k: int = 20
+    min_k: int = 3
+    max_k: int = 10
+    min_score: Optional[float] = None   # None = sin umbral absoluto
+    gap_factor: float = 2.0             # el salto debe ser >= gap_factor × descenso promedio
+    min_gap: float = 0.02               # y al menos esta diferencia de score
+
+    @classmethod
+    def from_env(cls, default: "CutoffConfig") -> "CutoffConfig":
+        """RETRIEVAL_FETCH_K / _MIN_K / _MAX_K / _MIN_SCORE / _GAP_FACTOR / _MIN_GAP."""
+        min_score = os.getenv("RETRIEVAL_MIN_SCORE")
+        return cls(
+            fetch_k=int(os.getenv("RETRIEVAL_FETCH_K", default.fetch_k)),
+            min_k=int(os.getenv("RETRIEVAL_MIN_K", default.min_k)),
+            max_k=int(os.getenv("RETRIEVAL_MAX_K", default.max_k)),
+            min_score=float(min_score) if min_score else default.min_score,
+            gap_factor=float(os.getenv("RETRIEVAL_GAP_FACTOR", default.gap_factor)),
+            min_gap=float(os.getenv("RETRIEVAL_MIN_GAP", default.min_gap)),
+        )
+
+
+@dataclass
+class CutoffResult:
+    hits: List[SearchHit]
+    fetched: int
+    by_score: int = 0     # descartados por el umbral absoluto
+    by_gap: int = 0       # descartados por el salto de scores
+    by_max_k: int = 0     # descartados por max_k
+
+    def describe(self) -> str:
+        return (f"{self.fetched} candidatos → {len(self.hits)} "
+                f"(umbral {self.by_score}, salto {self.by_gap}, máx. {self.by_max_k})")
+
+
+def _gap_cut(scores: Sequence[float], min_k: int, gap_factor: float, min_gap: float) -> int:
+    """Cantidad a conservar según el mayor salto de score (a partir de min_k)."""
+    if len(scores) <= max(1, min_k):
+        return len(scores)
+    drops = [scores[i] - scores[i + 1] for i in range(len(scores) - 1)]
+    mean_drop = (scores[0] - scores[-1]) / len(drops)
+    start = max(0, min_k - 1)
+    i = max(range(start, len(drops)), key=drops.__getitem__)
+    if drops[i] >= min_gap and drops[i] >= gap_factor * mean_drop:
+        return i + 1
+    return len(scores)
+
+
+def apply_cutoff(hits: Sequence[SearchHit], config: CutoffConfig) -> CutoffResult:
+    """Aplica umbral, salto y límites a resultados ordenados (o no) por score."""
+    ranked = sorted(hits, key=lambda h: h.score, reverse=True)
+    result = CutoffResult(hits=[], fetched=len(ranked))
+    n = len(ranked)
+
+    if config.min_score is not None:
+        above = sum(1 for h in ranked if h.score >= config.min_score)
+        keep = max(above, min(config.min_k, n))
+        result.by_score = n - keep
+        n = keep
+
+    keep = _gap_cut([h.score for h in ranked[:n]], config.min_k, config.gap_factor, config.min_gap)
+    result.by_gap = n - keep
+    n = keep
+
+    if n > config.max_k:
+        result.by_max_k = n - config.max_k
+        n = config.max_k
+
+    result.hits = ranked[:n]
+    return result
+
+
+RRF_K = 60
+
+
+def rrf_fuse(result_lists: Sequence[Sequence[SearchHit]], k: int = RRF_K) -> List[SearchHit]:
+    """
+    Reciprocal-rank fusion: score = Σ 1/(k + rank) sobre las listas donde
+    aparece cada id. El payload se toma de la primera aparición.
+    """
+    fused: Dict[object, float] = {}
+    first: Dict[object, SearchHit] = {}
+    for hits in result_lists:
+        for rank, hit in enumerate(hits, start=1):
+            fused[hit.id] = fused.get(hit.id, 0.0) + 1.0 / (k + rank)
+            first.setdefault(hit.id, hit)
+    ranked = sorted(fused.items(), key=lambda kv: kv[1], reverse=True)
+    return [SearchHit(i, score, first[i].payload) for i, score in ranked]
+
+
+class RetrievalStats:
+    """Totales de corte por proceso (para logs y métricas)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals: Dict[str, int] = {"queries": 0, "fetched": 0, "kept": 0,
+                                       "by_score": 0, "by_gap": 0, "by_max_k": 0}
+
+    def record(self, result: CutoffResult) -> None:
+        with self._lock:
+            self.totals["queries"] += 1
+            self.totals["fetched"] += result.fetched
+            self.totals["kept"] += len(result.hits)
+            self.totals["by_score"] += result.by_score
+            self.totals["by_gap"] += result.by_gap
+            self.totals["by_max_k"] += result.by_max_k
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.totals)
+
+
+STATS = RetrievalStats()
+
+
+class Retriever:
+    """
+    Búsqueda en un VectorStore con corte adaptativo.
+    `payload_fields` limita el payload devuelto a los campos que usa quien llama.
+    """
+
+    def __init__(self, store: VectorStore, config: Optional[CutoffConfig] = None, label: str = "búsqueda",
+                 payload_fields: PayloadSelector = True):
+        self.store = store
+        self.config = config or CutoffConfig()
+        self.label = label
+        self.payload_fields = payload_fields
+
+    def _config(self, max_k: Optional[int]) -> CutoffConfig:
+        return self.config if max_k is None else replace(self.config, max_k=max_k)
+
+    def search(self, vector: List[float], max_k: Optional[int] = None) -> CutoffResult:
+        config = self._config(max_k)
+        with span("retrieval.search", label=self.label, queries=1) as s:
+            hits = self.store.search(vector, limit=max(config.fetch_k, config.max_k),
+                                     with_payload=self.payload_fields)
+            result = apply_cutoff(hits, config)
+            s.set(fetched=result.fetched, kept=len(result.hits))
+        STATS.record(result)
+        print(f"🎯 {self.label}: {result.describe()}")
+        return result
+
+    def search_many(self, vectors: Sequence[List[float]], max_k: Optional[int] = None) -> List[CutoffResult]:
+        """Una lista cortada por consulta, con un solo request al almacén."""
+        config = self._config(max_k)
+        with span("retrieval.search", label=self.label, queries=len(vectors)) as s:
+            batches = self.store.search_batch(vectors, limit=max(config.fetch_k, config.max_k),
+                                              with_payload=self.payload_fields)
+            results = [apply_cutoff(hits, config) for hits in batches]
+            s.set(fetched=sum(r.fetched for r in results), kept=sum(len(r.hits) for r in results))
+        for n, result in enumerate(results, start=1):
+            STATS.record(result)
+            print(f"🎯 {self.label} [{n}/{len(results)}]: {result.describe()}")
+        return results
+
+    def search_fused(self, vectors: Sequence[List[float]], max_k: Optional[int] = None) -> CutoffResult:
+        """Sub-consultas en un request, cortadas por separado y fusionadas con RRF."""
+        if len(vectors) == 1:
+            return self.search(vectors[0], max_k=max_k)
+        results = self.search_many(vectors, max_k=max_k)
+        limit = self._config(max_k).max_k
+        fused = rrf_fuse([r.hits for r in results])
+        return CutoffResult(hits=fused[:limit], fetched=sum(r.fetched for r in results),
+                            by_score=sum(r.by_score for r in results),
+                            by_gap=sum(r.by_gap for r in results),
+                            by_max_k=max(0, len(fused) - limit))
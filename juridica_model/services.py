@@ -0,0 +1,111 @@
+# services.py
+# Registro de clientes compartidos por el chat, el analizador y la ingestión,
+# creados a demanda (importar app.py no carga los SDK ni abre conexiones):
+#   - Qdrant: un cliente por proceso y URL, con pool de conexiones keep-alive
+#     (HTTP) o canal gRPC si QDRANT_PREFER_GRPC=1, y timeout configurado
+#   - Gemini: la API key se configura una vez y cada modelo se crea una vez
+#   - Drive: credenciales una vez por proceso; el servicio se construye una
+#     vez por hilo (httplib2 no es seguro entre hilos), con timeout
+from __future__ import annotations
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from gemini_utils import configure
+from vector_store import LazyVectorStore, VectorStore, get_vector_store
+
+DEFAULT_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+
+QDRANT_PREFER_GRPC = (os.getenv("QDRANT_PREFER_GRPC") or "").strip().lower() in ("1", "true", "yes")
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", 6334))
+QDRANT_TIMEOUT = int(os.getenv("QDRANT_TIMEOUT", 30))
+QDRANT_POOL_SIZE = int(os.getenv("QDRANT_POOL_SIZE", 10))
+
+DRIVE_SCOPES = ["https://www.googleapis.com/auth/drive.readonly"]
+DRIVE_TIMEOUT = float(os.getenv("DRIVE_TIMEOUT", 60))
+
+_lock = threading.Lock()
+_qdrant_clients: Dict[Tuple[str, Optional[str]], Any] = {}
+_stores: Dict[Tuple[str, Optional[str]], LazyVectorStore] = {}
+_models: Dict[str, Any] = {}
+_drive_credentials = None
+_drive_local = threading.local()
+
+
+# ── Qdrant ───────────────────────────────────────
+def qdrant_client(url: str, api_key: Optional[str] = None):
+    """Cliente de Qdrant compartido para `url` (thread-safe, con pool de conexiones)."""
+    with _lock:
+        client = _qdrant_clients.get((url, api_key))
+        if client is None:
+            from qdrant_client import QdrantClient
+            client = QdrantClient(
+                url=url,
+                api_key=api_key,
+                prefer_grpc=QDRANT_PREFER_GRPC,
+                grpc_port=QDRANT_GRPC_PORT,
+                timeout=QDRANT_TIMEOUT,
+                pool_size=QDRANT_POOL_SIZE,
+            )
+            _qdrant_clients[(url, api_key)] = client
+            print(f"🔌 Cliente Qdrant creado ({'gRPC' if QDRANT_PREFER_GRPC else 'HTTP'}, "
+                  f"timeout {QDRANT_TIMEOUT}s, pool {QDRANT_POOL_SIZE})")
+        return client
+
+
+def shared_vector_store(collection_name: str = "resoluciones", *,
+                        qdrant_url: Optional[str] = None,
+                        qdrant_api_key: Optional[str] = None) -> VectorStore:
+    """Almacén de `collection_name` compartido por el proceso (cliente diferido)."""
+    url = qdrant_url or os.getenv("QDRANT_URL")
+    key = (collection_name, url)
+    with _lock:
+        store = _stores.get(key)
+        if store is None:
+            store = LazyVectorStore(
+                lambda: get_vector_store(collection_name, qdrant_url=url, qdrant_api_key=qdrant_api_key,
+                                         client_factory=qdrant_client),
+                collection_name,
+            )
+            _stores[key] = store
+        return store
+
+
+# ── Gemini ───────────────────────────────────────
+def llm(model: str = DEFAULT_MODEL):
+    """GenerativeModel de Gemini compartido; importa el SDK en la primera llamada."""
+    with _lock:
+        if model not in _models:
+            _models[model] = configure().GenerativeModel(model)
+        return _models[model]
+
+
+# ── Drive ────────────────────────────────────────
+def drive():
+    """Servicio de Drive v3 del hilo actual (credenciales de la cuenta de servicio)."""
+    global _drive_credentials
+    service = getattr(_drive_local, "service", None)
+    if service is not None:
+        return service
+    import google.auth
+    import httplib2
+    from google_auth_httplib2 import AuthorizedHttp
+    from googleapiclient.discovery import build
+    with _lock:
+        if _drive_credentials is None:
+            _drive_credentials, _ = google.auth.default(scopes=DRIVE_SCOPES)
+        creds = _drive_credentials
+    http = AuthorizedHttp(creds, http=httplib2.Http(timeout=DRIVE_TIMEOUT))
+    service = build("drive", "v3", http=http, cache_discovery=False)
+    _drive_local.service = service
+    return service
+
+
+def loaded() -> Dict[str, bool]:
+    """Qué servicios ya se construyeron (diagnóstico de arranque en frío)."""
+    with _lock:
+        status = {f"vector_store:{name}": s.loaded for (name, _), s in _stores.items()}
+        status.update({f"qdrant:{url}": True for (url, _) in _qdrant_clients})
+        status.update({f"llm:{name}": True for name in _models})
+        status["drive"] = _drive_credentials is not None
+        return status
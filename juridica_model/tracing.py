@@ -0,0 +1,296 @@
+# tracing.py
+# Spans de latencia por etapa (embedding, búsqueda, contexto, generación,
+# extracción del PDF, calificación de precedentes, reporte).
+#   - Cada turno del chat o análisis es una traza: el span raíz y sus hijos
+#     (también los que corren en otros hilos, vía `wrap`).
+#   - Al cerrarse la raíz, la traza se exporta en formato OTLP/JSON de
+#     OpenTelemetry: a un archivo (TRACE_FILE, una traza por línea) y/o a un
+#     colector (TRACE_OTLP_ENDPOINT, p. ej. http://localhost:4318/v1/traces).
+#   - Por nombre de span se acumulan percentiles p50/p95/p99 (STATS).
+# Sin TRACE_FILE ni TRACE_OTLP_ENDPOINT solo se calculan los percentiles.
+from __future__ import annotations
+import os
+import json
+import math
+import time
+import queue
+import threading
+import functools
+import contextvars
+import urllib.request
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, TypeVar
+
+TRACE_FILE = os.getenv("TRACE_FILE")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT")
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "juridica-rag")
+# Duraciones recientes que se guardan por span para los percentiles
+HISTOGRAM_SIZE = int(os.getenv("TRACE_HISTOGRAM_SIZE", 2048))
+
+T = TypeVar("T")
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str] = None
+    start_ns: int = 0
+    end_ns: int = 0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+def _new_id(nbytes: int) -> str:
+    return os.urandom(nbytes).hex()
+
+
+# ── Percentiles ──────────────────────────────────
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Percentil por rango más cercano sobre valores ya ordenados."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class LatencyStats:
+    """Duraciones recientes (ms) por nombre de span, para p50/p95/p99."""
+
+    def __init__(self, size: int = HISTOGRAM_SIZE):
+        self.size = size
+        self._samples: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, int] = {}
+        self._errors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, ms: float, error: bool = False) -> None:
+        with self._lock:
+            self._samples.setdefault(name, deque(maxlen=self.size)).append(ms)
+            self._counts[name] = self._counts.get(name, 0) + 1
+            if error:
+                self._errors[name] = self._errors.get(name, 0) + 1
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            samples = {name: sorted(values) for name, values in self._samples.items()}
+            counts, errors = dict(self._counts), dict(self._errors)
+        return {
+            name: {
+                "count": counts[name],
+                "errors": errors.get(name, 0),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "p99": percentile(values, 99),
+                "max": values[-1],
+            }
+            for name, values in samples.items()
+        }
+
+    def format(self) -> str:
+        rows = sorted(self.summary().items(), key=lambda kv: kv[1]["p95"], reverse=True)
+        lines = [f"{'span':<28}{'n':>7}{'p50':>10}{'p95':>10}{'p99':>10}"]
+        for name, s in rows:
+            lines.append(f"{name:<28}{s['count']:>7}{s['p50']:>10.1f}{s['p95']:>10.1f}{s['p99']:>10.1f}")
+        return "\n".join(lines)
+
+
+STATS = LatencyStats()
+
+
+# ── Exportación OTLP/JSON ────────────────────────
+def _attr_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(spans: List[Span]) -> Dict[str, Any]:
+    """Traza en el formato JSON de OTLP (ExportTraceServiceRequest)."""
+    otlp_spans = []
+    for s in spans:
+        item = {
+            "traceId": s.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns),
+            "attributes": [{"key": k, "value": _attr_value(v)} for k, v in s.attributes.items()],
+            "status": {"code": 2, "message": s.error} if s.error else {"code": 0},
+        }
+        if s.parent_id:
+            item["parentSpanId"] = s.parent_id
+        otlp_spans.append(item)
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": "juridica_model"}, "spans": otlp_spans}],
+    }]}
+
+
+class FileExporter:
+    """Una traza OTLP/JSON por línea."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[Span]) -> None:
+        line = json.dumps(to_otlp(spans), ensure_ascii=False)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class OTLPHttpExporter:
+    """POST de OTLP/JSON a un colector, desde un hilo de fondo (nunca bloquea la consulta)."""
+
+    def __init__(self, endpoint: str, timeout: float = 5.0, max_queue: int = 1000):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self._queue: "queue.Queue[List[Span]]" = queue.Queue(maxsize=max_queue)
+        self._warned = False
+        threading.Thread(target=self._run, name="otlp-export", daemon=True).start()
+
+    def export(self, spans: List[Span]) -> None:
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            pass  # colector caído o lento: se descartan trazas, no se frena el servicio
+
+    def _run(self) -> None:
+        while True:
+            spans = self._queue.get()
+            body = json.dumps(to_otlp(spans)).encode("utf-8")
+            request = urllib.request.Request(self.endpoint, data=body,
+                                             headers={"Content-Type": "application/json"})
+            try:
+                urllib.request.urlopen(request, timeout=self.timeout).close()
+            except Exception as e:
+                if not self._warned:
+                    print(f"⚠️ No se pudieron exportar trazas a {self.endpoint}: {e}")
+                    self._warned = True
+
+
+# ── Tracer ───────────────────────────────────────
+class Tracer:
+    def __init__(self, exporters: Optional[List[Any]] = None, stats: LatencyStats = STATS):
+        self.exporters = exporters or []
+        self.stats = stats
+        # Funciones llamadas con cada span cerrado (p. ej. histogramas de metrics.py)
+        self.listeners: List[Callable[[Span], None]] = []
+        self._traces: Dict[str, List[Span]] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        """Mide el bloque como hijo del span activo (o como raíz de una traza nueva)."""
+        parent = _current.get()
+        s = Span(name, parent.trace_id if parent else _new_id(16), _new_id(8),
+                 parent.span_id if parent else None, attributes=dict(attributes))
+        token = _current.set(s)
+        s.start_ns = time.time_ns()
+        t0 = time.perf_counter_ns()
+        try:
+            yield s
+        except BaseException as e:
+            s.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            s.end_ns = s.start_ns + (time.perf_counter_ns() - t0)
+            _current.reset(token)
+            self._finish(s)
+
+    def _finish(self, s: Span) -> None:
+        self.stats.record(s.name, s.duration_ms, error=s.error is not None)
+        for listener in self.listeners:
+            try:
+                listener(s)
+            except Exception as e:
+                print(f"⚠️ Error en listener de trazas: {e}")
+        if not self.exporters:
+            return
+        with self._lock:
+            spans = self._traces.setdefault(s.trace_id, [])
+            spans.append(s)
+            if s.parent_id is not None:
+                return
+            del self._traces[s.trace_id]
+        for exporter in self.exporters:
+            try:
+                exporter.export(spans)
+            except Exception as e:
+                print(f"⚠️ Error exportando traza: {e}")
+
+
+def _default_exporters() -> List[Any]:
+    exporters: List[Any] = []
+    if TRACE_FILE:
+        exporters.append(FileExporter(TRACE_FILE))
+    if TRACE_OTLP_ENDPOINT:
+        exporters.append(OTLPHttpExporter(TRACE_OTLP_ENDPOINT))
+    return exporters
+
+
+TRACER = Tracer(_default_exporters())
+
+
+def span(name: str, **attributes: Any):
+    """`with span("chat.search", k=10) as s: ...` con el tracer del proceso."""
+    return TRACER.span(name, **attributes)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def wrap(fn: Callable[..., T]) -> Callable[..., T]:
+    """Ejecuta `fn` con el contexto actual (para ThreadPoolExecutor: hijos de la traza)."""
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.copy().run(fn, *args, **kwargs)
+
+
+def traced(name: str):
+    """Decorador: cada llamada a la función es un span `name`."""
+    def decorator(fn: Callable[..., T]) -> Callable[..., T]:
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return inner
+    return decorator
+
+
+def summarize_file(path: str) -> LatencyStats:
+    """Percentiles por span a partir de un archivo exportado con TRACE_FILE."""
+    stats = LatencyStats(size=10 ** 6)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            for rs in json.loads(line).get("resourceSpans", []):
+                for ss in rs.get("scopeSpans", []):
+                    for s in ss.get("spans", []):
+                        ms = (int(s["endTimeUnixNano"]) - int(s["startTimeUnixNano"])) / 1e6
+                        stats.record(s["name"], ms, error=s.get("status", {}).get("code") == 2)
+    return stats
+
+
+if __name__ == "__main__":
+    # python tracing.py traces.jsonl → tabla p50/p95/p99 por etapa
+    import sys
+    print(summarize_file(sys.argv[1] if len(sys.argv) > 1 else (TRACE_FILE or "traces.jsonl")).format())
@@ -0,0 +1,234 @@
+# usage_store.py
+# Contador de consultas diarias por código de acceso.
+# Reemplaza daily_usage.json (que se leía y reescribía completo en cada
+# consulta, sin bloqueo): los incrementos son atómicos en el backend y la
+# verificación por consulta se responde desde memoria.
+#   - SQLiteUsageBackend: archivo compartido por todos los workers (WAL)
+#   - RedisUsageBackend: opcional, si USAGE_BACKEND=redis y `redis` está instalado
+#   - MemoryUsageBackend: un solo proceso (pruebas / desarrollo)
+from __future__ import annotations
+import os
+import time
+import atexit
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from metrics import CACHE
+
+USAGE_BACKEND = (os.getenv("USAGE_BACKEND") or "sqlite").strip().lower()
+USAGE_DB = os.getenv("USAGE_DB", "daily_usage.db")
+USAGE_REDIS_URL = os.getenv("USAGE_REDIS_URL", "redis://localhost:6379/0")
+
+
+def _today() -> str:
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+# ── Backends ─────────────────────────────────────
+class UsageBackend(ABC):
+    """Contadores por (día, código). `incr` es atómico entre procesos."""
+
+    @abstractmethod
+    def incr(self, day: str, code: str, amount: int = 1, limit: Optional[int] = None) -> Optional[int]:
+        """Suma `amount` y devuelve el nuevo total; None si superaría `limit` (no suma)."""
+
+    @abstractmethod
+    def get(self, day: str, code: str) -> int:
+        """Total de `code` en `day` (0 si no hay consultas)."""
+
+    def expire_before(self, day: str) -> None:
+        """Descarta los contadores de días anteriores a `day`."""
+
+
+class MemoryUsageBackend(UsageBackend):
+    def __init__(self):
+        self._counts: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def incr(self, day, code, amount=1, limit=None):
+        with self._lock:
+            value = self._counts.get((day, code), 0) + amount
+            if limit is not None and value > limit:
+                return None
+            self._counts[(day, code)] = value
+            return value
+
+    def get(self, day, code):
+        with self._lock:
+            return self._counts.get((day, code), 0)
+
+    def expire_before(self, day):
+        with self._lock:
+            self._counts = {k: v for k, v in self._counts.items() if k[0] >= day}
+
+
+class SQLiteUsageBackend(UsageBackend):
+    """Una fila por (día, código); el límite se verifica dentro del mismo UPSERT."""
+
+    def __init__(self, path: str | Path = USAGE_DB):
+        self.path = Path(path)
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS usage ("
+                " day TEXT NOT NULL, code TEXT NOT NULL, count INTEGER NOT NULL,"
+                " PRIMARY KEY (day, code))"
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def incr(self, day, code, amount=1, limit=None):
+        conn = self._conn()
+        with conn:
+            if limit is not None and amount > limit:
+                return None
+            cur = conn.execute(
+                """
+                INSERT INTO usage (day, code, count) VALUES (?1, ?2, ?3)
+                ON CONFLICT(day, code) DO UPDATE SET count = count + excluded.count
+                WHERE ?4 IS NULL OR count + excluded.count <= ?4
+                """,
+                (day, code, amount, limit),
+            )
+            if cur.rowcount == 0:
+                return None
+            return conn.execute("SELECT count FROM usage WHERE day = ? AND code = ?",
+                                (day, code)).fetchone()[0]
+
+    def get(self, day, code):
+        row = self._conn().execute("SELECT count FROM usage WHERE day = ? AND code = ?",
+                                   (day, code)).fetchone()
+        return row[0] if row else 0
+
+    def expire_before(self, day):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM usage WHERE day < ?", (day,))
+
+
+class RedisUsageBackend(UsageBackend):
+    """Claves usage:<día>:<código> con expiración al cierre del día siguiente."""
+
+    _INCR_LIMITED = """
+    local v = tonumber(redis.call('GET', KEYS[1]) or '0') + tonumber(ARGV[1])
+    if ARGV[2] ~= '' and v > tonumber(ARGV[2]) then return -1 end
+    redis.call('INCRBY', KEYS[1], ARGV[1])
+    redis.call('EXPIREAT', KEYS[1], ARGV[3])
+    return v
+    """
+
+    def __init__(self, url: str = USAGE_REDIS_URL):
+        import redis  # dependencia opcional
+        self._redis = redis.Redis.from_url(url)
+        self._incr = self._redis.register_script(self._INCR_LIMITED)
+
+    @staticmethod
+    def _key(day: str, code: str) -> str:
+        return f"usage:{day}:{code}"
+
+    def incr(self, day, code, amount=1, limit=None):
+        expire_at = datetime.strptime(day, "%Y-%m-%d") + timedelta(days=2)
+        value = self._incr(keys=[self._key(day, code)],
+                           args=[amount, "" if limit is None else limit, int(expire_at.timestamp())])
+        return None if value == -1 else int(value)
+
+    def get(self, day, code):
+        return int(self._redis.get(self._key(day, code)) or 0)
+
+
+def get_usage_backend(kind: str = USAGE_BACKEND) -> UsageBackend:
+    if kind == "memory":
+        return MemoryUsageBackend()
+    if kind == "redis":
+        try:
+            return RedisUsageBackend()
+        except ImportError:
+            print("⚠️ USAGE_BACKEND=redis pero el paquete `redis` no está instalado; uso SQLite")
+    return SQLiteUsageBackend()
+
+
+# ── Contador con caché ───────────────────────────
+class UsageCounter:
+    """
+    Caché en memoria sobre un UsageBackend.
+
+    - `peek` (verificación por consulta) responde desde memoria; solo lee el
+      backend la primera vez que ve un código en el día.
+    - `consume` con límite reserva la consulta con un incremento atómico en
+      el backend, así dos workers no pueden pasarse del límite.
+    - `consume` sin límite (código ilimitado) se acumula en memoria y se
+      escribe al backend cada `flush_interval` segundos (write-behind).
+    - Al cambiar el día se vacía la caché y se expiran los contadores viejos.
+    """
+
+    def __init__(self, backend: Optional[UsageBackend] = None, flush_interval: float = 30.0):
+        self.backend = backend or get_usage_backend()
+        self.flush_interval = flush_interval
+        self._day = _today()
+        self._cache: Dict[str, int] = {}
+        self._pending: Dict[str, int] = {}
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def _roll_day(self) -> str:
+        today = _today()
+        if today != self._day:
+            self.flush()
+            with self._lock:
+                self._day, self._cache = today, {}
+            self.backend.expire_before(today)
+        return today
+
+    def peek(self, code: str, track: bool = True) -> int:
+        """Total del día de `code`; `track=False` no cuenta el acceso en las métricas de caché."""
+        day = self._roll_day()
+        with self._lock:
+            if code in self._cache:
+                if track:
+                    CACHE.inc(cache="usage", result="hit")
+                return self._cache[code] + self._pending.get(code, 0)
+        if track:
+            CACHE.inc(cache="usage", result="miss")
+        value = self.backend.get(day, code)
+        with self._lock:
+            self._cache.setdefault(code, value)
+            return self._cache[code] + self._pending.get(code, 0)
+
+    def consume(self, code: str, limit: Optional[int] = None) -> Optional[int]:
+        """Registra una consulta; devuelve el total del día o None si se alcanzó `limit`."""
+        day = self._roll_day()
+        if limit is None:
+            with self._lock:
+                self._pending[code] = self._pending.get(code, 0) + 1
+                total = self._cache.get(code, 0) + self._pending[code]
+                due = time.monotonic() - self._last_flush >= self.flush_interval
+            if due:
+                self.flush()
+            return total
+        value = self.backend.incr(day, code, 1, limit)
+        with self._lock:
+            # si otro worker llegó al límite, la caché queda en el límite
+            self._cache[code] = limit if value is None else value
+        return value
+
+    def flush(self) -> None:
+        """Escribe al backend los incrementos acumulados sin límite."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+            day = self._day
+        for code, amount in pending.items():
+            value = self.backend.incr(day, code, amount)
+            with self._lock:
+                self._cache[code] = value
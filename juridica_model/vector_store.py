@@ -0,0 +1,395 @@
+# vector_store.py
+# Interfaz común de almacén vectorial con dos implementaciones:
+#   - QdrantVectorStore: Qdrant Cloud (producción)
+#   - LocalVectorStore: matriz NumPy mapeada en disco, búsqueda exacta o HNSW
+#     (hnswlib opcional), para pruebas locales y benchmarks sin red.
+# VECTOR_BACKEND=qdrant|local selecciona la implementación en get_vector_store().
+from __future__ import annotations
+import os
+import json
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Union
+
+import numpy as np
+
+try:
+    import hnswlib  # opcional: índice aproximado para LocalVectorStore
+except ImportError:
+    hnswlib = None
+
+# Dimensión de models/embedding-001 (la misma que collection_config.VECTOR_SIZE;
+# se repite aquí para que el backend local no requiera qdrant_client)
+VECTOR_SIZE = 768
+
+# with_payload: True (todo), False (nada) o los campos a devolver, con rutas
+# anidadas como en Qdrant ("document", "metadata.source")
+PayloadSelector = Union[bool, Sequence[str]]
+
+
+def project_payload(payload: Dict[str, Any], fields: PayloadSelector) -> Dict[str, Any]:
+    """Subconjunto de `payload` con los campos pedidos (misma semántica que Qdrant)."""
+    if fields is True:
+        return payload
+    if not fields:
+        return {}
+    out: Dict[str, Any] = {}
+    for path in fields:
+        keys = path.split(".")
+        src = payload
+        for key in keys:
+            if not isinstance(src, dict) or key not in src:
+                break
+            src = src[key]
+        else:
+            dst = out
+            for key in keys[:-1]:
+                dst = dst.setdefault(key, {})
+            dst[keys[-1]] = src
+    return out
+
+
+@dataclass
+class SearchHit:
+    """Resultado de búsqueda, con la misma forma que `ScoredPoint` de Qdrant."""
+    id: Any
+    score: float
+    payload: Dict[str, Any] = field(default_factory=dict)
+
+
+class VectorStore(ABC):
+    """Operaciones que usa el sistema RAG sobre una colección de vectores."""
+
+    collection_name: str
+
+    @abstractmethod
+    def ensure_collection(self) -> bool:
+        """Crea la colección si falta. Devuelve True si ya existía."""
+
+    @abstractmethod
+    def count(self) -> int:
+        ...
+
+    @abstractmethod
+    def upsert(self, ids: Sequence[Any], vectors: Sequence[Sequence[float]],
+               payloads: Sequence[Dict[str, Any]]) -> None:
+        ...
+
+    @abstractmethod
+    def search(self, vector: Sequence[float], limit: int = 10,
+               with_payload: PayloadSelector = True) -> List[SearchHit]:
+        ...
+
+    def search_batch(self, vectors: Sequence[Sequence[float]], limit: int = 10,
+                     with_payload: PayloadSelector = True) -> List[List[SearchHit]]:
+        return [self.search(v, limit=limit, with_payload=with_payload) for v in vectors]
+
+    @abstractmethod
+    def scroll_payloads(self, batch_size: int = 1000,
+                        fields: Optional[Sequence[str]] = None) -> Iterator[Dict[str, Any]]:
+        """Itera los payloads de la colección (solo `fields`, si se indican)."""
+
+
+# ── Qdrant ───────────────────────────────────────
+def _selector(with_payload: PayloadSelector):
+    """with_payload para qdrant_client: bool o lista de rutas (proyección en el servidor)."""
+    return with_payload if isinstance(with_payload, bool) else list(with_payload)
+
+
+class QdrantVectorStore(VectorStore):
+    def __init__(self, client, collection_name: str, settings=None):
+        from collection_config import CollectionSettings, search_params
+        self.client = client
+        self.collection_name = collection_name
+        self.settings = settings or CollectionSettings.from_env()
+        self._search_params = search_params(self.settings)
+
+    def ensure_collection(self) -> bool:
+        from collection_config import ensure_collection
+        return ensure_collection(self.client, self.collection_name, self.settings)
+
+    def count(self) -> int:
+        return self.client.count(collection_name=self.collection_name, exact=False).count
+
+    def upsert(self, ids, vectors, payloads) -> None:
+        from qdrant_client.models import PointStruct
+        points = [PointStruct(id=i, vector=list(v), payload=p) for i, v, p in zip(ids, vectors, payloads)]
+        self.client.upsert(collection_name=self.collection_name, points=points)
+
+    def search(self, vector, limit=10, with_payload=True) -> List[SearchHit]:
+        results = self.client.query_points(
+            collection_name=self.collection_name,
+            query=list(vector),
+            limit=limit,
+            with_payload=_selector(with_payload),
+            search_params=self._search_params,
+        ).points
+        return [SearchHit(r.id, r.score, r.payload or {}) for r in results]
+
+    def search_batch(self, vectors, limit=10, with_payload=True) -> List[List[SearchHit]]:
+        """Todas las consultas en un solo request (query_batch_points)."""
+        from qdrant_client.models import QueryRequest
+        if not len(vectors):
+            return []
+        requests = [
+            QueryRequest(query=list(v), limit=limit, with_payload=_selector(with_payload),
+                         params=self._search_params)
+            for v in vectors
+        ]
+        responses = self.client.query_batch_points(collection_name=self.collection_name, requests=requests)
+        return [[SearchHit(r.id, r.score, r.payload or {}) for r in resp.points] for resp in responses]
+
+    def scroll_payloads(self, batch_size=1000, fields=None) -> Iterator[Dict[str, Any]]:
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                limit=batch_size,
+                offset=offset,
+                with_payload=_selector(fields or True),
+                with_vectors=False,
+            )
+            for p in points:
+                yield p.payload or {}
+            if offset is None:
+                break
+
+
+# ── Local (NumPy memmap) ─────────────────────────
+class LocalVectorStore(VectorStore):
+    """
+    Almacén embebido en un directorio:
+      vectors.f32     matriz float32 (capacidad x dim) mapeada en memoria, normalizada
+      payloads.jsonl  una línea por upsert: {"row", "id", "payload"}
+    Con index="hnsw" el grafo de hnswlib se reconstruye en memoria al abrir.
+    Un lock protege upsert/_grow (la sincronización escribe en segundo plano
+    mientras el chat y el análisis buscan): las búsquedas toman bajo el lock
+    una instantánea de la matriz y calculan fuera de él.
+    """
+
+    def __init__(self, path: str | Path, collection_name: str = "resoluciones",
+                 dim: int = VECTOR_SIZE, index: str = "brute"):
+        self.collection_name = collection_name
+        self.dir = Path(path) / collection_name
+        self.dim = dim
+        self.index_kind = index
+        if index == "hnsw" and hnswlib is None:
+            print("ℹ️ hnswlib no instalado, LocalVectorStore usa búsqueda exacta")
+            self.index_kind = "brute"
+        self._matrix: Optional[np.memmap] = None
+        self._capacity = 0
+        self._size = 0
+        self._rows: Dict[Any, int] = {}
+        self._ids: List[Any] = []
+        self._payloads: List[Dict[str, Any]] = []
+        self._hnsw = None
+        self._lock = threading.RLock()
+        if self.dir.exists():
+            self._load()
+
+    @property
+    def _vectors_path(self) -> Path:
+        return self.dir / "vectors.f32"
+
+    @property
+    def _payloads_path(self) -> Path:
+        return self.dir / "payloads.jsonl"
+
+    def _load(self) -> None:
+        if self._payloads_path.exists():
+            with self._payloads_path.open("r", encoding="utf-8") as f:
+                for line in f:
+                    rec = json.loads(line)
+                    row = rec["row"]
+                    if row >= len(self._ids):
+                        self._ids.extend([None] * (row + 1 - len(self._ids)))
+                        self._payloads.extend([{}] * (row + 1 - len(self._payloads)))
+                    self._ids[row] = rec["id"]
+                    self._payloads[row] = rec["payload"]
+                    self._rows[rec["id"]] = row
+        self._size = len(self._ids)
+        if self._vectors_path.exists():
+            self._capacity = self._vectors_path.stat().st_size // (4 * self.dim)
+            if self._capacity:
+                self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r+",
+                                         shape=(self._capacity, self.dim))
+        if self.index_kind == "hnsw":
+            self._build_hnsw()
+
+    def _grow(self, needed: int) -> None:
+        # con self._lock tomado (upsert)
+        if needed <= self._capacity:
+            return
+        new_cap = max(needed, self._capacity * 2, 1024)
+        if self._matrix is not None:
+            self._matrix.flush()
+            del self._matrix
+        with self._vectors_path.open("ab") as f:
+            f.truncate(new_cap * self.dim * 4)
+        self._capacity = new_cap
+        self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r+",
+                                 shape=(self._capacity, self.dim))
+
+    def _build_hnsw(self) -> None:
+        self._hnsw = hnswlib.Index(space="ip", dim=self.dim)
+        self._hnsw.init_index(max_elements=max(self._capacity, 1024), ef_construction=100, M=16)
+        if self._size:
+            self._hnsw.add_items(np.asarray(self._matrix[:self._size]), np.arange(self._size))
+
+    def ensure_collection(self) -> bool:
+        existed = self.dir.exists()
+        self.dir.mkdir(parents=True, exist_ok=True)
+        return existed
+
+    def count(self) -> int:
+        return self._size
+
+    def upsert(self, ids, vectors, payloads) -> None:
+        self.ensure_collection()
+        mat = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        norms = np.linalg.norm(mat, axis=1, keepdims=True)
+        mat = mat / np.where(norms == 0, 1.0, norms)
+
+        with self._lock:
+            rows = []
+            for pid in ids:
+                row = self._rows.get(pid)
+                if row is None:
+                    row = self._size
+                    self._size += 1
+                    self._rows[pid] = row
+                    self._ids.append(pid)
+                    self._payloads.append({})
+                rows.append(row)
+            self._grow(self._size)
+            self._matrix[rows] = mat
+            self._matrix.flush()
+
+            with self._payloads_path.open("a", encoding="utf-8") as f:
+                for pid, row, payload in zip(ids, rows, payloads):
+                    self._payloads[row] = payload
+                    f.write(json.dumps({"row": row, "id": pid, "payload": payload}, ensure_ascii=False) + "\n")
+
+            if self.index_kind == "hnsw" and self._hnsw is None:
+                self._build_hnsw()
+            elif self._hnsw is not None:
+                if self._hnsw.get_max_elements() < self._size:
+                    self._hnsw.resize_index(self._capacity)
+                self._hnsw.add_items(mat, np.asarray(rows))
+
+    def search(self, vector, limit=10, with_payload=True) -> List[SearchHit]:
+        return self.search_batch([vector], limit=limit, with_payload=with_payload)[0]
+
+    def search_batch(self, vectors, limit=10, with_payload=True) -> List[List[SearchHit]]:
+        """Todas las consultas en una sola multiplicación de matrices (o knn_query en lote)."""
+        if not self._size or not len(vectors):
+            return [[] for _ in vectors]
+        q = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+        norms = np.linalg.norm(q, axis=1, keepdims=True)
+        q = q / np.where(norms == 0, 1.0, norms)
+
+        with self._lock:
+            size, matrix, ids, payloads = self._size, self._matrix, self._ids, self._payloads
+            limit = min(limit, size)
+            use_hnsw = self._hnsw is not None
+            if use_hnsw:
+                # hnswlib no admite knn_query mientras se agregan o redimensionan nodos
+                self._hnsw.set_ef(max(limit * 2, 64))
+                labels, dists = self._hnsw.knn_query(q, k=limit)
+                rows, scores = labels.tolist(), (1.0 - dists).tolist()
+
+        if not use_hnsw:
+            # `matrix` sigue abierta aunque _grow la reemplace; las filas < size ya están escritas
+            sims = q @ np.asarray(matrix[:size]).T
+            top = np.argpartition(-sims, limit - 1, axis=1)[:, :limit]
+            order = np.argsort(-np.take_along_axis(sims, top, axis=1), axis=1)
+            top = np.take_along_axis(top, order, axis=1)
+            rows, scores = top.tolist(), np.take_along_axis(sims, top, axis=1).tolist()
+
+        return [
+            [SearchHit(ids[r], float(s), project_payload(payloads[r], with_payload))
+             for r, s in zip(row, score)]
+            for row, score in zip(rows, scores)
+        ]
+
+    def scroll_payloads(self, batch_size=1000, fields=None) -> Iterator[Dict[str, Any]]:
+        with self._lock:
+            payloads = self._payloads[:self._size]
+        for payload in payloads:
+            yield project_payload(payload, fields or True)
+
+
+# ── Construcción diferida ────────────────────────
+class LazyVectorStore(VectorStore):
+    """
+    Crea el almacén real (y su cliente) en la primera operación.
+    Importar el módulo que lo declara no carga qdrant_client ni abre conexiones.
+    """
+
+    def __init__(self, factory: Callable[[], VectorStore], collection_name: str = "resoluciones"):
+        self._factory = factory
+        self._store: Optional[VectorStore] = None
+        self._lock = threading.Lock()
+        self.collection_name = collection_name
+
+    @property
+    def store(self) -> VectorStore:
+        if self._store is None:
+            with self._lock:
+                if self._store is None:
+                    self._store = self._factory()
+        return self._store
+
+    @property
+    def loaded(self) -> bool:
+        return self._store is not None
+
+    def ensure_collection(self) -> bool:
+        return self.store.ensure_collection()
+
+    def count(self) -> int:
+        return self.store.count()
+
+    def upsert(self, ids, vectors, payloads) -> None:
+        self.store.upsert(ids, vectors, payloads)
+
+    def search(self, vector, limit=10, with_payload=True) -> List[SearchHit]:
+        return self.store.search(vector, limit=limit, with_payload=with_payload)
+
+    def search_batch(self, vectors, limit=10, with_payload=True) -> List[List[SearchHit]]:
+        return self.store.search_batch(vectors, limit=limit, with_payload=with_payload)
+
+    def scroll_payloads(self, batch_size=1000, fields=None) -> Iterator[Dict[str, Any]]:
+        return self.store.scroll_payloads(batch_size, fields)
+
+
+# ── Fábrica ──────────────────────────────────────
+def get_vector_store(collection_name: str = "resoluciones", *,
+                     qdrant_url: Optional[str] = None,
+                     qdrant_api_key: Optional[str] = None,
+                     client_factory: Optional[Callable[[str, Optional[str]], Any]] = None) -> VectorStore:
+    """
+    Construye el almacén según VECTOR_BACKEND (qdrant por defecto).
+    `client_factory(url, api_key)` permite reutilizar un cliente de Qdrant
+    compartido (services.qdrant_client); si no se pasa, se crea uno nuevo.
+    """
+    backend = (os.getenv("VECTOR_BACKEND") or "qdrant").strip().lower()
+    if backend == "local":
+        return LocalVectorStore(
+            os.getenv("LOCAL_VECTOR_DIR", "vector_index"),
+            collection_name=collection_name,
+            index=(os.getenv("LOCAL_VECTOR_INDEX") or "brute").strip().lower(),
+        )
+    if backend != "qdrant":
+        raise ValueError(f"❌ VECTOR_BACKEND no soportado: {backend}")
+
+    url = qdrant_url or os.getenv("QDRANT_URL")
+    api_key = qdrant_api_key or os.getenv("QDRANT_API_KEY")
+    if not url:
+        raise ValueError("❌ QDRANT_URL no está configurada en las variables de entorno")
+    if client_factory is not None:
+        return QdrantVectorStore(client_factory(url, api_key), collection_name)
+    from qdrant_client import QdrantClient
+    return QdrantVectorStore(QdrantClient(url=url, api_key=api_key), collection_name)